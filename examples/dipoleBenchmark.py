@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+# This file is part of ip_diffim.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from lsst.ip.diffim.dipoleBenchmark import DipoleBenchmarkTask, writeBenchmarkResults
+
+
+def run(args):
+    config = DipoleBenchmarkTask.ConfigClass()
+    config.imageSize = args.imageSize
+    config.sourceDensity = args.density
+    config.separation = args.separation
+    config.signalToNoise = args.snr
+    config.footprintGrow = args.grow
+    config.numRepeats = args.repeats
+    if args.algorithms:
+        config.algorithms = args.algorithms
+    config.dipoleFit.numThreads = args.numThreads
+
+    task = DipoleBenchmarkTask(config=config)
+    results = task.run().results
+    writeBenchmarkResults(results, args.output)
+    for name, timing in sorted(results["timings"].items()):
+        print("%-20s %10.4f s/catalog %10.6f s/source" % (name, timing["catalogTime"]["min"],
+                                                          timing["sourceTime"]["median"]))
+    print("Wrote %s" % (args.output,))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Time the dipole measurement algorithms on a simulated difference image")
+
+    parser.add_argument("--output", "-o", default="dipoleBenchmark.json", help="Output JSON file")
+    parser.add_argument("--imageSize", type=int, default=512, help="Image width and height (pixels)")
+    parser.add_argument("--density", type=float, default=1., help="Dipoles per 100x100 pixels")
+    parser.add_argument("--separation", type=float, default=2., help="Lobe separation (PSF sigma)")
+    parser.add_argument("--snr", type=float, default=50., help="Signal-to-noise ratio of each lobe")
+    parser.add_argument("--grow", type=int, default=3, help="Footprint grow before merging (pixels)")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of runs of each algorithm")
+    parser.add_argument("--numThreads", type=int, default=1, help="Threads used by DipoleFitTask")
+    parser.add_argument("--algorithms", nargs="+", default=None,
+                        help="Algorithms to time (default: all)")
+
+    run(parser.parse_args())
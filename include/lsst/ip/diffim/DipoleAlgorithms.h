@@ -34,6 +34,8 @@
 #include <stdlib.h>
 #include <unistd.h>
 #include <array>
+#include <string>
+#include <vector>
 
 #include "lsst/base.h"
 #include "lsst/pex/config.h"
@@ -44,6 +46,7 @@
 #include "lsst/meas/base/CentroidUtilities.h"
 #include "lsst/meas/base/FlagHandler.h"
 #include "lsst/meas/base/InputUtilities.h"
+#include "lsst/ip/diffim/PsfImageCache.h"
 
 namespace lsst {
 namespace ip {
@@ -70,8 +73,24 @@ public:
     LSST_CONTROL_FIELD(stepSizeFlux, float, "Default initial step size for flux in non-linear fitter");
     LSST_CONTROL_FIELD(errorDef, double, "How many sigma the error bars of the non-linear fitter represent");
     LSST_CONTROL_FIELD(maxFnCalls, int, "Maximum function calls for non-linear fitter; 0 = unlimited");
+    LSST_CONTROL_FIELD(psfOversampling, int,
+                       "If > 0, compute the Psf images once per source at this number of sub-pixel offsets "
+                       "per pixel around the initial peaks, and interpolate them as the fit moves the lobes; "
+                       "if 0, compute the Psf images at every evaluation of the fit");
+    LSST_CONTROL_FIELD(usePsfImageCache, bool,
+                       "Get the Psf images computed at every evaluation of the fit (if psfOversampling is 0) "
+                       "from the PsfImageCache shared by the dipole algorithms; the image at the nearest "
+                       "grid position is shifted to the exact position to first order");
+    LSST_CONTROL_FIELD(psfImageCacheSubpixelGrid, int,
+                       "Number of grid steps per pixel of the positions of the shared PsfImageCache, "
+                       "if usePsfImageCache; changing it clears the cache");
+    LSST_CONTROL_FIELD(badMaskPlanes, std::vector<std::string>,
+                       "Mask planes of the pixels excluded from the fit; only the pixels of the footprint "
+                       "are included");
     PsfDipoleFluxControl() : DipoleFluxControl(),
-                             stepSizeCoord(0.1), stepSizeFlux(1.0), errorDef(1.0), maxFnCalls(100000) {}
+                             stepSizeCoord(0.1), stepSizeFlux(1.0), errorDef(1.0), maxFnCalls(100000),
+                             psfOversampling(0), usePsfImageCache(false), psfImageCacheSubpixelGrid(100),
+                             badMaskPlanes({"BAD", "SAT", "NO_DATA"}) {}
 };
 
 /**
@@ -303,6 +322,9 @@ public:
         _posCentroid = meas::base::CentroidResultKey(schema[name+"_pos_centroid"]);
         _negCentroid = meas::base::CentroidResultKey(schema[name+"_neg_centroid"]);
         _avgCentroid = meas::base::CentroidResultKey(schema[name+"_centroid"]);
+        if (_ctrl.usePsfImageCache) {
+            PsfImageCache::getInstance().setSubpixelGrid(_ctrl.psfImageCacheSubpixelGrid);
+        }
     }
     std::pair<double,int> chi2(afw::table::SourceRecord & source,
                 afw::image::Exposure<float> const & exposure,
@@ -315,6 +337,24 @@ public:
         afw::image::Exposure<float> const & exposure
     ) const;
 
+    /// Parameters of the fit of one source, as written to its record by measure
+    struct FitResult;
+
+    /**
+     *  @brief Measure all sources of a catalog, fitting up to numThreads sources concurrently.
+     *
+     *  Each thread fits with its own copy of the exposure's Psf; the results are written to the
+     *  catalog, and failures flagged, once all the fits are done.
+     *
+     *  This is not called by the measurement framework, which measures one record at a time with
+     *  the other sources replaced by noise; it is an entry point for callers fitting whole catalogs.
+     */
+    void measureAll(
+        afw::table::SourceCatalog & measCat,
+        afw::image::Exposure<float> const & exposure,
+        int numThreads=1
+    ) const;
+
     void fail(
         afw::table::SourceRecord & measRecord,
         meas::base::MeasurementError * error=NULL
@@ -322,6 +362,8 @@ public:
 
 private:
 
+    void _recordFit(afw::table::SourceRecord & source, FitResult const & fit) const;
+
     Control _ctrl;
     afw::table::Key<float> _chi2dofKey;
     meas::base::CentroidResultKey  _avgCentroid;
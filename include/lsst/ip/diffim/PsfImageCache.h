@@ -0,0 +1,136 @@
+// -*- LSST-C++ -*-
+
+/*
+ * LSST Data Management System
+ * Copyright 2008-2015 AURA/LSST
+ *
+ * This product includes software developed by the
+ * LSST Project (http://www.lsst.org/).
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the LSST License Statement and
+ * the GNU General Public License along with this program.  If not,
+ * see <http://www.lsstcorp.org/LegalNotices/>.
+ */
+
+/**
+ * @file PsfImageCache.h
+ *
+ * @brief Cache of Psf images shared by the dipole measurement algorithms
+ *
+ * @ingroup ip_diffim
+ */
+
+#ifndef LSST_IP_DIFFIM_PSFIMAGECACHE_H
+#define LSST_IP_DIFFIM_PSFIMAGECACHE_H
+
+#include <cstddef>
+#include <list>
+#include <memory>
+#include <mutex>
+#include <unordered_map>
+
+#include "lsst/geom.h"
+#include "lsst/afw/detection/Psf.h"
+
+namespace lsst {
+namespace ip {
+namespace diffim {
+
+    /**
+     * @brief Least-recently-used cache of Psf images
+     *
+     * @note Images are keyed on the identity of the Psf and on the position, rounded to a grid of
+     * 1/subpixelGrid pixels; the image returned is that of the Psf at the rounded position.  The
+     * images are shared between callers and must not be modified.  All methods are thread-safe.
+     *
+     * @ingroup ip_diffim
+     */
+    class PsfImageCache {
+    public:
+        typedef afw::detection::Psf::Image Image;
+
+        explicit PsfImageCache(std::size_t maxSize=1024, int subpixelGrid=100);
+        virtual ~PsfImageCache() {}
+
+        PsfImageCache(PsfImageCache const&) = delete;
+        PsfImageCache& operator=(PsfImageCache const&) = delete;
+
+        /**
+         * @brief Return the cache shared by all dipole measurement algorithms of this process
+         */
+        static PsfImageCache& getInstance();
+
+        /**
+         * @brief Return the image of psf at position, computing it if it is not in the cache
+         *
+         * @param psf  Psf to evaluate
+         * @param position  Position in the parent image; rounded to the sub-pixel grid
+         */
+        std::shared_ptr<Image> computeImage(std::shared_ptr<afw::detection::Psf const> const& psf,
+                                            geom::Point2D const& position);
+
+        /// Remove all images from the cache; the statistics are kept
+        void clear();
+
+        /// Number of images in the cache
+        std::size_t size() const;
+
+        std::size_t getMaxSize() const;
+        /// Set the maximum number of images, evicting the least recently used ones if necessary
+        void setMaxSize(std::size_t maxSize);
+
+        int getSubpixelGrid() const;
+        /// Set the number of grid steps per pixel positions are rounded to; clears the cache
+        void setSubpixelGrid(int subpixelGrid);
+
+        std::size_t getHits() const;
+        std::size_t getMisses() const;
+        std::size_t getEvictions() const;
+        void resetStatistics();
+
+    private:
+        struct Key {
+            afw::detection::Psf const* psf;
+            long long x;
+            long long y;
+
+            bool operator==(Key const& other) const {
+                return psf == other.psf && x == other.x && y == other.y;
+            }
+        };
+
+        struct KeyHash {
+            std::size_t operator()(Key const& key) const;
+        };
+
+        struct Entry {
+            std::weak_ptr<afw::detection::Psf const> psf;   // detects a new Psf at the same address
+            std::shared_ptr<Image> image;
+            std::list<Key>::iterator position;                // position in _order
+        };
+
+        void _evict();
+
+        mutable std::mutex _mutex;
+        std::size_t _maxSize;
+        int _subpixelGrid;
+        std::size_t _hits;
+        std::size_t _misses;
+        std::size_t _evictions;
+        std::list<Key> _order;                                // most recently used first
+        std::unordered_map<Key, Entry, KeyHash> _entries;
+    };
+
+}}} // end of namespace lsst::ip::diffim
+
+#endif // LSST_IP_DIFFIM_PSFIMAGECACHE_H
@@ -42,6 +42,7 @@ from lsst.meas.base import wrapSimpleAlgorithm
 from .dipoleFitTask import *
 from .imageDecorrelation import *
 from .imageMapReduce import *
+from .clippedStatistics import *
 from .zogy import *
 from .version import *
 
@@ -0,0 +1,335 @@
+# This file is part of ip_diffim.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Sigma-clipped image statistics shared by the decorrelation and ZOGY tasks.
+
+The A&L decorrelation and ZOGY tasks repeatedly compute the
+sigma-clipped mean of the image and variance planes of the same
+science, template and difference exposures. `computeClippedStatistics`
+computes these with a selectable estimator and memoizes the results in
+a process-wide `ClippedStatisticsCache`, so that each plane of an
+exposure is only processed once until its pixels or mask are modified.
+"""
+
+from collections import OrderedDict
+import threading
+import weakref
+
+import numpy as np
+
+import lsst.afw.image as afwImage
+import lsst.afw.math as afwMath
+import lsst.pex.config as pexConfig
+import lsst.pipe.base as pipeBase
+
+__all__ = ["ClippedStatisticsConfig", "ClippedStatisticsCache", "computeClippedStatistics",
+           "getClippedStatisticsCache"]
+
+
+class ClippedStatisticsConfig(pexConfig.Config):
+    """Configuration parameters for `computeClippedStatistics`
+    """
+    method = pexConfig.ChoiceField(
+        dtype=str,
+        doc="""Estimator to use for the sigma-clipped mean""",
+        default="meanclip",
+        allowed={
+            "meanclip": "afw MEANCLIP statistic computed over all unmasked pixels",
+            "sampled": "iterative sigma-clipping of a regularly-strided subsample of the unmasked pixels",
+            "histogram": "iterative sigma-clipping of a histogram of all unmasked pixels",
+        }
+    )
+    numSigmaClip = pexConfig.Field(
+        dtype=float,
+        doc="""Number of standard deviations at which to clip""",
+        default=3.,
+        check=lambda x: x > 0
+    )
+    numIter = pexConfig.Field(
+        dtype=int,
+        doc="""Number of clipping iterations""",
+        default=3,
+        check=lambda x: x > 0
+    )
+    maxSamples = pexConfig.Field(
+        dtype=int,
+        doc="""Maximum number of pixels used by the "sampled" estimator, and to
+        estimate the histogram range and the median for the "histogram" estimator""",
+        default=100000,
+        check=lambda x: x > 0
+    )
+    numHistogramBins = pexConfig.Field(
+        dtype=int,
+        doc="""Number of histogram bins used by the "histogram" estimator""",
+        default=4096,
+        check=lambda x: x > 1
+    )
+    useCache = pexConfig.Field(
+        dtype=bool,
+        doc="""Reuse statistics already computed for the same plane of an unmodified exposure""",
+        default=True
+    )
+
+
+class ClippedStatisticsCache:
+    """Least-recently-used cache of clipped statistics of image planes.
+
+    Entries are keyed on the identity of the object owning the image
+    plane and mask (typically the `lsst.afw.image.Exposure`), the pixel
+    buffers of the plane and mask within it, a checksum of their contents,
+    the mask planes ignored and the estimator configuration, so that
+    modifying the pixels or mask in place (e.g. setting the DETECTED
+    plane) leads to the statistics being recomputed. Entries are dropped
+    when their owner is garbage collected or passed to `invalidate`.
+    The cache may be shared between threads.
+
+    Sub-image views should not be cached: each view is a distinct owner,
+    so they would only evict the entries of the full images.
+
+    Parameters
+    ----------
+    maxSize : `int`, optional
+        Maximum number of entries to keep.
+    """
+
+    def __init__(self, maxSize=64):
+        self.maxSize = maxSize
+        self._entries = OrderedDict()
+        self._owners = {}
+        # Reentrant, as entries are dropped from weakref callbacks that may run
+        # during garbage collection while the lock is held.
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached value for `key`, or `None` if it is absent.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, owner, value):
+        """Store `value` for `key`, evicting the least recently used entry if full.
+
+        Parameters
+        ----------
+        key : `tuple`
+            Key of the entry, starting with ``id(owner)``.
+        owner : `object`
+            Object owning the pixels the statistics were computed from.
+            Nothing is stored if it does not support weak references.
+        value : `object`
+            The value to store.
+        """
+        ownerId = id(owner)
+        with self._lock:
+            if ownerId not in self._owners:
+                try:
+                    self._owners[ownerId] = weakref.ref(owner, lambda ref: self._dropOwner(ownerId, ref))
+                except TypeError:
+                    return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxSize:
+                evictedId = self._entries.popitem(last=False)[0][0]
+                if not any(key[0] == evictedId for key in self._entries):
+                    del self._owners[evictedId]
+
+    def invalidate(self, owner=None):
+        """Drop the entries of an owner whose pixels or mask have changed.
+
+        Parameters
+        ----------
+        owner : `object`, optional
+            The owner passed to `computeClippedStatistics`.
+            All entries are dropped if `None`.
+        """
+        with self._lock:
+            if owner is None:
+                self._entries.clear()
+                return
+            ref = self._owners.get(id(owner))
+            if ref is not None and ref() is owner:
+                self._dropOwner(id(owner), ref)
+
+    def _dropOwner(self, ownerId, ref):
+        """Remove all entries of an owner, unless it has been replaced by a new object.
+        """
+        with self._lock:
+            if self._owners.get(ownerId) is not ref:
+                return
+            del self._owners[ownerId]
+            for key in [key for key in self._entries if key[0] == ownerId]:
+                del self._entries[key]
+
+    def clear(self):
+        """Remove all entries and reset the hit and miss counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_statisticsCache = ClippedStatisticsCache()
+
+
+def getClippedStatisticsCache():
+    """Return the process-wide `ClippedStatisticsCache` used by default.
+    """
+    return _statisticsCache
+
+
+def _bufferKey(array):
+    return (array.__array_interface__['data'][0], array.shape, array.strides, array.dtype.str)
+
+
+def _contentKey(array):
+    """Return a checksum of the values of an array.
+
+    The bit patterns of the values are summed as unsigned integers, which
+    only takes a single pass over the array, much less than computing the
+    statistics. Unlike a floating point sum, it is well defined for NaNs.
+    """
+    unsigned = array.view(np.dtype("u%d" % array.dtype.itemsize))
+    return int(unsigned.sum(dtype=np.uint64))
+
+
+def _clipIteratively(values, numSigmaClip, numIter, weights=None):
+    """Compute a sigma-clipped mean, starting from the median and interquartile range.
+
+    If `weights` is given, `values` are histogram bin centers and `weights` the
+    corresponding counts.
+    """
+    if weights is None:
+        center = np.median(values)
+        q25, q75 = np.percentile(values, [25., 75.])
+    else:
+        cdf = np.cumsum(weights) / np.sum(weights)
+        q25, center, q75 = np.interp([0.25, 0.5, 0.75], cdf, values)
+        weights = weights.astype(float)
+    sigma = 0.741*(q75 - q25)
+    mean = center
+    for _ in range(numIter):
+        good = np.abs(values - center) <= numSigmaClip*sigma
+        if weights is None:
+            if not np.any(good):
+                break
+            mean = np.mean(values[good])
+            sigma = np.std(values[good])
+        else:
+            w = weights*good
+            if np.sum(w) == 0:
+                break
+            mean = np.average(values, weights=w)
+            sigma = np.sqrt(np.average((values - mean)**2, weights=w))
+        center = mean
+    return mean
+
+
+def computeClippedStatistics(image, mask, ignoreMaskPlanes, config=None, cache=None, owner=None):
+    """Compute the sigma-clipped mean and the median of an image plane.
+
+    Parameters
+    ----------
+    image : `lsst.afw.image.Image`
+        The image plane (e.g. the image or variance of a `MaskedImage`).
+    mask : `lsst.afw.image.Mask`
+        The mask corresponding to `image`.
+    ignoreMaskPlanes : `list` of `str`
+        Pixels with any of these mask planes set are excluded.
+    config : `ClippedStatisticsConfig`, optional
+        Estimator configuration; the defaults reproduce a 3-sigma,
+        3-iteration afw MEANCLIP.
+    cache : `ClippedStatisticsCache`, optional
+        Cache to use; defaults to the process-wide cache returned by
+        `getClippedStatisticsCache`. Ignored if ``config.useCache`` is False.
+    owner : `object`, optional
+        The long-lived object holding `image` and `mask`, typically their
+        `lsst.afw.image.Exposure`. The result is cached only if it is set,
+        until ``owner`` is garbage collected or passed to
+        `ClippedStatisticsCache.invalidate`, or ``image`` or ``mask`` are
+        modified. Must not be set for sub-image views.
+
+    Returns
+    -------
+    result : `lsst.pipe.base.Struct`
+        a `lsst.pipe.base.Struct` containing:
+
+        - ``mean`` : the sigma-clipped mean (`float`, NaN if no pixels are usable)
+        - ``median`` : the median of the unmasked pixels (`float`)
+    """
+    if config is None:
+        config = ClippedStatisticsConfig()
+    andMask = afwImage.Mask.getPlaneBitMask(ignoreMaskPlanes)
+    imArr = image.getArray()
+    maskArr = mask.getArray()
+
+    useCache = config.useCache and owner is not None
+    if useCache:
+        cache = _statisticsCache if cache is None else cache
+        key = (id(owner), _bufferKey(imArr), _bufferKey(maskArr), _contentKey(imArr), _contentKey(maskArr),
+               andMask, config.method, config.numSigmaClip, config.numIter, config.maxSamples,
+               config.numHistogramBins)
+        result = cache.get(key)
+        if result is not None:
+            return pipeBase.Struct(mean=result[0], median=result[1])
+
+    if config.method == "meanclip":
+        statsControl = afwMath.StatisticsControl()
+        statsControl.setNumSigmaClip(config.numSigmaClip)
+        statsControl.setNumIter(config.numIter)
+        statsControl.setAndMask(andMask)
+        statObj = afwMath.makeStatistics(image, mask, afwMath.MEANCLIP | afwMath.MEDIAN, statsControl)
+        mean = statObj.getValue(afwMath.MEANCLIP)
+        median = statObj.getValue(afwMath.MEDIAN)
+    else:
+        good = ((maskArr & andMask) == 0) & np.isfinite(imArr)
+        values = imArr[good]
+        if values.size == 0:
+            mean = median = np.nan
+        else:
+            stride = max(1, values.size // config.maxSamples)
+            sample = values[::stride]
+            median = np.median(sample)
+            if config.method == "sampled":
+                mean = _clipIteratively(sample, config.numSigmaClip, config.numIter)
+            else:
+                q25, q75 = np.percentile(sample, [25., 75.])
+                halfRange = 2.*config.numSigmaClip*max(0.741*(q75 - q25), np.finfo(float).eps)
+                counts, edges = np.histogram(values, bins=config.numHistogramBins,
+                                             range=(median - halfRange, median + halfRange))
+                centers = 0.5*(edges[:-1] + edges[1:])
+                mean = _clipIteratively(centers, config.numSigmaClip, config.numIter, weights=counts)
+        mean, median = float(mean), float(median)
+
+    if useCache:
+        cache.put(key, owner, (mean, median))
+    return pipeBase.Struct(mean=mean, median=median)
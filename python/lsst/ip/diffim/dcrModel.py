@@ -20,13 +20,19 @@
 # see <https://www.lsstcorp.org/LegalNotices/>.
 #
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import threading
+
 import numpy as np
 from scipy import ndimage
 from lsst.afw.coord.refraction import differentialRefraction
 import lsst.afw.image as afwImage
 import lsst.geom as geom
 
-__all__ = ["DcrModel", "applyDcr", "calculateDcr", "calculateImageParallacticAngle"]
+__all__ = ["DcrModel", "applyDcr", "fourierShiftKernel", "calculateDcr", "calculateImageParallacticAngle",
+           "DcrShiftCache", "getDcrShiftCache"]
 
 
 class DcrModel:
@@ -38,6 +44,15 @@ class DcrModel:
         Number of sub-filters used to model chromatic effects within a band.
     modelImages : `list` of `lsst.afw.image.Image`
         A list of masked images, each containing the model for one subfilter
+    prefilterCacheSize : `int`
+        Maximum number of spline-prefiltered or Fourier transformed subfilter
+        planes to keep.
+    prefilterCacheMaxBytes : `int` or `None`
+        Maximum total size in bytes of the cached planes, or `None` to only
+        bound their number. Planes larger than this are not cached.
+    workingDtype : `numpy.dtype`
+        Floating point precision of the intermediate arrays used to build
+        matched templates and reference images, either float32 or float64.
 
     Notes
     -----
@@ -47,15 +62,54 @@ class DcrModel:
     templates for a given ``Exposure``, and provides utilities for conditioning
     the model in ``dcrAssembleCoadd`` to avoid oscillating solutions between
     iterations of forward modeling or between the subfilters of the model.
+
+    The spline-prefiltered or Fourier transformed subfilter planes used to
+    shift the model are cached, and invalidated by ``__setitem__`` and ``assign``. Modifying the
+    pixels of a model image in place requires a call to ``clearCache``.
+
+    The subfilter planes may be memory-mapped from a file (see
+    ``writeMemmap`` and ``fromMemmap``), in which case the model images are
+    views of the file and only the pixels within the bounding boxes that
+    are accessed are read into memory. The cached planes of such a model
+    are by default limited to the size of the file, since planes of the
+    whole model in the float64 ``workingDtype`` would otherwise take twice
+    the memory the file was meant to save.
+
+    The conditioning and regularization methods operate on all subfilters at
+    once, on a single (subfilter, y, x) array. The subfilter images of models
+    made by ``fromImage`` and ``fromMemmap`` are views of such an array,
+    returned by ``getPlanes``; other models are copied to a new array for
+    each call, unless their images are first stacked with ``stackPlanes``.
+
+    The model images are always stored as float32. By default the
+    prefiltered planes, Fourier transforms, and accumulators of matched
+    templates are float64. With a ``workingDtype`` of float32 they are kept
+    in single precision, which halves their memory and the memory traffic of
+    building templates. The templates then differ from the double precision
+    templates by a few times the float32 resolution, about 1e-6 of the peak
+    pixel value, well below the noise of the model.
     """
 
-    def __init__(self, modelImages, filterInfo=None, psf=None, mask=None, variance=None):
+    def __init__(self, modelImages, filterInfo=None, psf=None, mask=None, variance=None,
+                 prefilterCacheSize=None, workingDtype=np.float64, prefilterCacheMaxBytes=None):
         self.dcrNumSubfilters = len(modelImages)
         self.modelImages = modelImages
         self._filter = filterInfo
         self._psf = psf
         self._mask = mask
         self._variance = variance
+        if prefilterCacheSize is None:
+            # Enough for every subfilter over two different bounding boxes
+            prefilterCacheSize = 2*self.dcrNumSubfilters
+        self.prefilterCacheSize = prefilterCacheSize
+        self.prefilterCacheMaxBytes = prefilterCacheMaxBytes
+        self._prefilterCache = OrderedDict()
+        self._prefilterCacheLock = threading.Lock()
+        self._planes = None
+        self._incrementalTemplate = None
+        self._loaders = {}
+        self._loadLock = threading.Lock()
+        self.workingDtype = workingDtype
 
     @classmethod
     def fromImage(cls, maskedImage, dcrNumSubfilters, filterInfo=None, psf=None):
@@ -86,7 +140,6 @@ class DcrModel:
         """
         # NANs will potentially contaminate the entire image,
         # depending on the shift or convolution type used.
-        model = maskedImage.image.clone()
         mask = maskedImage.mask.clone()
         # We divide the variance by N and not N**2 because we will assume each
         # subfilter is independent. That means that the significance of
@@ -95,14 +148,18 @@ class DcrModel:
         # subfilter images to construct matched templates.
         variance = maskedImage.variance.clone()
         variance /= dcrNumSubfilters
-        model /= dcrNumSubfilters
-        modelImages = [model, ]
-        for subfilter in range(1, dcrNumSubfilters):
-            modelImages.append(model.clone())
-        return cls(modelImages, filterInfo, psf, mask, variance)
+        # Store the subfilters in a single array, for the conditioning and regularization methods
+        image = maskedImage.image.array
+        planes = np.empty((dcrNumSubfilters,) + image.shape, dtype=image.dtype)
+        planes[:] = image
+        planes /= dcrNumSubfilters
+        dcrModel = cls(_makePlaneImages(planes, maskedImage.getXY0()), filterInfo, psf, mask, variance)
+        dcrModel._planes = planes
+        return dcrModel
 
     @classmethod
-    def fromDataRef(cls, dataRef, datasetType="dcrCoadd", numSubfilters=None, **kwargs):
+    def fromDataRef(cls, dataRef, datasetType="dcrCoadd", numSubfilters=None, bbox=None, lazy=True,
+                    **kwargs):
         """Load an existing DcrModel from a repository.
 
         Parameters
@@ -114,34 +171,170 @@ class DcrModel:
             Name of the DcrModel in the registry {"dcrCoadd", "dcrCoadd_sub"}
         numSubfilters : `int`
             Number of sub-filters used to model chromatic effects within a band.
+        bbox : `lsst.afw.geom.Box2I`, optional
+            Sub-region of the patch to read. If set, only cutouts of the
+            model are read, using the ``_sub`` variant of ``datasetType``.
+        lazy : `bool`, optional
+            Defer reading all but the first subfilter until it is accessed.
         **kwargs
             Additional keyword arguments to pass to look up the model in the data registry.
-            Common keywords and their types include: ``tract``:`str`, ``patch``:`str`,
-            ``bbox``:`lsst.afw.geom.Box2I`
+            Common keywords and their types include: ``tract``:`str`, ``patch``:`str`
 
         Returns
         -------
         dcrModel : `lsst.pipe.tasks.DcrModel`
             Best fit model of the true sky after correcting chromatic effects.
         """
-        modelImages = []
-        filterInfo = None
-        psf = None
-        mask = None
-        variance = None
-        for subfilter in range(numSubfilters):
-            dcrCoadd = dataRef.get(datasetType, subfilter=subfilter,
-                                   numSubfilters=numSubfilters, **kwargs)
-            if filterInfo is None:
-                filterInfo = dcrCoadd.getFilter()
-            if psf is None:
-                psf = dcrCoadd.getPsf()
-            if mask is None:
-                mask = dcrCoadd.mask
-            if variance is None:
-                variance = dcrCoadd.variance
-            modelImages.append(dcrCoadd.image)
-        return cls(modelImages, filterInfo, psf, mask, variance)
+        if bbox is not None:
+            kwargs["bbox"] = bbox
+            if not datasetType.endswith("_sub"):
+                datasetType += "_sub"
+        loaders = {subfilter: functools.partial(dataRef.get, datasetType, subfilter=subfilter,
+                                                numSubfilters=numSubfilters, **kwargs)
+                   for subfilter in range(numSubfilters)}
+        # The first subfilter is always read, for the metadata shared by the model
+        dcrCoadd = loaders.pop(0)()
+        modelImages = [dcrCoadd.image] + [None]*(numSubfilters - 1)
+        dcrModel = cls(modelImages, dcrCoadd.getFilter(), dcrCoadd.getPsf(), dcrCoadd.mask,
+                       dcrCoadd.variance)
+        dcrModel._loaders = loaders
+        if not lazy:
+            for subfilter in range(1, numSubfilters):
+                dcrModel[subfilter]
+        return dcrModel
+
+    @classmethod
+    def fromMemmap(cls, filename, xy0=None, filterInfo=None, psf=None, mask=None, variance=None,
+                   mode="r+", prefilterCacheMaxBytes=None):
+        """Initialize a DcrModel with subfilter planes memory-mapped from a file.
+
+        Parameters
+        ----------
+        filename : `str`
+            Name of a ``.npy`` file with the subfilter planes, with shape
+            (subfilter, y, x), as written by ``writeMemmap``.
+        xy0 : `lsst.geom.Point2I`, optional
+            Origin of the model images. Defaults to the origin of ``mask``
+            if it is set, otherwise to (0, 0).
+        filterInfo : `lsst.afw.image.Filter`, optional
+            The filter definition, set in the current instruments' obs package.
+            Required for any calculation of DCR, including making matched templates.
+        psf : `lsst.afw.detection.Psf`, optional
+            Point spread function (PSF) of the model.
+        mask : `lsst.afw.image.Mask`, optional
+            Mask plane of the DCR model.
+        variance : `lsst.afw.image.Image`, optional
+            Variance plane of the DCR model.
+        mode : {"r+", "c"}, optional
+            Open the file for reading and writing, or copy-on-write so that
+            changes to the model are not written back to the file.
+        prefilterCacheMaxBytes : `int`, optional
+            Maximum total size in bytes of the cached prefiltered and Fourier
+            transformed planes. Defaults to the size of the subfilter planes
+            in the file.
+
+        Returns
+        -------
+        dcrModel : `lsst.pipe.tasks.DcrModel`
+            Best fit model of the true sky after correcting chromatic effects.
+
+        Raises
+        ------
+        ValueError
+            If the file does not contain a 3-dimensional float32 array.
+        """
+        planes = np.load(filename, mmap_mode=mode)
+        if planes.ndim != 3 or planes.dtype != np.float32:
+            raise ValueError("%s does not contain a (subfilter, y, x) float32 array." % filename)
+        if xy0 is None:
+            xy0 = mask.getXY0() if mask is not None else geom.Point2I(0, 0)
+        modelImages = _makePlaneImages(planes, xy0)
+        if prefilterCacheMaxBytes is None:
+            prefilterCacheMaxBytes = planes.nbytes
+        dcrModel = cls(modelImages, filterInfo, psf, mask, variance,
+                       prefilterCacheMaxBytes=prefilterCacheMaxBytes)
+        dcrModel._planes = planes
+        return dcrModel
+
+    def writeMemmap(self, filename):
+        """Write the subfilter planes to a file, and return a model that is
+        memory-mapped from it.
+
+        Parameters
+        ----------
+        filename : `str`
+            Name of the ``.npy`` file to write.
+
+        Returns
+        -------
+        dcrModel : `lsst.pipe.tasks.DcrModel`
+            The same model, with subfilter planes memory-mapped from ``filename``.
+            The filter, psf, mask, and variance are shared with this model.
+        """
+        height, width = self.bbox.getHeight(), self.bbox.getWidth()
+        planes = np.lib.format.open_memmap(filename, mode="w+", dtype=np.float32,
+                                           shape=(len(self), height, width))
+        # Copy one plane at a time, so that the whole model is never held in memory twice
+        for plane, model in zip(planes, self):
+            plane[:] = model.array
+        planes.flush()
+        del planes
+        return self.fromMemmap(filename, xy0=self.bbox.getMin(), filterInfo=self.filter, psf=self.psf,
+                               mask=self.mask, variance=self.variance)
+
+    def flush(self):
+        """Write any changes to memory-mapped subfilter planes to disk.
+        """
+        if isinstance(self._planes, np.memmap):
+            self._planes.flush()
+
+    def stackPlanes(self):
+        """Store the subfilter images of the model in a single array.
+
+        The images of the model are replaced by views of a new
+        (subfilter, y, x) array, so images retrieved from the model before
+        this call are no longer part of the model. Models made by
+        ``fromImage`` and ``fromMemmap`` are already stacked.
+
+        Returns
+        -------
+        planes : `numpy.ndarray`
+            View of the model with shape (subfilter, y, x).
+        """
+        if self._planes is None:
+            planes = np.stack([model.array for model in self])
+            self.modelImages = _makePlaneImages(planes, self.bbox.getMin())
+            self._planes = planes
+        return self._planes
+
+    def getPlanes(self, bbox=None):
+        """Return the subfilter planes of the model as a single array.
+
+        Parameters
+        ----------
+        bbox : `lsst.afw.geom.Box2I`, optional
+            Sub-region of the coadd. Returns the entire model if `None`.
+
+        Returns
+        -------
+        planes : `numpy.ndarray`
+            View of the model with shape (subfilter, y, x).
+            Changes to ``planes`` modify the model, and require a call to
+            ``clearCache``.
+
+        Raises
+        ------
+        RuntimeError
+            If the subfilter images are not stacked in a single array;
+            see ``stackPlanes``.
+        """
+        if self._planes is None:
+            raise RuntimeError("The subfilter planes of the model are not stacked; call stackPlanes first.")
+        if bbox is None:
+            return self._planes
+        x0 = bbox.getMinX() - self.bbox.getMinX()
+        y0 = bbox.getMinY() - self.bbox.getMinY()
+        return self._planes[:, y0: y0 + bbox.getHeight(), x0: x0 + bbox.getWidth()]
 
     def __len__(self):
         """Return the number of subfilters.
@@ -176,7 +369,28 @@ class DcrModel:
         """
         if np.abs(subfilter) >= len(self):
             raise IndexError("subfilter out of bounds.")
-        return self.modelImages[subfilter]
+        model = self.modelImages[subfilter]
+        if model is None:
+            model = self._loadSubfilter(subfilter % len(self))
+        return model
+
+    def _loadSubfilter(self, subfilter):
+        """Read the model of a subfilter that was deferred by ``fromDataRef``.
+
+        Parameters
+        ----------
+        subfilter : `int`
+            Index of the subfilter, between 0 and the number of subfilters.
+
+        Returns
+        -------
+        modelImage : `lsst.afw.image.Image`
+            The DCR model for the given ``subfilter``.
+        """
+        with self._loadLock:
+            if self.modelImages[subfilter] is None:
+                self.modelImages[subfilter] = self._loaders.pop(subfilter)().image
+            return self.modelImages[subfilter]
 
     def __setitem__(self, subfilter, maskedImage):
         """Update the model image for one subfilter.
@@ -200,7 +414,13 @@ class DcrModel:
             raise IndexError("subfilter out of bounds.")
         if maskedImage.getBBox() != self.bbox:
             raise ValueError("The bounding box of a subfilter must not change.")
-        self.modelImages[subfilter] = maskedImage
+        if self._planes is not None:
+            # Keep the subfilter planes in their contiguous (or memory-mapped) array
+            self.modelImages[subfilter].array[:] = maskedImage.array
+        else:
+            self.modelImages[subfilter] = maskedImage
+            self._loaders.pop(subfilter % len(self), None)
+        self.clearCache(subfilter)
 
     @property
     def filter(self):
@@ -257,21 +477,60 @@ class DcrModel:
         """
         return self._variance
 
-    def getReferenceImage(self, bbox=None):
+    @property
+    def workingDtype(self):
+        """Return the precision of the intermediate arrays of the model.
+
+        Returns
+        -------
+        workingDtype : `numpy.dtype`
+            Either float32 or float64.
+        """
+        return self._workingDtype
+
+    @workingDtype.setter
+    def workingDtype(self, dtype):
+        """Set the precision of the intermediate arrays of the model.
+
+        Cached planes are keyed by their precision, so they do not need to be
+        cleared when it changes.
+
+        Parameters
+        ----------
+        dtype : `numpy.dtype`, `type`, or `str`
+            Either float32 or float64.
+
+        Raises
+        ------
+        ValueError
+            If ``dtype`` is not float32 or float64.
+        """
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise ValueError("The working precision must be float32 or float64, not %s" % dtype)
+        self._workingDtype = dtype
+
+    def getReferenceImage(self, bbox=None, out=None):
         """Calculate a reference image from the average of the subfilter images.
 
         Parameters
         ----------
         bbox : `lsst.afw.geom.Box2I`, optional
             Sub-region of the coadd. Returns the entire image if `None`.
+        out : `numpy.ndarray`, optional
+            Preallocated array to write the reference image to, with the shape
+            of ``bbox``. Its dtype sets the precision of the average.
 
         Returns
         -------
         refImage : `numpy.ndarray`
             The reference image with no chromatic effects applied.
+            Has the dtype of the model images unless ``out`` is set.
         """
         bbox = bbox or self.bbox
-        return np.mean([model[bbox].array for model in self], axis=0)
+        # Only the requested region of each plane is read if the model is memory-mapped.
+        planes = [model[bbox].array for model in self]
+        return _meanOfPlanes(planes, dtype=planes[0].dtype, out=out)
 
     def assign(self, dcrSubModel, bbox=None):
         """Update a sub-region of the ``DcrModel`` with new values.
@@ -295,10 +554,149 @@ class DcrModel:
         bbox = bbox or self.bbox
         for model, subModel in zip(self, dcrSubModel):
             model.assign(subModel[bbox], bbox)
+        self.clearCache()
+
+    def clearCache(self, subfilter=None):
+        """Discard cached spline-prefiltered and Fourier transformed model planes,
+        and the state of incremental templates.
+
+        Parameters
+        ----------
+        subfilter : `int`, optional
+            Index of the subfilter to discard the planes of.
+            All cached planes are discarded if `None`.
+        """
+        # The shifted subfilters of incremental templates depend on every subfilter
+        self._incrementalTemplate = None
+        with self._prefilterCacheLock:
+            if subfilter is None:
+                self._prefilterCache.clear()
+                return
+            subfilter %= len(self)
+            for key in [key for key in self._prefilterCache if key[0] == subfilter]:
+                del self._prefilterCache[key]
+
+    def getPrefilterCacheBytes(self):
+        """Return the total size of the cached prefiltered and Fourier transformed planes.
+
+        Returns
+        -------
+        nBytes : `int`
+            Number of bytes held by the cached planes.
+        """
+        with self._prefilterCacheLock:
+            return sum(plane.nbytes for plane in self._prefilterCache.values())
+
+    def getPrefilteredImage(self, subfilter, bbox=None, order=3):
+        """Return the spline-prefiltered model for one subfilter.
+
+        The prefiltered planes are computed on first use and cached, so
+        that shifting the same model for many exposures does not repeat the
+        spline filter.
+
+        Parameters
+        ----------
+        subfilter : `int`
+            Index of the current subfilter within the full band.
+        bbox : `lsst.afw.geom.Box2I`, optional
+            Sub-region of the coadd. Returns the entire image if `None`.
+        order : `int`, optional
+            The order of the spline interpolation, default is 3.
+
+        Returns
+        -------
+        prefilteredImage : `numpy.ndarray`
+            The spline coefficients of the model, to be shifted with
+            ``applyDcr`` using ``doPrefilter=False``.
+            Must not be modified.
+        """
+        bbox = bbox or self.bbox
+        model = self[subfilter]
+        dtype = self.workingDtype
+        return self._getCachedPlane(subfilter, bbox, ("spline", order, dtype.str),
+                                    lambda: ndimage.spline_filter(model[bbox].array, order=order,
+                                                                  output=dtype))
+
+    def getFourierImage(self, subfilter, bbox=None, padding=0):
+        """Return the Fourier transform of the model for one subfilter.
+
+        The transforms are computed on first use and cached.
+
+        Parameters
+        ----------
+        subfilter : `int`
+            Index of the current subfilter within the full band.
+        bbox : `lsst.afw.geom.Box2I`, optional
+            Sub-region of the coadd. Returns the entire image if `None`.
+        padding : `int`, optional
+            Number of zero-valued pixels to add to each edge of the image
+            before the transform, so that shifts do not wrap around.
+
+        Returns
+        -------
+        fourierImage : `numpy.ndarray`
+            The real-input Fourier transform of the padded model, complex64
+            if ``workingDtype`` is float32.
+            Must not be modified.
+        """
+        bbox = bbox or self.bbox
+        model = self[subfilter]
+        dtype = self._complexDtype
+
+        def makePlane():
+            fourierImage = np.fft.rfft2(np.pad(model[bbox].array, padding, mode='constant'))
+            return fourierImage.astype(dtype, copy=False)
+        return self._getCachedPlane(subfilter, bbox, ("fourier", padding, dtype.str), makePlane)
+
+    @property
+    def _complexDtype(self):
+        """The complex type with the precision of ``workingDtype``.
+        """
+        return np.result_type(self.workingDtype, np.complex64)
+
+    def _getCachedPlane(self, subfilter, bbox, kind, makePlane):
+        """Look up a derived plane of the model in the cache, computing it if needed.
+
+        Parameters
+        ----------
+        subfilter : `int`
+            Index of the current subfilter within the full band.
+        bbox : `lsst.afw.geom.Box2I`
+            Sub-region of the coadd.
+        kind : `tuple`
+            Description of the derived plane, used as part of the cache key.
+        makePlane : `callable`
+            Function with no arguments computing the plane.
+
+        Returns
+        -------
+        plane : `numpy.ndarray`
+            The cached plane, or a new plane if it is larger than
+            ``prefilterCacheMaxBytes``.
+        """
+        key = (subfilter % len(self), bbox.getMinX(), bbox.getMinY(), bbox.getMaxX(), bbox.getMaxY(), kind)
+        with self._prefilterCacheLock:
+            plane = self._prefilterCache.get(key)
+            if plane is not None:
+                self._prefilterCache.move_to_end(key)
+                return plane
+        # Compute the plane outside of the lock, so different planes may be computed concurrently
+        plane = makePlane()
+        maxBytes = self.prefilterCacheMaxBytes
+        if maxBytes is not None and plane.nbytes > maxBytes:
+            return plane
+        with self._prefilterCacheLock:
+            self._prefilterCache[key] = plane
+            nBytes = sum(cachedPlane.nbytes for cachedPlane in self._prefilterCache.values())
+            while (len(self._prefilterCache) > self.prefilterCacheSize
+                   or (maxBytes is not None and nBytes > maxBytes)):
+                nBytes -= self._prefilterCache.popitem(last=False)[1].nbytes
+        return plane
 
     def buildMatchedTemplate(self, exposure=None, order=3,
                              visitInfo=None, bbox=None, wcs=None, mask=None,
-                             splitSubfilters=True, splitThreshold=0., amplifyModel=1.):
+                             splitSubfilters=True, splitThreshold=0., amplifyModel=1.,
+                             shiftMethod="spline", tileSize=0, numThreads=1, incrementalTolerance=None):
         """Create a DCR-matched template image for an exposure.
 
         Parameters
@@ -325,6 +723,27 @@ class DcrModel:
         amplifyModel : `float`, optional
             Multiplication factor to amplify differences between model planes.
             Used to speed convergence of iterative forward modeling.
+        shiftMethod : {"spline", "fourier"}, optional
+            Shift each subfilter with spline interpolation (``order`` sets
+            the spline order), or with a phase ramp in Fourier space, which
+            transforms each subfilter once and needs a single inverse
+            transform for the template.
+        tileSize : `int`, optional
+            Shift the model in square tiles of this many pixels, each
+            extended by a halo covering the largest DCR shift plus the spline
+            support. The tiles are stitched back together without seams.
+            Used only with spline shifts. Defaults to 0, which shifts the
+            whole ``bbox`` at once.
+        numThreads : `int`, optional
+            Number of threads over which to prefilter the subfilters and
+            shift the tiles. Used only with spline shifts.
+        incrementalTolerance : `float`, optional
+            If set, update the template of the previous call instead of
+            building a new one, provided the ``bbox`` and shift options are
+            unchanged. Subfilters whose DCR shift changed by less than this
+            many pixels since they were last shifted are reused, and only the
+            others are shifted again. Used only with spline shifts, instead
+            of ``tileSize`` and ``numThreads``.
 
         Returns
         -------
@@ -334,7 +753,8 @@ class DcrModel:
         Raises
         ------
         ValueError
-            If neither ``exposure`` or all of ``visitInfo``, ``bbox``, and ``wcs`` are set.
+            If neither ``exposure`` or all of ``visitInfo``, ``bbox``, and ``wcs`` are set,
+            or if ``shiftMethod`` is not supported.
         """
         if self.filter is None:
             raise ValueError("'filterInfo' must be set for the DcrModel in order to calculate DCR.")
@@ -344,20 +764,272 @@ class DcrModel:
             wcs = exposure.getInfo().getWcs()
         elif visitInfo is None or bbox is None or wcs is None:
             raise ValueError("Either exposure or visitInfo, bbox, and wcs must be set.")
+        if shiftMethod not in ("spline", "fourier"):
+            raise ValueError("Unknown DCR shift method: %s" % shiftMethod)
         dcrShift = calculateDcr(visitInfo, wcs, self.filter, len(self), splitSubfilters=splitSubfilters)
         templateImage = afwImage.ImageF(bbox)
-        refModel = self.getReferenceImage(bbox)
-        for subfilter, dcr in enumerate(dcrShift):
+        if shiftMethod == "fourier":
+            templateImage.array[:] = self._buildFourierTemplate(bbox, dcrShift,
+                                                                splitSubfilters=splitSubfilters,
+                                                                splitThreshold=splitThreshold,
+                                                                amplifyModel=amplifyModel)
+        elif incrementalTolerance is not None:
+            templateImage.array[:] = self._buildIncrementalTemplate(bbox, dcrShift, incrementalTolerance,
+                                                                    order=order,
+                                                                    splitSubfilters=splitSubfilters,
+                                                                    splitThreshold=splitThreshold,
+                                                                    amplifyModel=amplifyModel)
+        else:
+            templateImage.array[:] = self._buildSplineTemplate(bbox, dcrShift, order=order,
+                                                               splitSubfilters=splitSubfilters,
+                                                               splitThreshold=splitThreshold,
+                                                               amplifyModel=amplifyModel,
+                                                               tileSize=tileSize, numThreads=numThreads)
+        return templateImage
+
+    def buildMatchedTemplates(self, inputs, order=3, splitSubfilters=True, splitThreshold=0.,
+                              amplifyModel=1., shiftMethod="spline"):
+        """Create DCR-matched template images for many exposures in one pass.
+
+        With spline shifts, the model is prefiltered once over the union of
+        the requested bounding boxes, and the prefiltered planes are shared
+        by every template. The DCR shifts are calculated once for each
+        distinct pair of ``visitInfo`` and ``wcs``. Templates are generated
+        one at a time, so only the shared planes and the current template are
+        held in memory.
+
+        Parameters
+        ----------
+        inputs : iterable of `tuple`
+            The ``(visitInfo, wcs, bbox)`` of each exposure to build a matched
+            template for, with types `lsst.afw.image.VisitInfo`,
+            `lsst.afw.geom.SkyWcs`, and `lsst.afw.geom.Box2I`.
+        order : `int`, optional
+            Interpolation order of the DCR shift.
+        splitSubfilters : `bool`, optional
+            Calculate DCR for two evenly-spaced wavelengths in each subfilter,
+            instead of at the midpoint. Default: True
+        splitThreshold : `float`, optional
+            Minimum DCR difference within a subfilter required to use ``splitSubfilters``
+        amplifyModel : `float`, optional
+            Multiplication factor to amplify differences between model planes.
+        shiftMethod : {"spline", "fourier"}, optional
+            Method used to apply the DCR shifts, see ``buildMatchedTemplate``.
+
+        Yields
+        ------
+        templateImage : `lsst.afw.image.ImageF`
+            The DCR-matched template of the next exposure in ``inputs``.
+
+        Raises
+        ------
+        ValueError
+            If the filter of the model is not set, or if ``shiftMethod`` is not supported.
+
+        Notes
+        -----
+        Away from the edges of each bounding box the templates are the same as
+        those of ``buildMatchedTemplate``. Near the edges they are computed from
+        the surrounding model pixels, instead of treating the model as zero
+        outside the bounding box.
+        """
+        if self.filter is None:
+            raise ValueError("'filterInfo' must be set for the DcrModel in order to calculate DCR.")
+        if shiftMethod not in ("spline", "fourier"):
+            raise ValueError("Unknown DCR shift method: %s" % shiftMethod)
+        inputs = list(inputs)
+        prefilterBBox = geom.Box2I()
+        for visitInfo, wcs, bbox in inputs:
+            prefilterBBox.include(bbox)
+        dcrShifts = {}
+        for visitInfo, wcs, bbox in inputs:
+            key = (id(visitInfo), id(wcs))
+            if key not in dcrShifts:
+                dcrShifts[key] = calculateDcr(visitInfo, wcs, self.filter, len(self),
+                                              splitSubfilters=splitSubfilters)
+            templateImage = afwImage.ImageF(bbox)
+            if shiftMethod == "fourier":
+                templateImage.array[:] = self._buildFourierTemplate(bbox, dcrShifts[key],
+                                                                    splitSubfilters=splitSubfilters,
+                                                                    splitThreshold=splitThreshold,
+                                                                    amplifyModel=amplifyModel)
+            else:
+                templateImage.array[:] = self._buildSplineTemplate(bbox, dcrShifts[key], order=order,
+                                                                   splitSubfilters=splitSubfilters,
+                                                                   splitThreshold=splitThreshold,
+                                                                   amplifyModel=amplifyModel,
+                                                                   prefilterBBox=prefilterBBox)
+            yield templateImage
+
+    def _buildSplineTemplate(self, bbox, dcrShift, order=3, splitSubfilters=True, splitThreshold=0.,
+                             amplifyModel=1., prefilterBBox=None, tileSize=0, numThreads=1):
+        """Shift and sum the subfilters of the model with spline interpolation.
+
+        Parameters
+        ----------
+        bbox : `lsst.afw.geom.Box2I`
+            Sub-region of the coadd.
+        dcrShift : `list`
+            Shift of each subfilter, calculated with ``calculateDcr``.
+        order : `int`, optional
+            Interpolation order of the DCR shift.
+        splitSubfilters : `bool`, optional
+            ``dcrShift`` was calculated for two wavelengths in each subfilter.
+        splitThreshold : `float`, optional
+            Minimum DCR difference within a subfilter required to use ``splitSubfilters``
+        amplifyModel : `float`, optional
+            Multiplication factor to amplify differences between model planes.
+        prefilterBBox : `lsst.afw.geom.Box2I`, optional
+            Region containing ``bbox`` over which to prefilter the model.
+            Defaults to ``bbox``.
+        tileSize : `int`, optional
+            Size of the square tiles to shift separately. Defaults to 0,
+            which shifts the whole ``bbox`` at once.
+        numThreads : `int`, optional
+            Number of threads over which to prefilter the subfilters and
+            shift the tiles.
+
+        Returns
+        -------
+        templateImage : `numpy.ndarray`
+            The DCR-matched template.
+        """
+        prefilterBBox = prefilterBBox or bbox
+        with ThreadPoolExecutor(max_workers=max(numThreads, 1)) as executor:
+            prefilteredModels = list(executor.map(
+                lambda subfilter: self.getPrefilteredImage(subfilter, prefilterBBox, order=order),
+                range(len(self))))
+            if prefilterBBox != bbox:
+                x0 = bbox.getMinX() - prefilterBBox.getMinX()
+                y0 = bbox.getMinY() - prefilterBBox.getMinY()
+                prefilteredModels = [model[y0: y0 + bbox.getHeight(), x0: x0 + bbox.getWidth()]
+                                     for model in prefilteredModels]
             if amplifyModel > 1:
-                model = (self[subfilter][bbox].array - refModel)*amplifyModel + refModel
+                # The spline filter is linear, so the amplified model can be
+                # built directly from the cached prefiltered planes.
+                refModel = _meanOfPlanes(prefilteredModels, dtype=self.workingDtype)
             else:
-                model = self[subfilter][bbox].array
-            templateImage.array += applyDcr(model, dcr, splitSubfilters=splitSubfilters,
-                                            splitThreshold=splitThreshold, order=order)
+                refModel = None
+            templateImage = np.zeros((bbox.getHeight(), bbox.getWidth()), dtype=self.workingDtype)
+            shiftTile = functools.partial(_shiftTile, prefilteredModels, refModel, dcrShift, templateImage,
+                                          order=order, splitSubfilters=splitSubfilters,
+                                          splitThreshold=splitThreshold, amplifyModel=amplifyModel)
+            if tileSize > 0:
+                # The spline support extends ``order//2 + 1`` pixels from the shifted position
+                halo = int(np.ceil(np.max(np.abs(dcrShift)))) + order//2 + 1
+                tiles = _makeTiles(templateImage.shape, tileSize, halo)
+            else:
+                tiles = [((slice(None), slice(None)), (slice(None), slice(None)))]
+            # Tiles do not overlap, so each thread writes to a separate region of ``templateImage``
+            list(executor.map(lambda tile: shiftTile(*tile), tiles))
         return templateImage
 
+    def _buildIncrementalTemplate(self, bbox, dcrShift, tolerance, order=3, splitSubfilters=True,
+                                  splitThreshold=0., amplifyModel=1.):
+        """Update the template of the previous call for new DCR shifts.
+
+        The shifted model of each subfilter is kept between calls, and only
+        the subfilters whose shift changed by at least ``tolerance`` are
+        shifted again, from the cached prefiltered planes.
+
+        Parameters
+        ----------
+        bbox : `lsst.afw.geom.Box2I`
+            Sub-region of the coadd.
+        dcrShift : `list`
+            Shift of each subfilter, calculated with ``calculateDcr``.
+        tolerance : `float`
+            Change of the shift below which a shifted subfilter is reused, in pixels.
+        order : `int`, optional
+            Interpolation order of the DCR shift.
+        splitSubfilters : `bool`, optional
+            ``dcrShift`` was calculated for two wavelengths in each subfilter.
+        splitThreshold : `float`, optional
+            Minimum DCR difference within a subfilter required to use ``splitSubfilters``
+        amplifyModel : `float`, optional
+            Multiplication factor to amplify differences between model planes.
+
+        Returns
+        -------
+        templateImage : `numpy.ndarray`
+            The DCR-matched template.
+        """
+        key = (bbox.getMinX(), bbox.getMinY(), bbox.getMaxX(), bbox.getMaxY(),
+               order, splitSubfilters, splitThreshold, amplifyModel, self.workingDtype.str)
+        state = self._incrementalTemplate
+        if state is None or state.key != key:
+            state = _IncrementalTemplate(key, len(self))
+            self._incrementalTemplate = state
+        prefilteredModels = [self.getPrefilteredImage(subfilter, bbox, order=order)
+                             for subfilter in range(len(self))]
+        if amplifyModel > 1:
+            refModel = _meanOfPlanes(prefilteredModels, dtype=self.workingDtype)
+            model = np.empty_like(refModel)
+        for subfilter, dcr in enumerate(dcrShift):
+            lastShift = state.dcrShifts[subfilter]
+            if lastShift is not None and np.max(np.abs(np.subtract(dcr, lastShift))) < tolerance:
+                continue
+            if amplifyModel > 1:
+                _amplifyPlane(prefilteredModels[subfilter], refModel, amplifyModel, out=model)
+            else:
+                model = prefilteredModels[subfilter]
+            # Shift into the array of the previous shift of the subfilter, if there is one
+            state.shiftedModels[subfilter] = applyDcr(model, dcr, splitSubfilters=splitSubfilters,
+                                                      splitThreshold=splitThreshold, doPrefilter=False,
+                                                      order=order, output=state.shiftedModels[subfilter])
+            state.dcrShifts[subfilter] = dcr
+        return _meanOfPlanes(state.shiftedModels, dtype=self.workingDtype, scale=len(self))
+
+    def _buildFourierTemplate(self, bbox, dcrShift, splitSubfilters=True, splitThreshold=0., amplifyModel=1.):
+        """Shift and sum the subfilters of the model in Fourier space.
+
+        Parameters
+        ----------
+        bbox : `lsst.afw.geom.Box2I`
+            Sub-region of the coadd.
+        dcrShift : `list`
+            Shift of each subfilter, calculated with ``calculateDcr``.
+        splitSubfilters : `bool`, optional
+            ``dcrShift`` was calculated for two wavelengths in each subfilter.
+        splitThreshold : `float`, optional
+            Minimum DCR difference within a subfilter required to use ``splitSubfilters``
+        amplifyModel : `float`, optional
+            Multiplication factor to amplify differences between model planes.
+
+        Returns
+        -------
+        templateImage : `numpy.ndarray`
+            The DCR-matched template.
+        """
+        # Pad by a multiple of 8 pixels that covers the largest shift, so the
+        # shifted image does not wrap around and the cached transforms can be
+        # reused for exposures with similar shifts.
+        padding = 8*int(np.ceil((np.max(np.abs(dcrShift)) + 1.)/8.))
+        fourierModels = [self.getFourierImage(subfilter, bbox, padding=padding)
+                         for subfilter in range(len(self))]
+        dtype = self._complexDtype
+        if amplifyModel > 1:
+            refModel = _meanOfPlanes(fourierModels, dtype=dtype)
+        shape = (bbox.getHeight() + 2*padding, bbox.getWidth() + 2*padding)
+        frequencies = (np.fft.fftfreq(shape[0]), np.fft.rfftfreq(shape[1]))
+        templateFourier = np.zeros_like(fourierModels[0])
+        shiftedModel = np.empty_like(templateFourier)
+        for subfilter, dcr in enumerate(dcrShift):
+            if amplifyModel > 1:
+                _amplifyPlane(fourierModels[subfilter], refModel, amplifyModel, out=shiftedModel)
+                model = shiftedModel
+            else:
+                model = fourierModels[subfilter]
+            kernel = fourierShiftKernel(frequencies, dcr, splitSubfilters=splitSubfilters,
+                                        splitThreshold=splitThreshold)
+            np.multiply(model, kernel.astype(dtype, copy=False), out=shiftedModel)
+            templateFourier += shiftedModel
+        templateImage = np.fft.irfft2(templateFourier, s=shape)
+        return templateImage[padding:shape[0] - padding, padding:shape[1] - padding]
+
     def buildMatchedExposure(self, exposure=None,
-                             visitInfo=None, bbox=None, wcs=None, mask=None):
+                             visitInfo=None, bbox=None, wcs=None, mask=None, shiftMethod="spline",
+                             tileSize=0, numThreads=1):
         """Wrapper to create an exposure from a template image.
 
         Parameters
@@ -374,6 +1046,12 @@ class DcrModel:
             Ignored if ``exposure`` is set.
         mask : `lsst.afw.image.Mask`, optional
             reference mask to use for the template image.
+        shiftMethod : {"spline", "fourier"}, optional
+            Method used to apply the DCR shifts, see ``buildMatchedTemplate``.
+        tileSize : `int`, optional
+            Size of the tiles to shift separately, see ``buildMatchedTemplate``.
+        numThreads : `int`, optional
+            Number of threads over which to shift the tiles.
 
         Returns
         -------
@@ -383,7 +1061,48 @@ class DcrModel:
         if bbox is None:
             bbox = exposure.getBBox()
         templateImage = self.buildMatchedTemplate(exposure=exposure, visitInfo=visitInfo,
-                                                  bbox=bbox, wcs=wcs, mask=mask)
+                                                  bbox=bbox, wcs=wcs, mask=mask, shiftMethod=shiftMethod,
+                                                  tileSize=tileSize, numThreads=numThreads)
+        return self._makeTemplateExposure(templateImage, bbox, wcs)
+
+    def buildMatchedExposures(self, inputs, shiftMethod="spline"):
+        """Create DCR-matched template exposures for many exposures in one pass.
+
+        Parameters
+        ----------
+        inputs : iterable of `tuple`
+            The ``(visitInfo, wcs, bbox)`` of each exposure to build a matched
+            template for, see ``buildMatchedTemplates``.
+        shiftMethod : {"spline", "fourier"}, optional
+            Method used to apply the DCR shifts, see ``buildMatchedTemplate``.
+
+        Yields
+        ------
+        templateExposure : `lsst.afw.image.ExposureF`
+            The DCR-matched template of the next exposure in ``inputs``.
+        """
+        inputs = list(inputs)
+        templateImages = self.buildMatchedTemplates(inputs, shiftMethod=shiftMethod)
+        for (visitInfo, wcs, bbox), templateImage in zip(inputs, templateImages):
+            yield self._makeTemplateExposure(templateImage, bbox, wcs)
+
+    def _makeTemplateExposure(self, templateImage, bbox, wcs):
+        """Attach the mask, variance, and metadata of the model to a template image.
+
+        Parameters
+        ----------
+        templateImage : `lsst.afw.image.ImageF`
+            The DCR-matched template.
+        bbox : `lsst.afw.geom.Box2I`
+            Bounding box of the template.
+        wcs : `lsst.afw.geom.SkyWcs`
+            Coordinate system definition (wcs) of the template.
+
+        Returns
+        -------
+        templateExposure : `lsst.afw.image.exposureF`
+            The DCR-matched template
+        """
         maskedImage = afwImage.MaskedImageF(bbox)
         maskedImage.image = templateImage[bbox]
         maskedImage.mask = self.mask[bbox]
@@ -399,20 +1118,27 @@ class DcrModel:
 
         Parameters
         ----------
-        modelImages : `list` of `lsst.afw.image.Image`
-            The new DCR model images from the current iteration.
+        modelImages : `list` of `lsst.afw.image.Image`, `DcrModel`, or `numpy.ndarray`
+            The new DCR model images from the current iteration, or their
+            planes as a (subfilter, y, x) array.
             The values will be modified in place.
+            A list of images is copied to and from a single array.
         bbox : `lsst.afw.geom.Box2I`
             Sub-region of the coadd
         gain : `float`, optional
             Relative weight to give the new solution when updating the model.
             Defaults to 1.0, which gives equal weight to both solutions.
         """
-        # Calculate weighted averages of the images.
-        for model, newModel in zip(self, modelImages):
-            newModel *= gain
-            newModel += model[bbox]
-            newModel /= 1. + gain
+        newPlanes = _stackPlanes(modelImages)
+        # Calculate weighted averages of all of the subfilters at once.
+        newPlanes *= gain
+        if self._planes is not None:
+            newPlanes += self.getPlanes(bbox)
+        else:
+            for newPlane, model in zip(newPlanes, self):
+                newPlane += model[bbox].array
+        newPlanes /= 1. + gain
+        _unstackPlanes(newPlanes, modelImages)
 
     def regularizeModelIter(self, subfilter, newModel, bbox, regularizationFactor,
                             regularizationWidth=2):
@@ -434,7 +1160,8 @@ class DcrModel:
             Minimum radius of a region to include in regularization, in pixels.
         """
         refImage = self[subfilter][bbox].array
-        highThreshold = np.abs(refImage)*regularizationFactor
+        highThreshold = np.abs(refImage)
+        highThreshold *= regularizationFactor
         lowThreshold = refImage/regularizationFactor
         newImage = newModel.array
         self.applyImageThresholds(newImage, highThreshold=highThreshold, lowThreshold=lowThreshold,
@@ -446,9 +1173,10 @@ class DcrModel:
 
         Parameters
         ----------
-        modelImages : `list` of `lsst.afw.image.Image`
+        modelImages : `list` of `lsst.afw.image.Image`, or `DcrModel`
             The new DCR model images from the current iteration.
             The values will be modified in place.
+            A list of images is copied to and from a single array.
         bbox : `lsst.afw.geom.Box2I`
             Sub-region to coadd
         statsCtrl : `lsst.afw.math.StatisticsControl`
@@ -466,6 +1194,8 @@ class DcrModel:
         -----
         This implementation of frequency regularization restricts each subfilter
         image to be a smoothly-varying function times a reference image.
+        All of the subfilters are thresholded and smoothed at once, along the
+        spatial axes of a single (subfilter, y, x) array.
         """
         # ``regularizationFactor`` is the maximum change between subfilter images, so the maximum difference
         # between one subfilter image and the average will be the square root of that.
@@ -488,19 +1218,26 @@ class DcrModel:
 
         lowThreshold = smoothRef/maxDiff
         highThreshold = smoothRef*maxDiff
-        for model in modelImages:
-            self.applyImageThresholds(model.array,
-                                      highThreshold=highThreshold,
-                                      lowThreshold=lowThreshold,
-                                      regularizationWidth=regularizationWidth)
-            smoothModel = ndimage.filters.gaussian_filter(model.array, filterWidth, mode='constant')
-            smoothModel += 3.*noiseLevel
-            relativeModel = smoothModel/smoothRef
-            # Now sharpen the smoothed relativeModel using an alpha of 3.
-            alpha = 3.
-            relativeModel2 = ndimage.filters.gaussian_filter(relativeModel, filterWidth/alpha)
-            relativeModel += alpha*(relativeModel - relativeModel2)
-            model.array = relativeModel*referenceImage
+        newPlanes = _stackPlanes(modelImages)
+        self.applyImageThresholds(newPlanes,
+                                  highThreshold=highThreshold,
+                                  lowThreshold=lowThreshold,
+                                  regularizationWidth=regularizationWidth)
+        # Smooth only along the spatial axes
+        relativeModel = ndimage.filters.gaussian_filter(newPlanes, (0, filterWidth, filterWidth),
+                                                        mode='constant')
+        relativeModel += 3.*noiseLevel
+        relativeModel /= smoothRef
+        # Now sharpen the smoothed relativeModel using an alpha of 3.
+        alpha = 3.
+        relativeModel2 = ndimage.filters.gaussian_filter(relativeModel,
+                                                         (0, filterWidth/alpha, filterWidth/alpha))
+        # relativeModel += alpha*(relativeModel - relativeModel2), without temporaries
+        relativeModel2 -= relativeModel
+        relativeModel2 *= -alpha
+        relativeModel += relativeModel2
+        np.multiply(relativeModel, referenceImage, out=newPlanes)
+        _unstackPlanes(newPlanes, modelImages)
 
     def calculateNoiseCutoff(self, image, statsCtrl, bufferSize,
                              convergenceMaskPlanes="DETECTED", mask=None, bbox=None):
@@ -553,7 +1290,8 @@ class DcrModel:
         Parameters
         ----------
         image : `numpy.ndarray`
-            The image to apply the thresholds to.
+            The image to apply the thresholds to, or a (subfilter, y, x) array
+            of images to apply the same thresholds to.
             The values will be modified in place.
         highThreshold : `numpy.ndarray`, optional
             Array of upper limit values for each pixel of ``image``.
@@ -567,22 +1305,235 @@ class DcrModel:
         # will be excluded from regularization.
         filterStructure = ndimage.iterate_structure(ndimage.generate_binary_structure(2, 1),
                                                     regularizationWidth)
+        if image.ndim == 3:
+            # Do not connect pixels of different subfilters
+            filterStructure = filterStructure[np.newaxis, :, :]
         if highThreshold is not None:
             highPixels = image > highThreshold
             if regularizationWidth > 0:
                 # Erode and dilate ``highPixels`` to exclude noisy pixels.
                 highPixels = ndimage.morphology.binary_opening(highPixels, structure=filterStructure)
-            image[highPixels] = highThreshold[highPixels]
+            np.copyto(image, highThreshold, where=highPixels, casting='unsafe')
         if lowThreshold is not None:
             lowPixels = image < lowThreshold
             if regularizationWidth > 0:
                 # Erode and dilate ``lowPixels`` to exclude noisy pixels.
                 lowPixels = ndimage.morphology.binary_opening(lowPixels, structure=filterStructure)
-            image[lowPixels] = lowThreshold[lowPixels]
+            np.copyto(image, lowThreshold, where=lowPixels, casting='unsafe')
+
+
+class _IncrementalTemplate:
+    """The shifted subfilters of the last incremental template of a `DcrModel`.
+
+    Parameters
+    ----------
+    key : `tuple`
+        The bounding box and shift options of the template.
+    dcrNumSubfilters : `int`
+        Number of sub-filters used to model chromatic effects within a band.
+    """
+
+    def __init__(self, key, dcrNumSubfilters):
+        self.key = key
+        self.dcrShifts = [None]*dcrNumSubfilters
+        self.shiftedModels = [None]*dcrNumSubfilters
+
+
+def _makeTiles(shape, tileSize, halo):
+    """Divide an image into square tiles, each extended by a halo.
+
+    Parameters
+    ----------
+    shape : `tuple` of two `int`
+        Shape of the image.
+    tileSize : `int`
+        Size of the tiles, in pixels.
+    halo : `int`
+        Number of pixels by which to extend each tile, within the image.
+
+    Returns
+    -------
+    tiles : `list` of `tuple`
+        For each tile, the slices of the tile in the image, and the slices
+        of the tile extended by the halo.
+    """
+    tiles = []
+    for y0 in range(0, shape[0], tileSize):
+        for x0 in range(0, shape[1], tileSize):
+            tileSlices = (slice(y0, min(y0 + tileSize, shape[0])), slice(x0, min(x0 + tileSize, shape[1])))
+            haloSlices = tuple(slice(max(tile.start - halo, 0), min(tile.stop + halo, size))
+                               for tile, size in zip(tileSlices, shape))
+            tiles.append((tileSlices, haloSlices))
+    return tiles
+
+
+def _shiftTile(prefilteredModels, refModel, dcrShift, templateImage, tileSlices, haloSlices,
+               order=3, splitSubfilters=True, splitThreshold=0., amplifyModel=1.):
+    """Shift and sum the prefiltered subfilters of a model over one tile.
+
+    Parameters
+    ----------
+    prefilteredModels : `list` of `numpy.ndarray`
+        Spline-prefiltered planes of the model.
+    refModel : `numpy.ndarray` or `None`
+        Average of ``prefilteredModels``, required if ``amplifyModel > 1``.
+    dcrShift : `list`
+        Shift of each subfilter, calculated with ``calculateDcr``.
+    templateImage : `numpy.ndarray`
+        Template to write the tile of the shifted model to.
+    tileSlices : `tuple` of two `slice`
+        Region of ``templateImage`` to compute.
+    haloSlices : `tuple` of two `slice`
+        Region of the model containing ``tileSlices`` and every pixel
+        contributing to it after the shift.
+    order : `int`, optional
+        Interpolation order of the DCR shift.
+    splitSubfilters : `bool`, optional
+        ``dcrShift`` was calculated for two wavelengths in each subfilter.
+    splitThreshold : `float`, optional
+        Minimum DCR difference within a subfilter required to use ``splitSubfilters``
+    amplifyModel : `float`, optional
+        Multiplication factor to amplify differences between model planes.
+    """
+    # Location of the tile within the halo region
+    innerSlices = tuple(slice(tile.start - halo.start if tile.start is not None else None,
+                              tile.stop - halo.start if tile.stop is not None else None)
+                        for tile, halo in zip(tileSlices, haloSlices))
+    # Buffers shared by the subfilters, with the precision of the template
+    haloShape = prefilteredModels[0][haloSlices].shape
+    shiftedModel = np.empty(haloShape, dtype=templateImage.dtype)
+    if amplifyModel > 1:
+        ref = refModel[haloSlices]
+        model = np.empty(haloShape, dtype=templateImage.dtype)
+    for subfilter, dcr in enumerate(dcrShift):
+        if amplifyModel > 1:
+            _amplifyPlane(prefilteredModels[subfilter][haloSlices], ref, amplifyModel, out=model)
+        else:
+            model = prefilteredModels[subfilter][haloSlices]
+        applyDcr(model, dcr, splitSubfilters=splitSubfilters, splitThreshold=splitThreshold,
+                 doPrefilter=False, order=order, output=shiftedModel)
+        templateImage[tileSlices] += shiftedModel[innerSlices]
+
+
+def _meanOfPlanes(planes, dtype, out=None, scale=None):
+    """Average a sequence of planes, using a single accumulator.
+
+    Parameters
+    ----------
+    planes : sequence of `numpy.ndarray`
+        Planes of the same shape, for example the subfilters of a model.
+    dtype : `numpy.dtype`
+        Precision of the accumulator, if ``out`` is not set.
+    out : `numpy.ndarray`, optional
+        Preallocated accumulator to write the average to.
+    scale : `float`, optional
+        Multiply the average by this factor, for example the number of
+        planes to return their sum. Defaults to 1.
+
+    Returns
+    -------
+    mean : `numpy.ndarray`
+        The average of ``planes``, times ``scale``.
+    """
+    if out is None:
+        out = np.empty(planes[0].shape, dtype=dtype)
+    np.copyto(out, planes[0], casting='unsafe')
+    for plane in planes[1:]:
+        np.add(out, plane, out=out, casting='unsafe')
+    factor = 1./len(planes) if scale is None else scale/len(planes)
+    if factor != 1.:
+        out *= factor
+    return out
+
+
+def _amplifyPlane(plane, refPlane, amplifyModel, out):
+    """Amplify the difference between a plane and a reference, into ``out``.
+
+    Computes ``(plane - refPlane)*amplifyModel + refPlane`` without temporaries.
+
+    Parameters
+    ----------
+    plane : `numpy.ndarray`
+        One plane of the model.
+    refPlane : `numpy.ndarray`
+        The average of the planes of the model.
+    amplifyModel : `float`
+        Multiplication factor to amplify differences between model planes.
+    out : `numpy.ndarray`
+        Preallocated array to write the amplified plane to.
+
+    Returns
+    -------
+    out : `numpy.ndarray`
+        The amplified plane.
+    """
+    np.subtract(plane, refPlane, out=out, casting='unsafe')
+    out *= amplifyModel
+    out += refPlane
+    return out
+
+
+def _stackPlanes(modelImages):
+    """Return DCR model images as a single (subfilter, y, x) array.
+
+    Parameters
+    ----------
+    modelImages : `list` of `lsst.afw.image.Image`, `DcrModel`, or `numpy.ndarray`
+        The model images.
+
+    Returns
+    -------
+    planes : `numpy.ndarray`
+        A view of the planes of an array or of a stacked `DcrModel`, or a
+        copy of the planes of a list of images or other `DcrModel`.
+    """
+    if isinstance(modelImages, DcrModel) and modelImages._planes is not None:
+        return modelImages.getPlanes()
+    if isinstance(modelImages, np.ndarray):
+        return modelImages
+    return np.stack([model.array for model in modelImages])
+
+
+def _unstackPlanes(planes, modelImages):
+    """Copy planes returned by ``_stackPlanes`` back to the model images.
+
+    Parameters
+    ----------
+    planes : `numpy.ndarray`
+        The (subfilter, y, x) array returned by ``_stackPlanes``.
+    modelImages : `list` of `lsst.afw.image.Image`, `DcrModel`, or `numpy.ndarray`
+        The model images passed to ``_stackPlanes``.
+    """
+    if isinstance(modelImages, np.ndarray):
+        return
+    if not (isinstance(modelImages, DcrModel) and planes is modelImages._planes):
+        for model, plane in zip(modelImages, planes):
+            model.array[:] = plane
+    if isinstance(modelImages, DcrModel):
+        modelImages.clearCache()
+
+
+def _makePlaneImages(planes, xy0):
+    """Return images that are views of the planes of an array.
+
+    Parameters
+    ----------
+    planes : `numpy.ndarray`
+        A float32 or float64 (subfilter, y, x) array.
+    xy0 : `lsst.geom.Point2I`
+        Origin of the images.
+
+    Returns
+    -------
+    modelImages : `list` of `lsst.afw.image.Image`
+        One image per subfilter, sharing the pixels of ``planes``.
+    """
+    imageType = afwImage.ImageF if planes.dtype == np.float32 else afwImage.ImageD
+    return [imageType(plane, deep=False, xy0=xy0) for plane in planes]
 
 
 def applyDcr(image, dcr, useInverse=False, splitSubfilters=False, splitThreshold=0.,
-             doPrefilter=True, order=3):
+             doPrefilter=True, order=3, output=None):
     """Shift an image along the X and Y directions.
 
     Parameters
@@ -611,16 +1562,23 @@ def applyDcr(image, dcr, useInverse=False, splitSubfilters=False, splitThreshold
         the filter.
     order : `int`, optional
         The order of the spline interpolation, default is 3.
+    output : `numpy.ndarray`, optional
+        Preallocated array with the shape of ``image`` to write the shifted
+        image to. If `None`, a new array is returned, with the dtype of the
+        (prefiltered) image.
 
     Returns
     -------
     shiftedImage : `numpy.ndarray`
-        A copy of the input image with the specified shift applied.
+        A copy of the input image with the specified shift applied,
+        or ``output`` if it is set.
     """
     if doPrefilter:
         prefilteredImage = ndimage.spline_filter(image, order=order)
     else:
         prefilteredImage = image
+    if output is None:
+        output = np.empty(image.shape, dtype=prefilteredImage.dtype)
     if splitSubfilters:
         shiftAmp = np.max(np.abs([_dcr0 - _dcr1 for _dcr0, _dcr1 in zip(dcr[0], dcr[1])]))
         if shiftAmp >= splitThreshold:
@@ -630,23 +1588,137 @@ def applyDcr(image, dcr, useInverse=False, splitSubfilters=False, splitThreshold
             else:
                 shift = dcr[0]
                 shift1 = dcr[1]
-            shiftedImage = ndimage.shift(prefilteredImage, shift, prefilter=False, order=order)
-            shiftedImage += ndimage.shift(prefilteredImage, shift1, prefilter=False, order=order)
-            shiftedImage /= 2.
-            return shiftedImage
+            ndimage.shift(prefilteredImage, shift, output=output, prefilter=False, order=order)
+            output += ndimage.shift(prefilteredImage, shift1, output=output.dtype, prefilter=False,
+                                    order=order)
+            output /= 2.
+            return output
         else:
             # If the difference in the DCR shifts is less than the threshold,
             # then just use the average shift for efficiency.
-            dcr = (np.mean(dcr[0]), np.mean(dcr[1]))
+            dcr = np.mean(dcr, axis=0)
     if useInverse:
         shift = [-1.*s for s in dcr]
     else:
         shift = dcr
-    shiftedImage = ndimage.shift(prefilteredImage, shift, prefilter=False, order=order)
-    return shiftedImage
+    ndimage.shift(prefilteredImage, shift, output=output, prefilter=False, order=order)
+    return output
+
+
+def fourierShiftKernel(frequencies, dcr, useInverse=False, splitSubfilters=False, splitThreshold=0.):
+    """Calculate the Fourier space kernel that shifts an image.
+
+    Parameters
+    ----------
+    frequencies : `tuple` of two `numpy.ndarray`
+        Sample frequencies along the Y and X axes of the transformed image,
+        for example from ``numpy.fft.fftfreq`` and ``numpy.fft.rfftfreq``.
+    dcr : `tuple`
+        Shift calculated with ``calculateDcr``, see ``applyDcr``.
+    useInverse : `bool`, optional
+        Apply the shift in the opposite direction. Default: False
+    splitSubfilters : `bool`, optional
+        Calculate DCR for two evenly-spaced wavelengths in each subfilter,
+        instead of at the midpoint. Default: False
+    splitThreshold : `float`, optional
+        Minimum DCR difference within a subfilter required to use ``splitSubfilters``
+
+    Returns
+    -------
+    kernel : `numpy.ndarray`
+        Complex phase ramp to multiply the transformed image by.
+        If ``splitSubfilters`` is set, the average of the ramps of the two
+        wavelengths, so both shifts are applied with one inverse transform.
+    """
+    sign = 1. if useInverse else -1.
+
+    def phaseRamp(shift):
+        # The ramp is separable, so only evaluate the exponential along each axis
+        rampY = np.exp(sign*2j*np.pi*frequencies[0]*shift[0])
+        rampX = np.exp(sign*2j*np.pi*frequencies[1]*shift[1])
+        return np.outer(rampY, rampX)
+
+    if splitSubfilters:
+        shiftAmp = np.max(np.abs([_dcr0 - _dcr1 for _dcr0, _dcr1 in zip(dcr[0], dcr[1])]))
+        if shiftAmp >= splitThreshold:
+            kernel = phaseRamp(dcr[0])
+            kernel += phaseRamp(dcr[1])
+            kernel /= 2.
+            return kernel
+        # If the difference in the DCR shifts is less than the threshold,
+        # then just use the average shift for efficiency.
+        dcr = np.mean(dcr, axis=0)
+    return phaseRamp(dcr)
+
+
+class DcrShiftCache:
+    """Least-recently-used cache of the DCR shift tables of observations.
+
+    An entry holds the parallactic angle of an observation and the
+    differential refraction in pixels at both wavelength endpoints of each
+    subfilter. Entries are keyed on the exposure id, filter, number of
+    subfilters and pixel scale, together with the pointing, date, observatory
+    and weather of the observation, so that visitInfos sharing an exposure id
+    but describing different observations do not collide. The rotation of the
+    WCS is applied to the cached table, so one entry serves every patch and
+    tract the exposure overlaps. The cache may be shared between threads.
+
+    Parameters
+    ----------
+    maxSize : `int`, optional
+        Maximum number of entries to keep.
+    """
+
+    def __init__(self, maxSize=256):
+        self.maxSize = maxSize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached shift table for `key`, or `None` if it is absent.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, value):
+        """Store `value` for `key`, evicting the least recently used entry if full.
+        """
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries and reset the hit and miss counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_dcrShiftCache = DcrShiftCache()
 
 
-def calculateDcr(visitInfo, wcs, filterInfo, dcrNumSubfilters, splitSubfilters=False):
+def getDcrShiftCache():
+    """Return the process-wide `DcrShiftCache` used by default.
+    """
+    return _dcrShiftCache
+
+
+def calculateDcr(visitInfo, wcs, filterInfo, dcrNumSubfilters, splitSubfilters=False, cache=None):
     """Calculate the shift in pixels of an exposure due to DCR.
 
     Parameters
@@ -662,6 +1734,9 @@ def calculateDcr(visitInfo, wcs, filterInfo, dcrNumSubfilters, splitSubfilters=F
     splitSubfilters : `bool`, optional
         Calculate DCR for two evenly-spaced wavelengths in each subfilter,
         instead of at the midpoint. Default: False
+    cache : `DcrShiftCache`, optional
+        Cache of shift tables to use; defaults to the process-wide cache
+        returned by `getDcrShiftCache`.
 
     Returns
     -------
@@ -669,37 +1744,106 @@ def calculateDcr(visitInfo, wcs, filterInfo, dcrNumSubfilters, splitSubfilters=F
         The 2D shift due to DCR, in pixels.
         Uses numpy axes ordering (Y, X).
     """
-    rotation = calculateImageParallacticAngle(visitInfo, wcs)
+    cache = _dcrShiftCache if cache is None else cache
+    pixelScale = wcs.getPixelScale().asArcseconds()
+    key = _dcrShiftKey(visitInfo, filterInfo, dcrNumSubfilters, pixelScale)
+    shiftTable = cache.get(key)
+    if shiftTable is None:
+        shiftTable = _calculateDcrShiftTable(visitInfo, filterInfo, dcrNumSubfilters, pixelScale)
+        cache.put(key, shiftTable)
+    parAngle, diffRefractTable = shiftTable
+    rotation = _calculateImageRotation(parAngle, wcs).asRadians()
     dcrShift = []
     weight = [0.75, 0.25]
-    lambdaEff = filterInfo.getFilterProperty().getLambdaEff()
-    for wl0, wl1 in wavelengthGenerator(filterInfo, dcrNumSubfilters):
-        # Note that diffRefractAmp can be negative, since it's relative to the midpoint of the full band
-        diffRefractAmp0 = differentialRefraction(wavelength=wl0, wavelengthRef=lambdaEff,
-                                                 elevation=visitInfo.getBoresightAzAlt().getLatitude(),
-                                                 observatory=visitInfo.getObservatory(),
-                                                 weather=visitInfo.getWeather())
-        diffRefractAmp1 = differentialRefraction(wavelength=wl1, wavelengthRef=lambdaEff,
-                                                 elevation=visitInfo.getBoresightAzAlt().getLatitude(),
-                                                 observatory=visitInfo.getObservatory(),
-                                                 weather=visitInfo.getWeather())
+    for diffRefractPix0, diffRefractPix1 in diffRefractTable:
         if splitSubfilters:
-            diffRefractPix0 = diffRefractAmp0.asArcseconds()/wcs.getPixelScale().asArcseconds()
-            diffRefractPix1 = diffRefractAmp1.asArcseconds()/wcs.getPixelScale().asArcseconds()
             diffRefractArr = [diffRefractPix0*weight[0] + diffRefractPix1*weight[1],
                               diffRefractPix0*weight[1] + diffRefractPix1*weight[0]]
-            shiftX = [diffRefractPix*np.sin(rotation.asRadians()) for diffRefractPix in diffRefractArr]
-            shiftY = [diffRefractPix*np.cos(rotation.asRadians()) for diffRefractPix in diffRefractArr]
+            shiftX = [diffRefractPix*np.sin(rotation) for diffRefractPix in diffRefractArr]
+            shiftY = [diffRefractPix*np.cos(rotation) for diffRefractPix in diffRefractArr]
             dcrShift.append(((shiftY[0], shiftX[0]), (shiftY[1], shiftX[1])))
         else:
-            diffRefractAmp = (diffRefractAmp0 + diffRefractAmp1)/2.
-            diffRefractPix = diffRefractAmp.asArcseconds()/wcs.getPixelScale().asArcseconds()
-            shiftX = diffRefractPix*np.sin(rotation.asRadians())
-            shiftY = diffRefractPix*np.cos(rotation.asRadians())
+            diffRefractPix = (diffRefractPix0 + diffRefractPix1)/2.
+            shiftX = diffRefractPix*np.sin(rotation)
+            shiftY = diffRefractPix*np.cos(rotation)
             dcrShift.append((shiftY, shiftX))
     return dcrShift
 
 
+def _dcrShiftKey(visitInfo, filterInfo, dcrNumSubfilters, pixelScale):
+    """Build the `DcrShiftCache` key of an observation.
+
+    Parameters
+    ----------
+    visitInfo : `lsst.afw.image.VisitInfo`
+        Metadata for the exposure.
+    filterInfo : `lsst.afw.image.Filter`
+        The filter definition, set in the current instruments' obs package.
+    dcrNumSubfilters : `int`
+        Number of sub-filters used to model chromatic effects within a band.
+    pixelScale : `float`
+        Pixel scale of the exposure, in arcseconds.
+
+    Returns
+    -------
+    key : `tuple`
+        Hashable key of the shift table.
+    """
+    azAlt = visitInfo.getBoresightAzAlt()
+    raDec = visitInfo.getBoresightRaDec()
+    observatory = visitInfo.getObservatory()
+    weather = visitInfo.getWeather()
+    # Pack the floating point values as bytes, so that NaN values compare equal
+    values = np.array([pixelScale, azAlt.getLongitude().asRadians(), azAlt.getLatitude().asRadians(),
+                       raDec.getLongitude().asRadians(), raDec.getLatitude().asRadians(),
+                       visitInfo.getDate().nsecs(), observatory.getLongitude().asRadians(),
+                       observatory.getLatitude().asRadians(), observatory.getElevation(),
+                       weather.getAirTemperature(), weather.getAirPressure(), weather.getHumidity()],
+                      dtype=float)
+    return (visitInfo.getExposureId(), filterInfo.getName(), dcrNumSubfilters, values.tobytes())
+
+
+def _calculateDcrShiftTable(visitInfo, filterInfo, dcrNumSubfilters, pixelScale):
+    """Calculate the parallactic angle and the differential refraction of
+    each subfilter of an observation.
+
+    Parameters
+    ----------
+    visitInfo : `lsst.afw.image.VisitInfo`
+        Metadata for the exposure.
+    filterInfo : `lsst.afw.image.Filter`
+        The filter definition, set in the current instruments' obs package.
+    dcrNumSubfilters : `int`
+        Number of sub-filters used to model chromatic effects within a band.
+    pixelScale : `float`
+        Pixel scale of the exposure, in arcseconds.
+
+    Returns
+    -------
+    parAngle : `float`
+        The parallactic angle of the observation, in radians.
+    diffRefractTable : `tuple` of `tuple` of two `float`
+        The differential refraction at the wavelength endpoints of each
+        subfilter, in pixels.
+    """
+    lambdaEff = filterInfo.getFilterProperty().getLambdaEff()
+    elevation = visitInfo.getBoresightAzAlt().getLatitude()
+    observatory = visitInfo.getObservatory()
+    weather = visitInfo.getWeather()
+    diffRefractTable = []
+    for wl0, wl1 in wavelengthGenerator(filterInfo, dcrNumSubfilters):
+        # Note that diffRefractAmp can be negative, since it's relative to the midpoint of the full band
+        diffRefractAmp0 = differentialRefraction(wavelength=wl0, wavelengthRef=lambdaEff,
+                                                 elevation=elevation, observatory=observatory,
+                                                 weather=weather)
+        diffRefractAmp1 = differentialRefraction(wavelength=wl1, wavelengthRef=lambdaEff,
+                                                 elevation=elevation, observatory=observatory,
+                                                 weather=weather)
+        diffRefractTable.append((diffRefractAmp0.asArcseconds()/pixelScale,
+                                 diffRefractAmp1.asArcseconds()/pixelScale))
+    return visitInfo.getBoresightParAngle().asRadians(), tuple(diffRefractTable)
+
+
 def calculateImageParallacticAngle(visitInfo, wcs):
     """Calculate the total sky rotation angle of an exposure.
 
@@ -721,7 +1865,25 @@ def calculateImageParallacticAngle(visitInfo, wcs):
         A rotation angle of 90 degrees is defined with
         North along the +x axis and East along the -y axis.
     """
-    parAngle = visitInfo.getBoresightParAngle().asRadians()
+    return _calculateImageRotation(visitInfo.getBoresightParAngle().asRadians(), wcs)
+
+
+def _calculateImageRotation(parAngle, wcs):
+    """Combine the parallactic angle with the rotation of a WCS.
+
+    Parameters
+    ----------
+    parAngle : `float`
+        The parallactic angle of the observation, in radians.
+    wcs : `lsst.afw.geom.SkyWcs`
+        Coordinate system definition (wcs) for the exposure.
+
+    Returns
+    -------
+    `lsst.geom.Angle`
+        The rotation of the image axis, East from North.
+        See ``calculateImageParallacticAngle``.
+    """
     cd = wcs.getCdMatrix()
     if wcs.isFlipped:
         cdAngle = (np.arctan2(-cd[0, 1], cd[0, 0]) + np.arctan2(cd[1, 0], cd[1, 1]))/2.
@@ -749,6 +1911,27 @@ def wavelengthGenerator(filterInfo, dcrNumSubfilters):
     """
     lambdaMin = filterInfo.getFilterProperty().getLambdaMin()
     lambdaMax = filterInfo.getFilterProperty().getLambdaMax()
+    yield from _subfilterWavelengths(lambdaMin, lambdaMax, dcrNumSubfilters)
+
+
+@functools.lru_cache(maxsize=64)
+def _subfilterWavelengths(lambdaMin, lambdaMax, dcrNumSubfilters):
+    """Calculate the wavelength endpoints of the subfilters of a band.
+
+    Parameters
+    ----------
+    lambdaMin : `float`
+        Minimum wavelength of the band, in nm.
+    lambdaMax : `float`
+        Maximum wavelength of the band, in nm.
+    dcrNumSubfilters : `int`
+        Number of sub-filters used to model chromatic effects within a band.
+
+    Returns
+    -------
+    wavelengths : `tuple` of `tuple` of two `float`
+        The wavelength endpoints of each subfilter, in nm.
+    """
     wlStep = (lambdaMax - lambdaMin)/dcrNumSubfilters
-    for wl in np.linspace(lambdaMin, lambdaMax, dcrNumSubfilters, endpoint=False):
-        yield (wl, wl + wlStep)
+    return tuple((wl, wl + wlStep)
+                 for wl in np.linspace(lambdaMin, lambdaMax, dcrNumSubfilters, endpoint=False))
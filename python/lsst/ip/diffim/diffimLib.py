@@ -32,6 +32,7 @@ from .imageSubtract import *
 from .kernelCandidate import *
 from .kernelCandidateDetection import *
 from .kernelSolution import *
+from .psfImageCache import *
 
 from .deprecated import deprecate_policy as _deprecate_policy
 
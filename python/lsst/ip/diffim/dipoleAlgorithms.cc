@@ -62,6 +62,10 @@ void declareDipolePsfFluxControl(py::module &mod) {
     LSST_DECLARE_CONTROL_FIELD(cls, PsfDipoleFluxControl, stepSizeFlux);
     LSST_DECLARE_CONTROL_FIELD(cls, PsfDipoleFluxControl, errorDef);
     LSST_DECLARE_CONTROL_FIELD(cls, PsfDipoleFluxControl, maxFnCalls);
+    LSST_DECLARE_CONTROL_FIELD(cls, PsfDipoleFluxControl, psfOversampling);
+    LSST_DECLARE_CONTROL_FIELD(cls, PsfDipoleFluxControl, usePsfImageCache);
+    LSST_DECLARE_CONTROL_FIELD(cls, PsfDipoleFluxControl, psfImageCacheSubpixelGrid);
+    LSST_DECLARE_CONTROL_FIELD(cls, PsfDipoleFluxControl, badMaskPlanes);
 }
 
 void declareDipoleCentroidAlgorithm(py::module &mod) {
@@ -132,6 +136,7 @@ void declarePsfDipoleFlux(py::module &mod) {
     cls.def("chi2", &PsfDipoleFlux::chi2, "source"_a, "exposure"_a, "negCenterX"_a, "negCenterY"_a,
             "negFlux"_a, "posCenterX"_a, "posCenterY"_a, "posFlux"_a);
     cls.def("measure", &PsfDipoleFlux::measure, "measRecord"_a, "exposure"_a);
+    cls.def("measureAll", &PsfDipoleFlux::measureAll, "measCat"_a, "exposure"_a, "numThreads"_a = 1);
     cls.def("fail", &PsfDipoleFlux::fail, "measRecord"_a, "error"_a = NULL);
 }
 
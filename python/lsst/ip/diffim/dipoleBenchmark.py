@@ -0,0 +1,294 @@
+# This file is part of ip_diffim.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Throughput benchmarks of the dipole measurement algorithms.
+
+`DipoleBenchmarkTask` simulates a difference image with
+`lsst.ip.diffim.utils.DipoleTestImage`, with a configurable density,
+separation and signal-to-noise of the dipoles and size of their
+footprints, then times `DipoleFitTask.run`, `PsfDipoleFlux` and
+`NaiveDipoleCentroid` per source and per catalog. The results are
+plain dictionaries that `writeBenchmarkResults` writes as JSON, so that
+they can be compared between releases.
+"""
+
+import datetime
+import json
+import platform
+import time
+
+import numpy as np
+
+import lsst.afw.table as afwTable
+import lsst.meas.base as measBase
+import lsst.pex.config as pexConfig
+import lsst.pipe.base as pipeBase
+
+from .diffimLib import DipoleCentroidControl, NaiveDipoleCentroid, PsfDipoleFlux, PsfDipoleFluxControl
+from .dipoleFitTask import DipoleFitPluginConfig, DipoleFitTask
+from .utils import DipoleTestImage
+
+__all__ = ("DipoleBenchmarkConfig", "DipoleBenchmarkTask", "writeBenchmarkResults")
+
+BENCHMARK_ALGORITHMS = ("DipoleFitTask", "PsfDipoleFlux", "NaiveDipoleCentroid")
+
+
+class DipoleBenchmarkConfig(pexConfig.Config):
+    """Configuration for DipoleBenchmarkTask
+    """
+    imageSize = pexConfig.Field(
+        dtype=int, default=512,
+        doc="Width and height of the simulated difference image (pixels)",
+        check=lambda x: x >= 64)
+    sourceDensity = pexConfig.Field(
+        dtype=float, default=1.,
+        doc="Number of dipoles per 100x100 pixels",
+        check=lambda x: x > 0.)
+    separation = pexConfig.Field(
+        dtype=float, default=2.,
+        doc="Separation of the positive and negative lobes of the dipoles, in units of the PSF sigma",
+        check=lambda x: x >= 0.)
+    signalToNoise = pexConfig.Field(
+        dtype=float, default=50.,
+        doc="Signal-to-noise ratio of each lobe of the dipoles",
+        check=lambda x: x > 0.)
+    footprintGrow = pexConfig.Field(
+        dtype=int, default=3,
+        doc="Number of pixels by which the detected footprints are grown before merging; sets the "
+            "size of the footprints that are fit",
+        check=lambda x: x >= 0)
+    psfSigma = pexConfig.Field(
+        dtype=float, default=2.,
+        doc="Sigma of the Gaussian PSF (pixels)")
+    noise = pexConfig.Field(
+        dtype=float, default=10.,
+        doc="Standard deviation of the noise of the pre-subtraction images")
+    numRepeats = pexConfig.Field(
+        dtype=int, default=3,
+        doc="Number of times each algorithm is run on the catalog",
+        check=lambda x: x >= 1)
+    randomSeed = pexConfig.Field(
+        dtype=int, default=12345,
+        doc="Seed of the random positions and orientations of the dipoles")
+    algorithms = pexConfig.ListField(
+        dtype=str, default=list(BENCHMARK_ALGORITHMS),
+        doc="Algorithms to time; any of %s" % (BENCHMARK_ALGORITHMS,),
+        itemCheck=lambda x: x in BENCHMARK_ALGORITHMS)
+    dipoleFit = pexConfig.ConfigField(
+        dtype=DipoleFitPluginConfig,
+        doc="Configuration of the dipole fit timed by DipoleFitTask")
+
+
+class DipoleBenchmarkTask(pipeBase.Task):
+    """Time the dipole measurement algorithms on a simulated difference image.
+
+    Notes
+    -----
+    The dipoles are placed on a jittered grid, with random orientations,
+    so that their footprints do not overlap. Each algorithm measures a new
+    catalog with the same footprints in each repeat. For `DipoleFitTask`,
+    the per-source times are those of `DipoleFitPlugin.measure`, run after
+    the timed `DipoleFitTask.run`.
+    """
+    ConfigClass = DipoleBenchmarkConfig
+    _DefaultName = "ip_diffim_dipoleBenchmark"
+
+    def makeTestImage(self):
+        """Simulate the difference image and pre-subtraction images.
+
+        Returns
+        -------
+        testImage : `lsst.ip.diffim.utils.DipoleTestImage`
+            The simulated images.
+        numDipoles : `int`
+            Number of simulated dipoles.
+        """
+        config = self.config
+        rng = np.random.RandomState(config.randomSeed)
+        numDipoles = max(1, int(round(config.sourceDensity*config.imageSize**2/1e4)))
+
+        # Cells of a grid, far enough from the edges to fit the footprints
+        margin = 5.*config.psfSigma + config.separation*config.psfSigma/2. + config.footprintGrow
+        numCells = int(np.ceil(np.sqrt(numDipoles)))
+        cellSize = (config.imageSize - 2.*margin)/numCells
+        cells = rng.permutation(numCells**2)[:numDipoles]
+        xc = margin + (cells % numCells + 0.5 + rng.uniform(-0.25, 0.25, numDipoles))*cellSize
+        yc = margin + (cells // numCells + 0.5 + rng.uniform(-0.25, 0.25, numDipoles))*cellSize
+
+        angle = rng.uniform(0., 2.*np.pi, numDipoles)
+        offset = 0.5*config.separation*config.psfSigma
+        dx, dy = offset*np.cos(angle), offset*np.sin(angle)
+
+        # Flux for which the S/N of a Gaussian PSF, measured optimally, is signalToNoise
+        flux = config.signalToNoise*config.noise*np.sqrt(4.*np.pi)*config.psfSigma
+
+        testImage = DipoleTestImage(w=config.imageSize, h=config.imageSize,
+                                    xcenPos=list(xc + dx), ycenPos=list(yc + dy),
+                                    xcenNeg=list(xc - dx), ycenNeg=list(yc - dy),
+                                    psfSigma=config.psfSigma, flux=[flux]*numDipoles, noise=config.noise)
+        return testImage, numDipoles
+
+    @pipeBase.timeMethod
+    def run(self):
+        """Simulate the images and time the configured algorithms.
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            Struct containing:
+
+            - ``results`` : the benchmark results, as a `dict` holding the
+              ``parameters`` of the benchmark, a description of the
+              ``environment``, the ``numDipoles`` simulated and the
+              ``footprints`` detected, and the ``timings`` of each
+              algorithm (`dict`)
+        """
+        testImage, numDipoles = self.makeTestImage()
+        sources = testImage.detectDipoleSources(doMerge=True, grow=self.config.footprintGrow)
+        footprints = [source.getFootprint() for source in sources]
+        self.log.info("Simulated %d dipoles; detected %d footprints", numDipoles, len(footprints))
+
+        timings = {}
+        for name in self.config.algorithms:
+            timeAlgorithm = getattr(self, "_time" + name)
+            catalogTimes, sourceTimes = [], []
+            for i in range(self.config.numRepeats):
+                catalogTime, times = timeAlgorithm(testImage, footprints)
+                catalogTimes.append(catalogTime)
+                sourceTimes.extend(times)
+            timings[name] = self._summarize(catalogTimes, sourceTimes, len(footprints))
+            self.log.info("%s: %.4g s per catalog, %.4g s per source", name,
+                          timings[name]["catalogTime"]["min"], timings[name]["sourceTime"]["median"])
+
+        areas = [fp.getArea() for fp in footprints]
+        results = dict(
+            parameters=self.config.toDict(),
+            environment=dict(python=platform.python_version(), numpy=np.__version__,
+                             machine=platform.machine(), platform=platform.platform(),
+                             date=datetime.datetime.utcnow().isoformat()),
+            numDipoles=numDipoles,
+            footprints=dict(number=len(footprints),
+                            meanArea=float(np.mean(areas)) if areas else 0.,
+                            maxArea=int(np.max(areas)) if areas else 0),
+            timings=timings,
+        )
+        return pipeBase.Struct(results=results)
+
+    @staticmethod
+    def _summarize(catalogTimes, sourceTimes, numSources):
+        """Summarize the timings of one algorithm, in seconds.
+        """
+        sourceTimes = np.array(sourceTimes) if sourceTimes else np.array([np.nan])
+        return dict(
+            numSources=numSources,
+            catalogTime=dict(min=float(np.min(catalogTimes)), median=float(np.median(catalogTimes)),
+                             all=[float(t) for t in catalogTimes]),
+            perSourceCatalogTime=float(np.min(catalogTimes))/max(numSources, 1),
+            sourceTime=dict(median=float(np.median(sourceTimes)), mean=float(np.mean(sourceTimes)),
+                            p90=float(np.percentile(sourceTimes, 90.)), max=float(np.max(sourceTimes))),
+        )
+
+    @staticmethod
+    def _makeCatalog(schema, footprints):
+        """Return a new catalog with one record per footprint.
+        """
+        catalog = afwTable.SourceCatalog(schema)
+        for fp in footprints:
+            catalog.addNew().setFootprint(fp)
+        return catalog
+
+    @staticmethod
+    def _makePluginSchema():
+        """Return a minimal schema with a centroid slot, as needed by the C++ plugins.
+        """
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        schema.addField("centroid_x", type=float)
+        schema.addField("centroid_y", type=float)
+        schema.addField("centroid_flag", type="Flag")
+        schema.getAliasMap().set("slot_Centroid", "centroid")
+        return schema
+
+    def _timePlugin(self, plugin, schema, exposure, footprints):
+        """Time a C++ dipole plugin on each record of a new catalog.
+        """
+        catalog = self._makeCatalog(schema, footprints)
+        times = []
+        start = time.perf_counter()
+        for record in catalog:
+            t0 = time.perf_counter()
+            plugin.measure(record, exposure)
+            times.append(time.perf_counter() - t0)
+        return time.perf_counter() - start, times
+
+    def _timePsfDipoleFlux(self, testImage, footprints):
+        schema = self._makePluginSchema()
+        plugin = PsfDipoleFlux(PsfDipoleFluxControl(), "ip_diffim_PsfDipoleFlux", schema)
+        return self._timePlugin(plugin, schema, testImage.diffim, footprints)
+
+    def _timeNaiveDipoleCentroid(self, testImage, footprints):
+        schema = self._makePluginSchema()
+        plugin = NaiveDipoleCentroid(DipoleCentroidControl(), "ip_diffim_NaiveDipoleCentroid", schema)
+        return self._timePlugin(plugin, schema, testImage.diffim, footprints)
+
+    def _timeDipoleFitTask(self, testImage, footprints):
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        measureConfig = measBase.SingleFrameMeasurementConfig()
+        measureConfig.slots.calibFlux = None
+        measureConfig.slots.modelFlux = None
+        measureConfig.slots.gaussianFlux = None
+        measureConfig.slots.shape = None
+        measureConfig.slots.centroid = "ip_diffim_NaiveDipoleCentroid"
+        measureConfig.doReplaceWithNoise = False
+        measureConfig.plugins.names = ["base_CircularApertureFlux",
+                                       "base_PixelFlags",
+                                       "base_SkyCoord",
+                                       "base_PsfFlux",
+                                       "ip_diffim_NaiveDipoleCentroid"]
+        measureConfig.plugins["ip_diffim_DipoleFit"].update(**self.config.dipoleFit.toDict())
+        task = DipoleFitTask(config=measureConfig, schema=schema)
+
+        catalog = self._makeCatalog(schema, footprints)
+        exposures = (testImage.diffim, testImage.posImage, testImage.negImage)
+        start = time.perf_counter()
+        task.run(catalog, *exposures)
+        catalogTime = time.perf_counter() - start
+
+        times = []
+        for record in catalog:
+            t0 = time.perf_counter()
+            task.dipoleFitter.measure(record, *exposures)
+            times.append(time.perf_counter() - t0)
+        return catalogTime, times
+
+
+def writeBenchmarkResults(results, filename):
+    """Write the results of `DipoleBenchmarkTask.run` as JSON.
+
+    Parameters
+    ----------
+    results : `dict`
+        The ``results`` returned by `DipoleBenchmarkTask.run`.
+    filename : `str`
+        Name of the output file.
+    """
+    with open(filename, "w") as outfile:
+        json.dump(results, outfile, indent=2, sort_keys=True)
+        outfile.write("\n")
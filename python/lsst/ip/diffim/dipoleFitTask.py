@@ -20,7 +20,13 @@
 # see <https://www.lsstcorp.org/LegalNotices/>.
 #
 
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
+
 import numpy as np
+import scipy.linalg
 import warnings
 
 import lsst.afw.image as afwImage
@@ -33,6 +39,8 @@ import lsst.pex.exceptions as pexExcept
 import lsst.pex.config as pexConfig
 from lsst.pipe.base import Struct, timeMethod
 
+from .psfImageCache import PsfImageCache
+
 __all__ = ("DipoleFitTask", "DipoleFitPlugin", "DipoleFitTaskConfig", "DipoleFitPluginConfig",
            "DipoleFitAlgorithm")
 
@@ -76,6 +84,57 @@ class DipoleFitPluginConfig(measBase.SingleFramePluginConfig):
         dtype=bool, default=False,
         doc="Include parameters to fit for negative values (flux, gradient) separately from pos.")
 
+    fitMethod = pexConfig.ChoiceField(
+        dtype=str, default="lmfit",
+        doc="Optimization backend used to fit the dipole model",
+        allowed={
+            "lmfit": "Levenberg-Marquardt through `lmfit.Model`",
+            "leastSquares": "`scipy.optimize.least_squares` called directly on a flat parameter vector "
+                            "with bounds, avoiding the lmfit overhead",
+        })
+
+    psfStampOversampling = pexConfig.Field(
+        dtype=int, default=0,
+        doc="If greater than zero, generate the dipole model from a PSF stamp computed once per source "
+            "with this sub-pixel oversampling factor and shifted by bilinear interpolation, and supply "
+            "the analytic Jacobian of the model to the optimizer. If zero, compute the PSF image at "
+            "every model evaluation.",
+        check=lambda x: x >= 0)
+
+    badMaskPlanes = pexConfig.ListField(
+        dtype=str, default=["BAD", "SAT", "NO_DATA"],
+        doc="Mask planes of the pixels excluded from the dipole fit; only the pixels of the footprint "
+            "are included")
+
+    usePsfImageCache = pexConfig.Field(
+        dtype=bool, default=False,
+        doc="Get the PSF images of the dipole model from the `lsst.ip.diffim.PsfImageCache` shared by the "
+            "dipole measurement algorithms (used if psfStampOversampling is 0). The image at the nearest "
+            "position on the sub-pixel grid of the cache is shifted to the exact position to first order.")
+
+    psfImageCacheSubpixelGrid = pexConfig.Field(
+        dtype=int, default=100,
+        doc="Number of grid steps per pixel of the positions of the shared PSF image cache, if "
+            "usePsfImageCache. Changing it clears the cache.",
+        check=lambda x: x >= 1)
+
+    doPrefilter = pexConfig.Field(
+        dtype=bool, default=False,
+        doc="Reject implausible dipoles before fitting, using a cheap test on the moments of the "
+            "positive and negative pixels in the footprint")
+
+    prefilterMinLobeFluxFraction = pexConfig.Field(
+        dtype=float, default=0.1,
+        doc="Minimum fraction of the total absolute footprint flux that must be in the fainter lobe "
+            "for a source to be fit (used if doPrefilter); lobe centroids must also be separated by "
+            "no more than maxSeparation * psfSigma",
+        check=lambda x: 0. <= x <= 0.5)
+
+    numThreads = pexConfig.Field(
+        dtype=int, default=1,
+        doc="Number of threads used to fit the dipoles of a catalog in `DipoleFitTask.fitDipoleCatalog`",
+        check=lambda x: x >= 1)
+
     # Config params for classification of detected diaSources as dipole or not
     minSn = pexConfig.Field(
         dtype=float, default=np.sqrt(2) * 5.0,
@@ -172,8 +231,31 @@ class DipoleFitTask(measBase.SingleFrameMeasurementTask):
         if not sources:
             return
 
-        for source in sources:
-            self.dipoleFitter.measure(source, exposure, posExp, negExp)
+        self.fitDipoleCatalog(sources, exposure, posExp, negExp)
+
+    def fitDipoleCatalog(self, sources, exposure, posExp=None, negExp=None):
+        """Fit dipoles to all ``diaSources`` of a catalog in one batch.
+
+        The results are written to the same schema keys as
+        `DipoleFitPlugin.measure`; see `DipoleFitPlugin.measureCatalog`.
+
+        Parameters
+        ----------
+        sources : `lsst.afw.table.SourceCatalog`
+            ``diaSources`` that will be measured using dipole measurement
+        exposure : `lsst.afw.image.Exposure`
+            The difference exposure on which the ``diaSources`` were detected.
+        posExp : `lsst.afw.image.Exposure`, optional
+            "Positive" exposure, typically a science exposure, or None if unavailable
+        negExp : `lsst.afw.image.Exposure`, optional
+            "Negative" exposure, typically a template exposure, or None if unavailable
+        """
+        result = self.dipoleFitter.measureCatalog(sources, exposure, posExp, negExp,
+                                                  numThreads=self.dipoleFitter.config.numThreads)
+        self.metadata.set("numDipoleFits", result.numFit)
+        self.metadata.set("numDipoleFitsAvoided", result.numFitsAvoided)
+        self.metadata.set("psfImageCacheHits", result.psfImageCacheHits)
+        self.metadata.set("psfImageCacheMisses", result.psfImageCacheMisses)
 
 
 class DipoleModel(object):
@@ -184,10 +266,20 @@ class DipoleModel(object):
     `DMTN-007: Dipole characterization for image differencing  <https://dmtn-007.lsst.io>`_.
     """
 
-    def __init__(self):
+    # Most footprints fall in a few bounding box shapes, so the centred coordinate grids (keyed on
+    # shape) and the QR-factorised background design matrices (keyed on shape, polynomial order and
+    # background pixels) are cached and shared between instances.
+    _gridCache = OrderedDict()
+    _backgroundQRCache = OrderedDict()
+    _maxCacheSize = 128
+    _cacheLock = threading.Lock()
+
+    def __init__(self, psfImageCache=None):
         import lsstDebug
         self.debug = lsstDebug.Info(__name__).debug
         self.log = Log.getLogger(__name__)
+        self._psfStamp = None
+        self.psfImageCache = psfImageCache
 
     def makeBackgroundModel(self, in_x, pars=None):
         """Generate gradient model (2-d array) with up to 2nd-order polynomial
@@ -247,11 +339,78 @@ class DipoleModel(object):
             y- coordinates
         """
 
-        x, y = np.mgrid[bbox.getBeginY():bbox.getEndY(), bbox.getBeginX():bbox.getEndX()]
-        in_x = np.array([y, x]).astype(np.float64)
-        in_x[0, :] -= np.mean(in_x[0, :])
-        in_x[1, :] -= np.mean(in_x[1, :])
-        return in_x
+        return self._getCenteredGrid(bbox.getHeight(), bbox.getWidth())
+
+    @classmethod
+    def _getCached(cls, cache, key, compute):
+        """Return ``cache[key]``, computing and storing it with ``compute()`` if missing.
+
+        The cache is a least-recently-used `collections.OrderedDict` holding
+        at most ``_maxCacheSize`` entries.
+        """
+        with cls._cacheLock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+        value = compute()
+        with cls._cacheLock:
+            cache[key] = value
+            while len(cache) > cls._maxCacheSize:
+                cache.popitem(last=False)
+        return value
+
+    @classmethod
+    def _getCenteredGrid(cls, height, width):
+        """Return the (read-only) grid of x- and y- coordinates of a bounding
+        box of the given shape, relative to its centre.
+
+        Parameters
+        ----------
+        height, width : `int`
+            Shape of the bounding box
+
+        Returns
+        -------
+        in_x : `numpy.array`
+            (2, h, w)-dimensional numpy array, as returned by `_generateXYGrid`.
+        """
+        def compute():
+            y, x = np.mgrid[:height, :width].astype(np.float64)
+            in_x = np.array([x - (width - 1)/2., y - (height - 1)/2.])
+            in_x.flags.writeable = False
+            return in_x
+        return cls._getCached(cls._gridCache, (height, width), compute)
+
+    @classmethod
+    def _getBackgroundQR(cls, isBg, order):
+        """Return the QR factorisation of the background polynomial design matrix.
+
+        Parameters
+        ----------
+        isBg : `numpy.array`
+            2-d boolean array, true for the bounding box pixels used in the fit
+        order : `int`
+            Polynomial order of background gradient to fit.
+
+        Returns
+        -------
+        q, r : `numpy.array`
+            Factors of the design matrix of the pixels selected by ``isBg``,
+            in the row-major order of ``isBg``.
+        """
+        def compute():
+            in_x = cls._getCenteredGrid(*isBg.shape)
+            x, y = in_x[1][isBg], in_x[0][isBg]
+            b = np.ones_like(x, dtype=np.float64)
+
+            M = np.vstack([b]).T  # order = 0
+            if order == 1:
+                M = np.vstack([b, x, y]).T
+            elif order == 2:
+                M = np.vstack([b, x, y, x**2., y**2., x*y]).T
+            return np.linalg.qr(M)
+        key = (isBg.shape, order, np.packbits(isBg).tobytes())
+        return cls._getCached(cls._backgroundQRCache, key, compute)
 
     def _getHeavyFootprintSubimage(self, fp, badfill=np.nan, grow=0):
         """Extract the image from a ``~lsst.afw.detection.HeavyFootprint``
@@ -313,28 +472,13 @@ class DipoleModel(object):
         posHfp = afwDet.HeavyFootprintF(fp, posImage.getMaskedImage())
         posFpImg = self._getHeavyFootprintSubimage(posHfp, grow=3)
 
-        isBg = np.isnan(posFpImg.getArray()).ravel()
-
-        data = posImg.getArray().ravel()
-        data = data[isBg]
-        B = data
+        isBg = np.isnan(posFpImg.getArray())
+        B = posImg.getArray()[isBg]
 
-        x, y = np.mgrid[bbox.getBeginY():bbox.getEndY(), bbox.getBeginX():bbox.getEndX()]
-        x = x.astype(np.float64).ravel()
-        x -= np.mean(x)
-        x = x[isBg]
-        y = y.astype(np.float64).ravel()
-        y -= np.mean(y)
-        y = y[isBg]
-        b = np.ones_like(x, dtype=np.float64)
-
-        M = np.vstack([b]).T  # order = 0
-        if order == 1:
-            M = np.vstack([b, x, y]).T
-        elif order == 2:
-            M = np.vstack([b, x, y, x**2., y**2., x*y]).T
-
-        pars = np.linalg.lstsq(M, B, rcond=-1)[0]
+        # The factorisation is shared by repeated footprint shapes, and by the fits to the
+        # positive and negative images of the same footprint; each fit is then a back-substitution.
+        q, r = self._getBackgroundQR(isBg, order)
+        pars = scipy.linalg.solve_triangular(r, q.T.dot(B))
         return pars
 
     def makeStarModel(self, bbox, psf, xcen, ycen, flux):
@@ -361,7 +505,10 @@ class DipoleModel(object):
         """
 
         # Generate the psf image, normalize to flux
-        psf_img = psf.computeImage(geom.Point2D(xcen, ycen)).convertF()
+        if self.psfImageCache is not None:
+            psf_img = self._computeCachedPsfImage(psf, xcen, ycen)
+        else:
+            psf_img = psf.computeImage(geom.Point2D(xcen, ycen)).convertF()
         psf_img_sum = np.nansum(psf_img.getArray())
         psf_img *= (flux/psf_img_sum)
 
@@ -380,6 +527,147 @@ class DipoleModel(object):
 
         return p_Im
 
+    def _computeCachedPsfImage(self, psf, xcen, ycen):
+        """Compute the PSF image at a position from the image cached at the
+        nearest position on the sub-pixel grid of the cache.
+
+        The cached image is shifted by the remaining sub-pixel offset to
+        first order, using its finite-difference gradient. Otherwise the
+        model would be piecewise-constant in the centroids, and the
+        finite-difference Jacobian of the fit would not move them.
+
+        Parameters
+        ----------
+        psf : `lsst.afw.detection.Psf`
+            Psf model used to generate the 'star'
+        xcen : `float`
+            Desired x-centroid of the 'star'
+        ycen : `float`
+            Desired y-centroid of the 'star'
+
+        Returns
+        -------
+        psf_img : `lsst.afw.image.ImageF`
+            The PSF image at (``xcen``, ``ycen``), a copy of the cached image.
+        """
+        grid = self.psfImageCache.getSubpixelGrid()
+        xgrid = np.floor(xcen*grid + 0.5)/grid
+        ygrid = np.floor(ycen*grid + 0.5)/grid
+        psf_img = self.psfImageCache.computeImage(psf, geom.Point2D(xgrid, ygrid)).convertF()
+        arr = psf_img.getArray()
+        if min(arr.shape) > 1:
+            gy, gx = np.gradient(arr)
+            arr -= (xcen - xgrid)*gx + (ycen - ygrid)*gy
+        return psf_img
+
+    def setPsfStamp(self, psf, position, oversampling=5):
+        """Precompute the supersampled PSF stamp used to generate the models.
+
+        The PSF image is computed once at each of ``oversampling**2``
+        sub-pixel offsets from the pixel containing ``position``, and
+        the images are stored on a common pixel frame. Subsequent calls to
+        `makeStarModel` and `makeModel` then shift this stamp by bilinear
+        interpolation between the offsets instead of recomputing the PSF.
+
+        Parameters
+        ----------
+        psf : `lsst.afw.detection.Psf`
+            Psf model used to generate the 'star'
+        position : `lsst.geom.Point2D`
+            Position at which to evaluate the PSF; the PSF is assumed not to
+            vary across the shifts applied during the fit.
+        oversampling : `int`, optional
+            Number of sub-pixel offsets per pixel along each axis.
+            If `None` or zero, clear the stamp and revert to computing the
+            PSF image at every evaluation.
+        """
+        if not oversampling:
+            self._psfStamp = None
+            return
+
+        xref, yref = np.floor(position.getX()), np.floor(position.getY())
+        images = [[psf.computeImage(geom.Point2D(xref + i/oversampling, yref + j/oversampling))
+                   for i in range(oversampling)] for j in range(oversampling)]
+
+        # The sub-pixel offsets may move the PSF image origin; place all of them in one frame,
+        # with an extra row and column for the stamps shifted by one pixel below.
+        flatImages = [img for row in images for img in row]
+        x0 = min(img.getX0() for img in flatImages)
+        y0 = min(img.getY0() for img in flatImages)
+        nx = max(img.getBBox().getEndX() for img in flatImages) - x0 + 1
+        ny = max(img.getBBox().getEndY() for img in flatImages) - y0 + 1
+
+        planes = np.zeros((oversampling + 1, oversampling + 1, ny, nx))
+        for j in range(oversampling):
+            for i in range(oversampling):
+                img = images[j][i]
+                arr = img.getArray()
+                dx, dy = img.getX0() - x0, img.getY0() - y0
+                planes[j, i, dy:dy + arr.shape[0], dx:dx + arr.shape[1]] = arr / np.nansum(arr)
+        # An offset of one full pixel is the zero offset shifted by one pixel
+        planes[:oversampling, oversampling, :, 1:] = planes[:oversampling, 0, :, :-1]
+        planes[oversampling, :, 1:, :] = planes[0, :, :-1, :]
+
+        self._psfStamp = Struct(planes=planes, xref=xref, yref=yref, x0=x0, y0=y0,
+                                oversampling=oversampling)
+
+    def makeStampModel(self, bbox, xcen, ycen, withGradient=False):
+        """Generate a unit-flux star model from the PSF stamp set by `setPsfStamp`.
+
+        Parameters
+        ----------
+        bbox : `lsst.geom.Box2I`
+            Bounding box marking pixel coordinates for generated model
+        xcen : `float`
+            Desired x-centroid of the 'star'
+        ycen : `float`
+            Desired y-centroid of the 'star'
+        withGradient : `bool`, optional
+            Also return the derivatives of the model with respect to
+            ``xcen`` and ``ycen``.
+
+        Returns
+        -------
+        model : `numpy.ndarray`
+            (1, h, w) array containing the model on ``bbox``, or a (3, h, w)
+            array of the model and its derivatives with respect to ``xcen``
+            and ``ycen`` if ``withGradient`` is set.
+        """
+        stamp = self._psfStamp
+        osamp = stamp.oversampling
+        ux, uy = (xcen - stamp.xref)*osamp, (ycen - stamp.yref)*osamp
+        fx, fy = int(np.floor(ux)), int(np.floor(uy))
+        tx, ty = ux - fx, uy - fy
+        shiftX, ix = divmod(fx, osamp)
+        shiftY, iy = divmod(fy, osamp)
+
+        p00 = stamp.planes[iy, ix]
+        p01 = stamp.planes[iy, ix + 1]
+        p10 = stamp.planes[iy + 1, ix]
+        p11 = stamp.planes[iy + 1, ix + 1]
+        stamps = [(1. - ty)*((1. - tx)*p00 + tx*p01) + ty*((1. - tx)*p10 + tx*p11)]
+        if withGradient:
+            stamps.append(osamp*((1. - ty)*(p01 - p00) + ty*(p11 - p10)))
+            stamps.append(osamp*((1. - tx)*(p10 - p00) + tx*(p11 - p01)))
+
+        # Paste the overlap of the shifted stamp into the bounding box
+        model = np.zeros((len(stamps), bbox.getHeight(), bbox.getWidth()))
+        x0, y0 = stamp.x0 + shiftX, stamp.y0 + shiftY
+        xa, xb = max(x0, bbox.getBeginX()), min(x0 + p00.shape[1], bbox.getEndX())
+        ya, yb = max(y0, bbox.getBeginY()), min(y0 + p00.shape[0], bbox.getEndY())
+        if xa < xb and ya < yb:
+            bx0, by0 = bbox.getBeginX(), bbox.getBeginY()
+            stamps = np.array(stamps)
+            model[:, ya - by0:yb - by0, xa - bx0:xb - bx0] = stamps[:, ya - y0:yb - y0, xa - x0:xb - x0]
+        return model
+
+    def _getModelGrid(self, x, bbox):
+        """Return the input grid ``x``, or generate it from ``bbox`` if it is `None`.
+        """
+        if x is not None:
+            return x
+        return self._generateXYGrid(bbox)
+
     def makeModel(self, x, flux, xcenPos, ycenPos, xcenNeg, ycenNeg, fluxNeg=None,
                   b=None, x1=None, y1=None, xy=None, x2=None, y2=None,
                   bNeg=None, x1Neg=None, y1Neg=None, xyNeg=None, x2Neg=None, y2Neg=None,
@@ -446,15 +734,14 @@ class DipoleModel(object):
             if xy is not None:
                 self.log.debug('     %.2f %.2f %.2f', xy, x2, y2)
 
-        posIm = self.makeStarModel(bbox, psf, xcenPos, ycenPos, flux)
-        negIm = self.makeStarModel(bbox, psf, xcenNeg, ycenNeg, fluxNeg)
+        if self._psfStamp is not None:
+            posArr = flux*self.makeStampModel(bbox, xcenPos, ycenPos)[0]
+            negArr = fluxNeg*self.makeStampModel(bbox, xcenNeg, ycenNeg)[0]
+        else:
+            posArr = self.makeStarModel(bbox, psf, xcenPos, ycenPos, flux).getArray()
+            negArr = self.makeStarModel(bbox, psf, xcenNeg, ycenNeg, fluxNeg).getArray()
 
-        in_x = x
-        if in_x is None:  # use the footprint to generate the input grid
-            y, x = np.mgrid[bbox.getBeginY():bbox.getEndY(), bbox.getBeginX():bbox.getEndX()]
-            in_x = np.array([x, y]) * 1.
-            in_x[0, :] -= in_x[0, :].mean()  # center it!
-            in_x[1, :] -= in_x[1, :].mean()
+        in_x = self._getModelGrid(x, bbox)  # use the footprint to generate the input grid if needed
 
         if b is not None:
             gradient = self.makeBackgroundModel(in_x, (b, x1, y1, xy, x2, y2))
@@ -465,20 +752,89 @@ class DipoleModel(object):
             else:
                 gradientNeg = gradient
 
-            posIm.getArray()[:, :] += gradient
-            negIm.getArray()[:, :] += gradientNeg
+            posArr += gradient
+            negArr += gradientNeg
 
         # Generate the diffIm model
-        diffIm = afwImage.ImageF(bbox)
-        diffIm += posIm
-        diffIm -= negIm
-
-        zout = diffIm.getArray()
+        zout = posArr - negArr
         if rel_weight > 0.:
-            zout = np.append([zout], [posIm.getArray(), negIm.getArray()], axis=0)
+            zout = np.append([zout], [posArr, negArr], axis=0)
 
         return zout
 
+    def makeModelJacobian(self, x, values, varNames, **kwargs):
+        """Compute the analytic derivatives of `makeModel` with respect to its parameters.
+
+        Requires the PSF stamp to have been set with `setPsfStamp`.
+
+        Parameters
+        ----------
+        x : `numpy.array`
+            Input independent variable, as for `makeModel`.
+        values : `dict`
+            Values of all model parameters, keyed by the `makeModel`
+            argument names (e.g. ``flux``, ``xcenPos``, ``bNeg``).
+        varNames : `list` of `str`
+            Names of the parameters to differentiate against, in order.
+        **kwargs
+            Keyword arguments as for `makeModel`; must include
+            ``rel_weight`` and ``footprint``.
+
+        Returns
+        -------
+        jac : `numpy.array`
+            Array with first dimension ``len(varNames)``, each element of
+            which has the shape of the output of `makeModel`.
+        """
+        rel_weight = kwargs.get('rel_weight')
+        bbox = kwargs.get('footprint').getBBox()
+
+        flux = values['flux']
+        fluxNeg = values.get('fluxNeg')
+        separateFlux = fluxNeg is not None
+        if not separateFlux:
+            fluxNeg = flux
+
+        posStamp = self.makeStampModel(bbox, values['xcenPos'], values['ycenPos'], withGradient=True)
+        negStamp = self.makeStampModel(bbox, values['xcenNeg'], values['ycenNeg'], withGradient=True)
+
+        # Derivatives of the background model; these match the terms in `makeBackgroundModel`.
+        bgTerms = {}
+        if values.get('b') is not None:
+            in_x = self._getModelGrid(x, bbox)
+            bgTerms = {'b': np.ones_like(in_x[0]), 'x1': in_x[1], 'y1': in_x[0],
+                       'xy': in_x[0]*in_x[1], 'x2': in_x[1]*in_x[1], 'y2': in_x[0]*in_x[0]}
+        separateBg = values.get('bNeg') is not None
+
+        jac = np.zeros((len(varNames), 3, bbox.getHeight(), bbox.getWidth()))
+        for i, name in enumerate(varNames):
+            dPos = dNeg = 0.
+            if name == 'flux':
+                dPos = posStamp[0]
+                if not separateFlux:
+                    dNeg = negStamp[0]
+            elif name == 'fluxNeg':
+                dNeg = negStamp[0]
+            elif name in ('xcenPos', 'ycenPos'):
+                dPos = flux*posStamp[1 if name == 'xcenPos' else 2]
+            elif name in ('xcenNeg', 'ycenNeg'):
+                dNeg = fluxNeg*negStamp[1 if name == 'xcenNeg' else 2]
+            elif name in ('b', 'x1', 'y1', 'xy', 'x2', 'y2'):
+                dPos = bgTerms.get(name, 0.)
+                if not separateBg:
+                    dNeg = dPos
+            elif name in ('bNeg', 'x1Neg', 'y1Neg', 'xyNeg', 'x2Neg', 'y2Neg'):
+                dNeg = bgTerms.get(name[:-3], 0.)
+            else:
+                raise ValueError("Unknown dipole model parameter: %s" % name)
+            jac[i, 0] = dPos - dNeg
+            jac[i, 1] = dPos
+            jac[i, 2] = dNeg
+
+        if rel_weight > 0.:
+            return jac
+        return jac[:, 0]
+
 
 class DipoleFitAlgorithm(object):
     """Fit a dipole model using an image difference.
@@ -491,6 +847,11 @@ class DipoleFitAlgorithm(object):
     # using for algorithm development.
     _private_version_ = '0.0.5'
 
+    # Names of the `DipoleModel.makeModel` parameters, in the order they are optimized
+    _modelParamNames = ('flux', 'xcenPos', 'ycenPos', 'xcenNeg', 'ycenNeg', 'fluxNeg',
+                        'b', 'x1', 'y1', 'xy', 'x2', 'y2',
+                        'bNeg', 'x1Neg', 'y1Neg', 'xyNeg', 'x2Neg', 'y2Neg')
+
     # Below is a (somewhat incomplete) list of improvements
     # that would be worth investigating, given the time:
 
@@ -506,7 +867,7 @@ class DipoleFitAlgorithm(object):
     # todo 10. (DONE) better initial estimate for flux when there's a strong gradient
     # todo 11. (DONE) requires a new package `lmfit` -- investiate others? (astropy/scipy/iminuit?)
 
-    def __init__(self, diffim, posImage=None, negImage=None):
+    def __init__(self, diffim, posImage=None, negImage=None, psfImageCache=None):
         """Algorithm to run dipole measurement on a diaSource
 
         Parameters
@@ -517,11 +878,15 @@ class DipoleFitAlgorithm(object):
             "Positive" exposure from which the template was subtracted
         negImage : `lsst.afw.image.Exposure`
             "Negative" exposure which was subtracted from the posImage
+        psfImageCache : `lsst.ip.diffim.PsfImageCache`, optional
+            Cache from which the dipole models get their PSF images, or
+            `None` to compute them at every evaluation.
         """
 
         self.diffim = diffim
         self.posImage = posImage
         self.negImage = negImage
+        self.psfImageCache = psfImageCache
         self.psfSigma = None
         if diffim is not None:
             self.psfSigma = diffim.getPsf().computeShape().getDeterminantRadius()
@@ -531,50 +896,117 @@ class DipoleFitAlgorithm(object):
         import lsstDebug
         self.debug = lsstDebug.Info(__name__).debug
 
-    def fitDipoleImpl(self, source, tol=1e-7, rel_weight=0.5,
-                      fitBackground=1, bgGradientOrder=1, maxSepInSigma=5.,
-                      separateNegParams=True, verbose=False):
-        """Fit a dipole model to an input difference image.
+    def computeFootprintMoments(self, source):
+        """Compute the flux and first moments of the positive and negative
+        pixels within the footprint of a source on the diffim.
 
-        Actually, fits the subimage bounded by the input source's
-        footprint) and optionally constrain the fit using the
-        pre-subtraction images posImage and negImage.
+        These closed-form estimates are cheap compared to `fitDipole`, and
+        may be used to reject implausible dipoles before fitting them.
 
         Parameters
         ----------
-        source : TODO: DM-17458
-            TODO: DM-17458
-        tol : float, optional
-            TODO: DM-17458
+        source : `lsst.afw.table.SourceRecord`
+            Record containing the (merged) dipole source footprint detected on the diffim
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            Struct containing:
+
+            - ``posFlux``, ``negFlux`` : summed flux of the positive and
+              (absolute) flux of the negative pixels (`float`)
+            - ``posCentroid``, ``negCentroid`` : flux-weighted centroids
+              (x, y) of the positive and negative pixels (`tuple`)
+            - ``lobeFluxFraction`` : fraction of the total absolute flux in
+              the fainter lobe (`float`)
+            - ``separation`` : distance between the two centroids, in pixels,
+              or NaN if either lobe is empty (`float`)
+        """
+        fp = source.getFootprint()
+        bbox = fp.getBBox()
+        hfp = afwDet.HeavyFootprintF(fp, self.diffim.getMaskedImage())
+        img = DipoleModel()._getHeavyFootprintSubimage(hfp).getArray()
+        y, x = np.mgrid[bbox.getBeginY():bbox.getEndY(), bbox.getBeginX():bbox.getEndX()]
+
+        good = np.isfinite(img)
+        pix, x, y = img[good], x[good], y[good]
+        isPos, isNeg = pix > 0, pix < 0
+        posFlux, negFlux = np.sum(pix[isPos]), -np.sum(pix[isNeg])
+
+        posCentroid = negCentroid = (np.nan, np.nan)
+        if posFlux > 0.:
+            posCentroid = (np.sum(pix[isPos]*x[isPos])/posFlux, np.sum(pix[isPos]*y[isPos])/posFlux)
+        if negFlux > 0.:
+            negCentroid = (np.sum(pix[isNeg]*x[isNeg])/-negFlux, np.sum(pix[isNeg]*y[isNeg])/-negFlux)
+        totalFlux = posFlux + negFlux
+        lobeFluxFraction = min(posFlux, negFlux)/totalFlux if totalFlux > 0. else 0.
+        separation = np.hypot(posCentroid[0] - negCentroid[0], posCentroid[1] - negCentroid[1])
+
+        return Struct(posFlux=posFlux, negFlux=negFlux, posCentroid=posCentroid, negCentroid=negCentroid,
+                      lobeFluxFraction=lobeFluxFraction, separation=separation)
+
+    def _setupDipoleFit(self, source, rel_weight=0.5, fitBackground=1, bgGradientOrder=1,
+                        maxSepInSigma=5., separateNegParams=True, psfStampOversampling=0,
+                        badMaskPlanes=None):
+        """Extract the data to fit and compute the starting parameters and their bounds.
+
+        This is shared by the fitting backends, `fitDipoleImpl` and `fitDipoleImplLeastSquares`.
+
+        Parameters
+        ----------
+        source : `lsst.afw.table.SourceRecord`
+            Record containing the (merged) dipole source footprint detected on the diffim
         rel_weight : `float`, optional
-            TODO: DM-17458
+            Weight of the pre-subtraction images relative to the diffim in the
+            fit. If zero, or if neither ``posImage`` nor ``negImage`` is set,
+            only the diffim is fit.
         fitBackground : `int`, optional
-            TODO: DM-17458
+            How to treat the background of the pre-subtraction images:
+            0 ignores it, 1 fits a polynomial to the footprint and subtracts
+            it from the data before the dipole fit, and 2 uses that fit as
+            the starting point of background parameters that are fit together
+            with the dipole.
         bgGradientOrder : `int`, optional
-            TODO: DM-17458
+            Order of the polynomial background model (0, 1, or 2).
+            A negative value disables the background fit.
         maxSepInSigma : `float`, optional
-            TODO: DM-17458
+            Maximum distance of each lobe centroid from its starting position,
+            and of the starting positions from the footprint centroid, in
+            units of the PSF sigma.
         separateNegParams : `bool`, optional
-            TODO: DM-17458
-        verbose : `bool`, optional
-            TODO: DM-17458
+            Fit the flux and background of the negative lobe separately from
+            those of the positive lobe.
+        psfStampOversampling : `int`, optional
+            If greater than zero, generate the model from a PSF stamp with
+            this oversampling factor (see `DipoleModel.setPsfStamp`).
+        badMaskPlanes : `list` of `str`, optional
+            Mask planes of the pixels to exclude from the fit.
 
         Returns
         -------
-        result : `lmfit.MinimizerResult`
-            return `lmfit.MinimizerResult` object containing the fit
-            parameters and other information.
+        result : `lsst.pipe.base.Struct`
+            Struct containing:
+
+            - ``z`` : data to fit (`numpy.ndarray`)
+            - ``weights`` : least-squares weights of ``z`` (`numpy.ndarray`)
+            - ``pixelMask`` : `True` for the elements of ``z`` to fit: the
+              pixels of the footprint with finite values and none of
+              ``badMaskPlanes`` set (`numpy.ndarray` of `bool`)
+            - ``in_x`` : grid on which to compute the background model (`numpy.ndarray`)
+            - ``paramHints`` : starting value and optional ``min`` and ``max``
+              bounds of each fit parameter, keyed by `DipoleModel.makeModel`
+              argument name (`dict` of `dict`)
+            - ``rel_weight`` : weight of the pre-subtraction images, zero if
+              they are not included in ``z`` (`float`)
+            - ``dipoleModel`` : model to fit (`DipoleModel`)
         """
-
-        # Only import lmfit if someone wants to use the new DipoleFitAlgorithm.
-        import lmfit
-
         fp = source.getFootprint()
         bbox = fp.getBBox()
         subim = afwImage.MaskedImageF(self.diffim.getMaskedImage(), bbox=bbox, origin=afwImage.PARENT)
 
         z = diArr = subim.getArrays()[0]
         weights = 1. / subim.getArrays()[2]  # get the weights (=1/variance)
+        masks = [subim.getMask()]
 
         if rel_weight > 0. and ((self.posImage is not None) or (self.negImage is not None)):
             if self.negImage is not None:
@@ -593,34 +1025,13 @@ class DipoleFitAlgorithm(object):
             # Weight the pos/neg images by rel_weight relative to the diffim
             weights = np.append([weights], [1. / posSubim.getArrays()[2] * rel_weight,
                                             1. / negSubim.getArrays()[2] * rel_weight], axis=0)
+            masks += [posSubim.getMask(), negSubim.getMask()]
         else:
             rel_weight = 0.  # a short-cut for "don't include the pre-subtraction data"
 
-        # It seems that `lmfit` requires a static functor as its optimized method, which eliminates
-        # the ability to pass a bound method or other class method. Here we write a wrapper which
-        # makes this possible.
-        def dipoleModelFunctor(x, flux, xcenPos, ycenPos, xcenNeg, ycenNeg, fluxNeg=None,
-                               b=None, x1=None, y1=None, xy=None, x2=None, y2=None,
-                               bNeg=None, x1Neg=None, y1Neg=None, xyNeg=None, x2Neg=None, y2Neg=None,
-                               **kwargs):
-            """Generate dipole model with given parameters.
-
-            It simply defers to `modelObj.makeModel()`, where `modelObj` comes
-            out of `kwargs['modelObj']`.
-            """
-            modelObj = kwargs.pop('modelObj')
-            return modelObj.makeModel(x, flux, xcenPos, ycenPos, xcenNeg, ycenNeg, fluxNeg=fluxNeg,
-                                      b=b, x1=x1, y1=y1, xy=xy, x2=x2, y2=y2,
-                                      bNeg=bNeg, x1Neg=x1Neg, y1Neg=y1Neg, xyNeg=xyNeg,
-                                      x2Neg=x2Neg, y2Neg=y2Neg, **kwargs)
-
-        dipoleModel = DipoleModel()
-
-        modelFunctor = dipoleModelFunctor  # dipoleModel.makeModel does not work for now.
-        # Create the lmfit model (lmfit uses scipy 'leastsq' option by default - Levenberg-Marquardt)
-        # Note we can also tell it to drop missing values from the data.
-        gmod = lmfit.Model(modelFunctor, verbose=verbose, missing='drop')
-        # independent_vars=independent_vars) #, param_names=param_names)
+        dipoleModel = DipoleModel(psfImageCache=self.psfImageCache)
+        if psfStampOversampling > 0:
+            dipoleModel.setPsfStamp(self.diffim.getPsf(), fp.getCentroid(), oversampling=psfStampOversampling)
 
         # Add the constraints for centroids, fluxes.
         # starting constraint - near centroid of footprint
@@ -647,14 +1058,11 @@ class DipoleFitAlgorithm(object):
         # parameter hints/constraints: https://lmfit.github.io/lmfit-py/model.html#model-param-hints-section
         # might make sense to not use bounds -- see http://lmfit.github.io/lmfit-py/bounds.html
         # also see this discussion -- https://github.com/scipy/scipy/issues/3129
-        gmod.set_param_hint('xcenPos', value=cenPos[0],
-                            min=cenPos[0]-maxSep, max=cenPos[0]+maxSep)
-        gmod.set_param_hint('ycenPos', value=cenPos[1],
-                            min=cenPos[1]-maxSep, max=cenPos[1]+maxSep)
-        gmod.set_param_hint('xcenNeg', value=cenNeg[0],
-                            min=cenNeg[0]-maxSep, max=cenNeg[0]+maxSep)
-        gmod.set_param_hint('ycenNeg', value=cenNeg[1],
-                            min=cenNeg[1]-maxSep, max=cenNeg[1]+maxSep)
+        paramHints = {}
+        paramHints['xcenPos'] = dict(value=cenPos[0], min=cenPos[0]-maxSep, max=cenPos[0]+maxSep)
+        paramHints['ycenPos'] = dict(value=cenPos[1], min=cenPos[1]-maxSep, max=cenPos[1]+maxSep)
+        paramHints['xcenNeg'] = dict(value=cenNeg[0], min=cenNeg[0]-maxSep, max=cenNeg[0]+maxSep)
+        paramHints['ycenNeg'] = dict(value=cenNeg[1], min=cenNeg[1]-maxSep, max=cenNeg[1]+maxSep)
 
         # Use the (flux under the dipole)*5 for an estimate.
         # Lots of testing showed that having startingFlux be too high was better than too low.
@@ -662,11 +1070,11 @@ class DipoleFitAlgorithm(object):
         posFlux = negFlux = startingFlux
 
         # TBD: set max. flux limit?
-        gmod.set_param_hint('flux', value=posFlux, min=0.1)
+        paramHints['flux'] = dict(value=posFlux, min=0.1)
 
         if separateNegParams:
             # TBD: set max negative lobe flux limit?
-            gmod.set_param_hint('fluxNeg', value=np.abs(negFlux), min=0.1)
+            paramHints['fluxNeg'] = dict(value=np.abs(negFlux), min=0.1)
 
         # Fixed parameters (don't fit for them if there are no pre-sub images or no gradient fit requested):
         # Right now (fitBackground == 1), we fit a linear model to the background and then subtract
@@ -689,7 +1097,7 @@ class DipoleFitAlgorithm(object):
                 z[1, :] -= pbg
                 z[1, :] -= np.nanmedian(z[1, :])
                 posFlux = np.nansum(z[1, :])
-                gmod.set_param_hint('flux', value=posFlux*1.5, min=0.1)
+                paramHints['flux'] = dict(value=posFlux*1.5, min=0.1)
 
                 if separateNegParams and self.negImage is not None:
                     bgParsNeg = dipoleModel.fitFootprintBackground(source, self.negImage,
@@ -699,49 +1107,171 @@ class DipoleFitAlgorithm(object):
                 z[2, :] -= np.nanmedian(z[2, :])
                 if separateNegParams:
                     negFlux = np.nansum(z[2, :])
-                    gmod.set_param_hint('fluxNeg', value=negFlux*1.5, min=0.1)
+                    paramHints['fluxNeg'] = dict(value=negFlux*1.5, min=0.1)
 
             # Do not subtract the background from the images but include the background parameters in the fit
             if fitBackground == 2:
                 if bgGradientOrder >= 0:
-                    gmod.set_param_hint('b', value=bgParsPos[0])
+                    paramHints['b'] = dict(value=bgParsPos[0])
                     if separateNegParams:
-                        gmod.set_param_hint('bNeg', value=bgParsNeg[0])
+                        paramHints['bNeg'] = dict(value=bgParsNeg[0])
                 if bgGradientOrder >= 1:
-                    gmod.set_param_hint('x1', value=bgParsPos[1])
-                    gmod.set_param_hint('y1', value=bgParsPos[2])
+                    paramHints['x1'] = dict(value=bgParsPos[1])
+                    paramHints['y1'] = dict(value=bgParsPos[2])
                     if separateNegParams:
-                        gmod.set_param_hint('x1Neg', value=bgParsNeg[1])
-                        gmod.set_param_hint('y1Neg', value=bgParsNeg[2])
+                        paramHints['x1Neg'] = dict(value=bgParsNeg[1])
+                        paramHints['y1Neg'] = dict(value=bgParsNeg[2])
                 if bgGradientOrder >= 2:
-                    gmod.set_param_hint('xy', value=bgParsPos[3])
-                    gmod.set_param_hint('x2', value=bgParsPos[4])
-                    gmod.set_param_hint('y2', value=bgParsPos[5])
+                    paramHints['xy'] = dict(value=bgParsPos[3])
+                    paramHints['x2'] = dict(value=bgParsPos[4])
+                    paramHints['y2'] = dict(value=bgParsPos[5])
                     if separateNegParams:
-                        gmod.set_param_hint('xyNeg', value=bgParsNeg[3])
-                        gmod.set_param_hint('x2Neg', value=bgParsNeg[4])
-                        gmod.set_param_hint('y2Neg', value=bgParsNeg[5])
-
-        y, x = np.mgrid[bbox.getBeginY():bbox.getEndY(), bbox.getBeginX():bbox.getEndX()]
-        in_x = np.array([x, y]).astype(np.float)
-        in_x[0, :] -= in_x[0, :].mean()  # center it!
-        in_x[1, :] -= in_x[1, :].mean()
-
-        # Instead of explicitly using a mask to ignore flagged pixels, just set the ignored pixels'
-        #  weights to 0 in the fit. TBD: need to inspect mask planes to set this mask.
-        mask = np.ones_like(z, dtype=bool)  # TBD: set mask values to False if the pixels are to be ignored
+                        paramHints['xyNeg'] = dict(value=bgParsNeg[3])
+                        paramHints['x2Neg'] = dict(value=bgParsNeg[4])
+                        paramHints['y2Neg'] = dict(value=bgParsNeg[5])
+
+        in_x = dipoleModel._generateXYGrid(bbox)
+
+        # Only fit the pixels of the footprint, excluding masked and missing pixels; the fitters
+        # evaluate the residuals on the compressed vector z[pixelMask].
+        inFootprint = afwImage.Mask(bbox)
+        fp.getSpans().setMask(inFootprint, 1)
+        pixelMask = np.empty(z.shape, dtype=bool)
+        pixelMask[...] = inFootprint.getArray() != 0
+        for plane, mask in zip(pixelMask.reshape((-1,) + diArr.shape), masks):
+            badBits = self._getBadMaskBits(mask, badMaskPlanes)
+            if badBits:
+                plane &= (mask.getArray() & badBits) == 0
+        pixelMask &= np.isfinite(z) & np.isfinite(weights)
 
         # I'm not sure about the variance planes in the diffim (or convolved pre-sub. images
         # for that matter) so for now, let's just do an un-weighted least-squares fit
         # (override weights computed above).
-        weights = mask.astype(np.float64)
+        weights = np.ones_like(z, dtype=np.float64)
         if self.posImage is not None and rel_weight > 0.:
             weights = np.array([np.ones_like(diArr), np.ones_like(diArr)*rel_weight,
                                 np.ones_like(diArr)*rel_weight])
 
-        # Set the weights to zero if mask is False
-        if np.any(~mask):
-            weights[~mask] = 0.
+        return Struct(z=z, weights=weights, pixelMask=pixelMask, in_x=in_x, paramHints=paramHints,
+                      rel_weight=rel_weight, dipoleModel=dipoleModel)
+
+    @staticmethod
+    def _getBadMaskBits(mask, badMaskPlanes):
+        """Return the bits of the mask planes of ``badMaskPlanes`` that are
+        defined for ``mask``.
+        """
+        if not badMaskPlanes:
+            return 0
+        planes = [name for name in badMaskPlanes if name in mask.getMaskPlaneDict()]
+        return mask.getPlaneBitMask(planes) if planes else 0
+
+    def fitDipoleImpl(self, source, tol=1e-7, rel_weight=0.5,
+                      fitBackground=1, bgGradientOrder=1, maxSepInSigma=5.,
+                      separateNegParams=True, verbose=False, psfStampOversampling=0,
+                      badMaskPlanes=None):
+        """Fit a dipole model to an input difference image.
+
+        Actually, fits the subimage bounded by the input source's
+        footprint) and optionally constrain the fit using the
+        pre-subtraction images posImage and negImage.
+
+        Parameters
+        ----------
+        source : TODO: DM-17458
+            TODO: DM-17458
+        tol : float, optional
+            TODO: DM-17458
+        rel_weight : `float`, optional
+            TODO: DM-17458
+        fitBackground : `int`, optional
+            TODO: DM-17458
+        bgGradientOrder : `int`, optional
+            TODO: DM-17458
+        maxSepInSigma : `float`, optional
+            TODO: DM-17458
+        separateNegParams : `bool`, optional
+            TODO: DM-17458
+        verbose : `bool`, optional
+            TODO: DM-17458
+        psfStampOversampling : `int`, optional
+            If greater than zero, generate the model from a PSF stamp with
+            this oversampling factor and use its analytic Jacobian in the fit
+            (see `DipoleModel.setPsfStamp`).
+        badMaskPlanes : `list` of `str`, optional
+            Mask planes of the pixels to exclude from the fit.
+
+        Returns
+        -------
+        result : `lmfit.MinimizerResult`
+            return `lmfit.MinimizerResult` object containing the fit
+            parameters and other information. Its ``data`` and ``best_fit``
+            hold the fitted pixels only; ``pixelMask`` locates them in the
+            footprint bounding box.
+        """
+
+        # Only import lmfit if someone wants to use the new DipoleFitAlgorithm.
+        import lmfit
+
+        # It seems that `lmfit` requires a static functor as its optimized method, which eliminates
+        # the ability to pass a bound method or other class method. Here we write a wrapper which
+        # makes this possible.
+        def dipoleModelFunctor(x, flux, xcenPos, ycenPos, xcenNeg, ycenNeg, fluxNeg=None,
+                               b=None, x1=None, y1=None, xy=None, x2=None, y2=None,
+                               bNeg=None, x1Neg=None, y1Neg=None, xyNeg=None, x2Neg=None, y2Neg=None,
+                               **kwargs):
+            """Generate dipole model with given parameters.
+
+            It simply defers to `modelObj.makeModel()`, where `modelObj` comes
+            out of `kwargs['modelObj']`, and returns the pixels selected by
+            `kwargs['pixelMask']`.
+            """
+            modelObj = kwargs.pop('modelObj')
+            pixelMask = kwargs.pop('pixelMask')
+            model = modelObj.makeModel(x, flux, xcenPos, ycenPos, xcenNeg, ycenNeg, fluxNeg=fluxNeg,
+                                       b=b, x1=x1, y1=y1, xy=xy, x2=x2, y2=y2,
+                                       bNeg=bNeg, x1Neg=x1Neg, y1Neg=y1Neg, xyNeg=xyNeg,
+                                       x2Neg=x2Neg, y2Neg=y2Neg, **kwargs)
+            return model[pixelMask]
+
+        def dipoleModelJacobian(params, data, weights, **kwargs):
+            """Compute the Jacobian of the weighted residuals, one row per varying parameter.
+
+            The signature matches the residual function that `lmfit.Model`
+            passes to the optimizer.
+            """
+            modelObj = kwargs.pop('modelObj')
+            pixelMask = kwargs.pop('pixelMask')
+            varNames = [name for name, par in params.items() if par.vary]
+            jac = modelObj.makeModelJacobian(kwargs.pop('x'), params.valuesdict(), varNames, **kwargs)
+            jac = jac[:, pixelMask]
+            if weights is not None:
+                jac *= weights
+            return jac
+
+        setup = self._setupDipoleFit(source, rel_weight=rel_weight, fitBackground=fitBackground,
+                                     bgGradientOrder=bgGradientOrder, maxSepInSigma=maxSepInSigma,
+                                     separateNegParams=separateNegParams,
+                                     psfStampOversampling=psfStampOversampling,
+                                     badMaskPlanes=badMaskPlanes)
+        pixelMask = setup.pixelMask
+        z, weights = setup.z[pixelMask], setup.weights[pixelMask]
+        in_x, rel_weight = setup.in_x, setup.rel_weight
+        dipoleModel = setup.dipoleModel
+        fitKws = {'ftol': tol, 'xtol': tol, 'gtol': tol, 'maxfev': 250}  # see scipy docs
+
+        modelFunctor = dipoleModelFunctor  # dipoleModel.makeModel does not work for now.
+        # Create the lmfit model (lmfit uses scipy 'leastsq' option by default - Levenberg-Marquardt)
+        # Note we can also tell it to drop missing values from the data.
+        gmod = lmfit.Model(modelFunctor, verbose=verbose, missing='drop')
+        # independent_vars=independent_vars) #, param_names=param_names)
+
+        for name, hint in setup.paramHints.items():
+            gmod.set_param_hint(name, **hint)
+
+        # The fitted pixels are all finite, so none are dropped as missing and the rows of the
+        # analytic Jacobian match the residuals.
+        if psfStampOversampling > 0:
+            fitKws.update(Dfun=dipoleModelJacobian, col_deriv=True)
 
         # Note that although we can, we're not required to set initial values for params here,
         # since we set their param_hint's above.
@@ -750,12 +1280,13 @@ class DipoleFitAlgorithm(object):
             warnings.simplefilter("ignore")  # temporarily turn off silly lmfit warnings
             result = gmod.fit(z, weights=weights, x=in_x,
                               verbose=verbose,
-                              fit_kws={'ftol': tol, 'xtol': tol, 'gtol': tol,
-                                       'maxfev': 250},  # see scipy docs
+                              fit_kws=fitKws,
                               psf=self.diffim.getPsf(),  # hereon: kwargs that get passed to genDipoleModel()
                               rel_weight=rel_weight,
-                              footprint=fp,
+                              footprint=source.getFootprint(),
+                              pixelMask=pixelMask,
                               modelObj=dipoleModel)
+        result.pixelMask = pixelMask
 
         if verbose:  # the ci_report() seems to fail if neg params are constrained -- TBD why.
             # Never wanted in production - this takes a long time (longer than the fit!)
@@ -768,9 +1299,109 @@ class DipoleFitAlgorithm(object):
 
         return result
 
+    def fitDipoleImplLeastSquares(self, source, tol=1e-7, rel_weight=0.5,
+                                  fitBackground=1, bgGradientOrder=1, maxSepInSigma=5.,
+                                  separateNegParams=True, verbose=False, psfStampOversampling=0,
+                                  badMaskPlanes=None):
+        """Fit a dipole model to an input difference image with `scipy.optimize.least_squares`.
+
+        This is a drop-in alternative to `fitDipoleImpl` that avoids the
+        overhead of `lmfit`: the model is optimized directly over a flat
+        parameter vector, with the same starting values and bounds.
+
+        Parameters
+        ----------
+        source : `lsst.afw.table.SourceRecord`
+            Record containing the (merged) dipole source footprint detected on the diffim
+        tol : `float`, optional
+            Tolerance parameter for the optimization
+        rel_weight : `float`, optional
+            Weighting of posImage/negImage relative to the diffim in the fit
+        fitBackground : `int`, {0, 1, 2}, optional
+            How to fit linear background gradient in posImage/negImage; see `fitDipole`
+        bgGradientOrder : `int`, {0, 1, 2}, optional
+            Desired polynomial order of background gradient
+        maxSepInSigma : `float`, optional
+            Allowed window of centroid parameters relative to peak in input source footprint
+        separateNegParams : `bool`, optional
+            Fit separate parameters to the flux and background gradient in
+        verbose : `bool`, optional
+            Be verbose
+        psfStampOversampling : `int`, optional
+            If greater than zero, generate the model from a PSF stamp with
+            this oversampling factor and use its analytic Jacobian in the fit
+            (see `DipoleModel.setPsfStamp`).
+        badMaskPlanes : `list` of `str`, optional
+            Mask planes of the pixels to exclude from the fit.
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            Struct with the attributes of the `lmfit.model.ModelResult`
+            used by `fitDipole` and `displayFitResults`: ``best_values``,
+            ``params`` (with ``value`` and ``stderr`` of each parameter),
+            ``chisqr``, ``redchi``, ``data``, ``best_fit``, ``nfev`` and
+            ``success``, and the ``pixelMask`` of the fitted pixels. As for
+            `fitDipoleImpl`, ``data`` and ``best_fit`` hold the fitted pixels
+            only.
+        """
+        from scipy.optimize import least_squares
+
+        setup = self._setupDipoleFit(source, rel_weight=rel_weight, fitBackground=fitBackground,
+                                     bgGradientOrder=bgGradientOrder, maxSepInSigma=maxSepInSigma,
+                                     separateNegParams=separateNegParams,
+                                     psfStampOversampling=psfStampOversampling,
+                                     badMaskPlanes=badMaskPlanes)
+        good = setup.pixelMask
+        z, weights = setup.z[good], setup.weights[good]
+        in_x, dipoleModel = setup.in_x, setup.dipoleModel
+        modelKws = dict(psf=self.diffim.getPsf(), rel_weight=setup.rel_weight,
+                        footprint=source.getFootprint())
+
+        names = [name for name in self._modelParamNames if name in setup.paramHints]
+        lower = np.array([setup.paramHints[name].get('min', -np.inf) for name in names])
+        upper = np.array([setup.paramHints[name].get('max', np.inf) for name in names])
+        p0 = np.clip([setup.paramHints[name]['value'] for name in names], lower, upper)
+
+        def residuals(pars):
+            model = dipoleModel.makeModel(in_x, **dict(zip(names, pars)), **modelKws)
+            return (model[good] - z)*weights
+
+        def jacobian(pars):
+            jac = dipoleModel.makeModelJacobian(in_x, dict(zip(names, pars)), names, **modelKws)
+            return (jac[:, good]*weights).T
+
+        result = least_squares(residuals, p0, bounds=(lower, upper), method='trf',
+                               jac=jacobian if psfStampOversampling > 0 else '2-point',
+                               ftol=tol, xtol=tol, gtol=tol, max_nfev=250)
+
+        # Scale the covariance by the reduced chi2, as lmfit does by default
+        chisqr = np.sum(result.fun**2)
+        nfree = result.fun.size - len(names)
+        redchi = chisqr/nfree if nfree > 0 else np.nan
+        try:
+            stderr = np.sqrt(np.diag(np.linalg.inv(result.jac.T.dot(result.jac)))*redchi)
+        except np.linalg.LinAlgError:
+            stderr = np.full(len(names), np.nan)
+
+        bestValues = dict(zip(names, result.x))
+        params = {name: Struct(value=value, stderr=err)
+                  for name, value, err in zip(names, result.x, stderr)}
+        bestFit = dipoleModel.makeModel(in_x, **bestValues, **modelKws)[good]
+
+        if verbose:
+            print(result.message)
+            for name in names:
+                print('    %s: %.6g +/- %.6g' % (name, params[name].value, params[name].stderr))
+
+        return Struct(best_values=bestValues, params=params, chisqr=chisqr, redchi=redchi,
+                      data=z, best_fit=bestFit, nfev=result.nfev, success=result.success,
+                      pixelMask=good)
+
     def fitDipole(self, source, tol=1e-7, rel_weight=0.1,
                   fitBackground=1, maxSepInSigma=5., separateNegParams=True,
-                  bgGradientOrder=1, verbose=False, display=False):
+                  bgGradientOrder=1, verbose=False, display=False, psfStampOversampling=0,
+                  fitMethod="lmfit", badMaskPlanes=None):
         """Fit a dipole model to an input ``diaSource`` (wraps `fitDipoleImpl`).
 
         Actually, fits the subimage bounded by the input source's
@@ -807,6 +1438,14 @@ class DipoleFitAlgorithm(object):
             Be verbose
         display
             Display input data, best fit model(s) and residuals in a matplotlib window.
+        psfStampOversampling : `int`, optional
+            If greater than zero, fit using a cached PSF stamp with this
+            oversampling factor and an analytic Jacobian (faster).
+        fitMethod : {"lmfit", "leastSquares"}, optional
+            Fitting backend: `fitDipoleImpl` (lmfit) or `fitDipoleImplLeastSquares`.
+        badMaskPlanes : `list` of `str`, optional
+            Mask planes of the pixels to exclude from the fit; only the
+            pixels of the footprint are fit.
 
         Returns
         -------
@@ -822,10 +1461,17 @@ class DipoleFitAlgorithm(object):
 
         """
 
-        fitResult = self.fitDipoleImpl(
+        if fitMethod == "lmfit":
+            fitImpl = self.fitDipoleImpl
+        elif fitMethod == "leastSquares":
+            fitImpl = self.fitDipoleImplLeastSquares
+        else:
+            raise ValueError("Unknown dipole fit method: %s" % fitMethod)
+        fitResult = fitImpl(
             source, tol=tol, rel_weight=rel_weight, fitBackground=fitBackground,
             maxSepInSigma=maxSepInSigma, separateNegParams=separateNegParams,
-            bgGradientOrder=bgGradientOrder, verbose=verbose)
+            bgGradientOrder=bgGradientOrder, verbose=verbose,
+            psfStampOversampling=psfStampOversampling, badMaskPlanes=badMaskPlanes)
 
         # Display images, model fits and residuals (currently uses matplotlib display functions)
         if display:
@@ -888,8 +1534,9 @@ class DipoleFitAlgorithm(object):
         ----------
         footprint : TODO: DM-17458
             Footprint containing the dipole that was fit
-        result : `lmfit.MinimizerResult`
-            `lmfit.MinimizerResult` object returned by `lmfit` optimizer
+        result : `lmfit.MinimizerResult` or `lsst.pipe.base.Struct`
+            Fit result returned by `fitDipoleImpl` or
+            `fitDipoleImplLeastSquares`
 
         Returns
         -------
@@ -909,8 +1556,10 @@ class DipoleFitAlgorithm(object):
             plt.colorbar(fig, cmap='gray')
             return fig
 
-        z = result.data
-        fit = result.best_fit
+        # Only the fitted pixels were kept; put them back in the footprint bounding box
+        z, fit = np.full((2,) + result.pixelMask.shape, np.nan)
+        z[result.pixelMask] = result.data
+        fit[result.pixelMask] = result.best_fit
         bbox = footprint.getBBox()
         extent = (bbox.getBeginX(), bbox.getEndX(), bbox.getBeginY(), bbox.getEndY())
         if z.shape[0] == 3:
@@ -1078,7 +1727,136 @@ class DipoleFitPlugin(measBase.SingleFramePlugin):
             TODO: DM-17458
         """
 
-        result = None
+        if not self._checkDipoleCandidate(measRecord):
+            return None
+
+        alg = self._makeAlgorithm(exposure, posExp, negExp)
+        if self.config.doPrefilter and not self._prefilterDipole(alg, measRecord):
+            return None
+        result, error = self._fitRecord(alg, measRecord)
+        self._recordResult(measRecord, result, error)
+
+    def measureCatalog(self, sources, exposure, posExp=None, negExp=None, numThreads=1):
+        """Fit dipoles to all records of a catalog in one batch.
+
+        Equivalent to calling `measure` on each record, but the fitting
+        algorithm (and its PSF size estimate) is set up once per worker
+        rather than once per record. The records are grouped by footprint
+        bounding box size and fitted largest first by a pool of
+        ``numThreads`` workers; the results are written to the catalog in
+        the calling thread.
+
+        Parameters
+        ----------
+        sources : `lsst.afw.table.SourceCatalog`
+            diaSources that will be measured using dipole measurement
+        exposure : `lsst.afw.image.Exposure`
+            Difference exposure on which the diaSources were detected
+        posExp : `lsst.afw.image.Exposure`, optional
+            "Positive" exposure, typically a science exposure, or None if unavailable
+        negExp : `lsst.afw.image.Exposure`, optional
+            "Negative" exposure, typically a template exposure, or None if unavailable
+        numThreads : `int`, optional
+            Number of worker threads.
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct`
+            Struct containing:
+
+            - ``numFit`` : number of records that were fit (`int`)
+            - ``numFitsAvoided`` : number of putative dipoles rejected by
+              the prefilter, and therefore not fit (`int`)
+            - ``psfImageCacheHits``, ``psfImageCacheMisses`` : number of
+              PSF images found in, and added to, the PSF image cache by
+              these fits (`int`)
+        """
+        alg = self._makeAlgorithm(exposure, posExp, negExp)
+        psfImageCache = PsfImageCache.getInstance()
+        hits, misses = psfImageCache.getHits(), psfImageCache.getMisses()
+
+        groups = defaultdict(list)
+        numFitsAvoided = 0
+        for measRecord in sources:
+            if not self._checkDipoleCandidate(measRecord):
+                continue
+            if self.config.doPrefilter and not self._prefilterDipole(alg, measRecord):
+                numFitsAvoided += 1
+                continue
+            bbox = measRecord.getFootprint().getBBox()
+            groups[(bbox.getWidth(), bbox.getHeight())].append(measRecord)
+        records = [measRecord for size in sorted(groups, key=lambda size: size[0]*size[1], reverse=True)
+                   for measRecord in groups[size]]
+        if not records:
+            return Struct(numFit=0, numFitsAvoided=numFitsAvoided, psfImageCacheHits=0,
+                          psfImageCacheMisses=0)
+
+        numThreads = max(1, min(numThreads, len(records)))
+        algorithms = queue.Queue()
+        algorithms.put(alg)
+        for i in range(1, numThreads):
+            # Psf models cache their images, so give each worker its own copy.
+            algorithms.put(self._makeAlgorithm(
+                *[self._copyExposureWithPsf(exp) for exp in (exposure, posExp, negExp)]))
+
+        def fitRecord(measRecord):
+            alg = algorithms.get()
+            try:
+                return self._fitRecord(alg, measRecord)
+            finally:
+                algorithms.put(alg)
+
+        if numThreads > 1:
+            with ThreadPoolExecutor(max_workers=numThreads) as executor:
+                results = list(executor.map(fitRecord, records))
+        else:
+            results = [fitRecord(measRecord) for measRecord in records]
+
+        for measRecord, (result, error) in zip(records, results):
+            self._recordResult(measRecord, result, error)
+
+        return Struct(numFit=len(records), numFitsAvoided=numFitsAvoided,
+                      psfImageCacheHits=psfImageCache.getHits() - hits,
+                      psfImageCacheMisses=psfImageCache.getMisses() - misses)
+
+    def _makeAlgorithm(self, exposure, posExp=None, negExp=None):
+        """Return the fitting algorithm for a set of exposures, using the
+        shared PSF image cache if ``config.usePsfImageCache``.
+        """
+        psfImageCache = None
+        if self.config.usePsfImageCache:
+            psfImageCache = PsfImageCache.getInstance()
+            psfImageCache.setSubpixelGrid(self.config.psfImageCacheSubpixelGrid)
+        return self.DipoleFitAlgorithmClass(exposure, posImage=posExp, negImage=negExp,
+                                            psfImageCache=psfImageCache)
+
+    @staticmethod
+    def _copyExposureWithPsf(exposure):
+        """Return a view of ``exposure`` (sharing its pixels) with a copy of its Psf.
+        """
+        if exposure is None:
+            return None
+        copy = exposure.Factory(exposure, exposure.getBBox())
+        if exposure.getPsf() is not None:
+            copy.setPsf(exposure.getPsf().clone())
+        return copy
+
+    def _checkDipoleCandidate(self, measRecord):
+        """Check whether the footprint of a record consists of a putative dipole.
+
+        Records that are not putative dipoles are flagged as such.
+
+        Parameters
+        ----------
+        measRecord : `lsst.afw.table.SourceRecord`
+            diaSource to check
+
+        Returns
+        -------
+        doFit : `bool`
+            Whether the record should be fit; true for putative dipoles, or
+            for all records if ``fitAllDiaSources`` is set.
+        """
         pks = measRecord.getFootprint().getPeaks()
 
         # Check if the footprint consists of a putative dipole - else don't fit it.
@@ -1091,26 +1869,98 @@ class DipoleFitPlugin(measBase.SingleFramePlugin):
             measRecord.set(self.classificationAttemptedFlagKey, False)
             self.fail(measRecord, measBase.MeasurementError('not a dipole', self.FAILURE_NOT_DIPOLE))
             if not self.config.fitAllDiaSources:
-                return result
+                return False
+        return True
+
+    def _prefilterDipole(self, alg, measRecord):
+        """Check whether a record is a plausible dipole, using only the
+        moments of its footprint pixels (see `DipoleFitAlgorithm.computeFootprintMoments`).
+
+        Records that fail are flagged as not being dipoles.
+
+        Parameters
+        ----------
+        alg : `DipoleFitAlgorithm`
+            Algorithm set up with the exposures to fit
+        measRecord : `lsst.afw.table.SourceRecord`
+            diaSource to check
 
+        Returns
+        -------
+        doFit : `bool`
+            Whether the record passed the prefilter and should be fit.
+        """
+        moments = alg.computeFootprintMoments(measRecord)
+        maxSep = alg.psfSigma * self.config.maxSeparation
+        # A NaN separation (one empty lobe) also fails here
+        if (moments.lobeFluxFraction >= self.config.prefilterMinLobeFluxFraction and
+                moments.separation <= maxSep):
+            return True
+
+        self.log.debug("Record %d rejected by dipole prefilter: lobe flux fraction %.2f, separation %.2f",
+                       measRecord.getId(), moments.lobeFluxFraction, moments.separation)
+        measRecord.set(self.classificationFlagKey, False)
+        measRecord.set(self.classificationAttemptedFlagKey, False)
+        self.fail(measRecord, measBase.MeasurementError('not a plausible dipole', self.FAILURE_NOT_DIPOLE))
+        return False
+
+    def _fitRecord(self, alg, measRecord):
+        """Fit a dipole to a single record, catching fit failures.
+
+        This does not modify ``measRecord``, so that it may be called from
+        worker threads.
+
+        Parameters
+        ----------
+        alg : `DipoleFitAlgorithm`
+            Algorithm set up with the exposures to fit
+        measRecord : `lsst.afw.table.SourceRecord`
+            diaSource to fit
+
+        Returns
+        -------
+        result : `lsst.pipe.base.Struct` or `None`
+            Result of `DipoleFitAlgorithm.fitDipole`, or `None` if the fit failed.
+        error : `lsst.meas.base.MeasurementError` or `None`
+            The failure, if any.
+        """
+        result = error = None
         try:
-            alg = self.DipoleFitAlgorithmClass(exposure, posImage=posExp, negImage=negExp)
             result, _ = alg.fitDipole(
                 measRecord, rel_weight=self.config.relWeight,
                 tol=self.config.tolerance,
                 maxSepInSigma=self.config.maxSeparation,
                 fitBackground=self.config.fitBackground,
                 separateNegParams=self.config.fitSeparateNegParams,
+                psfStampOversampling=self.config.psfStampOversampling,
+                fitMethod=self.config.fitMethod,
+                badMaskPlanes=self.config.badMaskPlanes,
                 verbose=False, display=False)
         except pexExcept.LengthError:
-            self.fail(measRecord, measBase.MeasurementError('edge failure', self.FAILURE_EDGE))
+            error = measBase.MeasurementError('edge failure', self.FAILURE_EDGE)
         except Exception:
-            self.fail(measRecord, measBase.MeasurementError('dipole fit failure', self.FAILURE_FIT))
+            error = measBase.MeasurementError('dipole fit failure', self.FAILURE_FIT)
+        return result, error
+
+    def _recordResult(self, measRecord, result, error=None):
+        """Write the result of a dipole fit to a record and classify it.
+
+        Parameters
+        ----------
+        measRecord : `lsst.afw.table.SourceRecord`
+            diaSource that was fit
+        result : `lsst.pipe.base.Struct` or `None`
+            Result of `DipoleFitAlgorithm.fitDipole`, or `None` if the fit failed.
+        error : `lsst.meas.base.MeasurementError`, optional
+            Failure raised during the fit.
+        """
+        if error is not None:
+            self.fail(measRecord, error)
 
         if result is None:
             measRecord.set(self.classificationFlagKey, False)
             measRecord.set(self.classificationAttemptedFlagKey, False)
-            return result
+            return
 
         self.log.debug("Dipole fit result: %d %s", measRecord.getId(), str(result))
 
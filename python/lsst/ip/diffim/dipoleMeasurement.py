@@ -19,17 +19,24 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import multiprocessing
+from collections import OrderedDict
+
 import numpy as np
 
 import lsst.afw.image as afwImage
 import lsst.geom as geom
 import lsst.pex.config as pexConfig
+import lsst.pipe.base as pipeBase
 from lsst.log import Log
 import lsst.meas.deblender.baseline as deblendBaseline
 from lsst.meas.base.pluginRegistry import register
 from lsst.meas.base import SingleFrameMeasurementTask, SingleFrameMeasurementConfig, \
     SingleFramePluginConfig, SingleFramePlugin
 import lsst.afw.display as afwDisplay
+import lsst.afw.table as afwTable
+
+from .psfImageCache import PsfImageCache
 
 __all__ = ("DipoleMeasurementConfig", "DipoleMeasurementTask", "DipoleAnalysis", "DipoleDeblender",
            "SourceFlagChecker", "ClassificationDipoleConfig", "ClassificationDipolePlugin")
@@ -99,6 +106,21 @@ class ClassificationDipolePlugin(SingleFramePlugin):
 
 class DipoleMeasurementConfig(SingleFrameMeasurementConfig):
     """Measurement of detected diaSources as dipoles"""
+    numProcesses = pexConfig.Field(
+        dtype=int,
+        default=1,
+        doc="Number of processes over which to measure batches of diaSources; "
+            "1 measures them serially in this process. The workers are forked, which is unsafe "
+            "once this process has started threads (e.g. DipoleFitTask with numThreads > 1)",
+        check=lambda x: x >= 1,
+    )
+    batchSize = pexConfig.Field(
+        dtype=int,
+        default=0,
+        doc="Approximate number of diaSources measured per batch when numProcesses > 1; "
+            "parent/child families are never split. 0 picks a size giving four batches per process",
+        check=lambda x: x >= 0,
+    )
 
     def setDefaults(self):
         SingleFrameMeasurementConfig.setDefaults(self)
@@ -343,6 +365,171 @@ class DipoleMeasurementTask(SingleFrameMeasurementTask):
     ConfigClass = DipoleMeasurementConfig
     _DefaultName = "dipoleMeasurement"
 
+    def run(self, measCat, exposure, **kwargs):
+        """Run the measurement plugins, recording in the task metadata the
+        use of the PSF image cache shared by the dipole algorithms
+        (``psfImageCacheHits``, ``psfImageCacheMisses``).
+
+        Parameters
+        ----------
+        measCat : `lsst.afw.table.SourceCatalog`
+            diaSources to measure
+        exposure : `lsst.afw.image.Exposure`
+            Difference exposure on which the diaSources were detected
+        **kwargs
+            Additional keyword arguments for `lsst.meas.base.SingleFrameMeasurementTask.run`.
+        """
+        psfImageCache = PsfImageCache.getInstance()
+        hits, misses = psfImageCache.getHits(), psfImageCache.getMisses()
+        batches = self._makeBatches(measCat)
+        if len(batches) > 1:
+            workerHits, workerMisses = self._runParallel(measCat, exposure, batches, **kwargs)
+        else:
+            SingleFrameMeasurementTask.run(self, measCat, exposure, **kwargs)
+            workerHits, workerMisses = 0, 0
+        self.metadata.set("numBatches", max(len(batches), 1))
+        self.metadata.set("psfImageCacheHits", psfImageCache.getHits() - hits + workerHits)
+        self.metadata.set("psfImageCacheMisses", psfImageCache.getMisses() - misses + workerMisses)
+
+    def _makeBatches(self, measCat):
+        """Partition a catalog into batches of record indices that may be
+        measured independently.
+
+        Every descendant is kept in the same batch as its top-level
+        ancestor, and the indices within each batch are in catalog order.
+        A single batch is returned if the parallel mode is disabled, or
+        cannot be used.
+
+        Parameters
+        ----------
+        measCat : `lsst.afw.table.SourceCatalog`
+            diaSources to measure
+
+        Returns
+        -------
+        batches : `list` of `list` of `int`
+            Indices into ``measCat`` of the records in each batch.
+        """
+        if self.config.numProcesses == 1 or len(measCat) < 2:
+            return [list(range(len(measCat)))]
+        if self.config.doReplaceWithNoise:
+            # Noise replacement depends on every footprint in the exposure
+            self.log.warn("Parallel dipole measurement is not supported with doReplaceWithNoise; "
+                          "measuring serially")
+            return [list(range(len(measCat)))]
+        if "fork" not in multiprocessing.get_all_start_methods():
+            self.log.warn("Parallel dipole measurement requires the fork start method; measuring serially")
+            return [list(range(len(measCat)))]
+
+        parents = {record.getId(): record.getParent() for record in measCat}
+
+        def getRoot(sourceId):
+            while parents.get(sourceId, 0):
+                sourceId = parents[sourceId]
+            return sourceId
+
+        families = OrderedDict()
+        for i, record in enumerate(measCat):
+            families.setdefault(getRoot(record.getId()), []).append(i)
+
+        batchSize = self.config.batchSize
+        if batchSize == 0:
+            batchSize = max(1, -(-len(measCat) // (4*self.config.numProcesses)))
+        batches = [[]]
+        for indices in families.values():
+            if len(batches[-1]) >= batchSize:
+                batches.append([])
+            batches[-1].extend(indices)
+        return [sorted(indices) for indices in batches]
+
+    def _runParallel(self, measCat, exposure, batches, **kwargs):
+        """Measure batches of diaSources on a pool of forked processes.
+
+        The exposure and catalog are shared with the workers through the
+        copy-on-write memory of the forked processes rather than pickled;
+        only the measured field values are returned.  They are written back
+        in catalog order, so the output is identical to a serial run.
+
+        Forking copies only the calling thread, so a lock held by another
+        thread at that moment (e.g. the mutex of the `PsfImageCache`, or
+        the pool of `DipoleFitTask.measureCatalog` when ``numThreads > 1``)
+        stays locked forever in the workers.  This method must therefore
+        not be called once this process has started threads of its own.
+
+        Parameters
+        ----------
+        measCat : `lsst.afw.table.SourceCatalog`
+            diaSources to measure
+        exposure : `lsst.afw.image.Exposure`
+            Difference exposure on which the diaSources were detected
+        batches : `list` of `list` of `int`
+            Indices into ``measCat`` of the records in each batch.
+        **kwargs
+            Additional keyword arguments for `lsst.meas.base.SingleFrameMeasurementTask.run`.
+
+        Returns
+        -------
+        hits, misses : `int`
+            PSF image cache hits and misses in the worker processes.
+        """
+        global _parallelState
+        keys = [item.key for item in measCat.schema
+                if item.field.getName() not in ("id", "parent")]
+        _parallelState = (self, measCat, exposure, keys, kwargs)
+        try:
+            context = multiprocessing.get_context("fork")
+            with context.Pool(min(self.config.numProcesses, len(batches))) as pool:
+                results = pool.map(_measureDipoleBatch, batches, chunksize=1)
+        finally:
+            _parallelState = None
+
+        hits, misses = 0, 0
+        for indices, result in zip(batches, results):
+            for i, values in zip(indices, result.values):
+                record = measCat[i]
+                for key, value in zip(keys, values):
+                    record.set(key, value)
+            hits += result.hits
+            misses += result.misses
+        return hits, misses
+
+
+# State inherited by the forked worker processes of DipoleMeasurementTask
+_parallelState = None
+
+
+def _measureDipoleBatch(indices):
+    """Measure a batch of diaSources in a worker process.
+
+    Parameters
+    ----------
+    indices : `list` of `int`
+        Indices of the records to measure in the inherited catalog.
+
+    Returns
+    -------
+    result : `lsst.pipe.base.Struct`
+        Result struct with components:
+
+        - ``values`` : measured field values of each record (`list` of `list`).
+        - ``hits``, ``misses`` : PSF image cache statistics (`int`).
+    """
+    task, measCat, exposure, keys, kwargs = _parallelState
+    psfImageCache = PsfImageCache.getInstance()
+    hits, misses = psfImageCache.getHits(), psfImageCache.getMisses()
+
+    batch = afwTable.SourceCatalog(measCat.getTable())
+    batch.extend([measCat[i] for i in indices], deep=True)
+    # The measurement framework looks up the children of each parent in a catalog sorted by parent
+    batch.sort(measCat.getTable().getParentKey())
+    SingleFrameMeasurementTask.run(task, batch, exposure, **kwargs)
+
+    records = {record.getId(): record for record in batch}
+    values = [[records[measCat[i].getId()].get(key) for key in keys] for i in indices]
+    return pipeBase.Struct(values=values,
+                           hits=psfImageCache.getHits() - hits,
+                           misses=psfImageCache.getMisses() - misses)
+
 
 #########
 # Other Support classs
@@ -48,6 +48,40 @@ class GetCoaddAsTemplateConfig(pexConfig.Config):
         dtype=int,
         default=3,
     )
+    dcrShiftMethod = pexConfig.ChoiceField(
+        doc="Method used to apply the DCR shifts to the subfilters of a DcrCoadd, "
+            "used only if ``coaddName``='dcr'",
+        dtype=str,
+        default="spline",
+        allowed={
+            "spline": "Cubic spline interpolation of each subfilter",
+            "fourier": "Phase ramps in Fourier space, with one inverse transform per template",
+        },
+    )
+    dcrTileSize = pexConfig.Field(
+        doc="Size in pixels of the tiles in which to shift the subfilters of a DcrCoadd; "
+            "0 shifts each patch at once. Used only if ``coaddName``='dcr' with spline shifts",
+        dtype=int,
+        default=0,
+        check=lambda x: x >= 0,
+    )
+    dcrNumThreads = pexConfig.Field(
+        doc="Number of threads over which to shift the tiles of a DcrCoadd. "
+            "Used only if ``coaddName``='dcr' with spline shifts",
+        dtype=int,
+        default=1,
+        check=lambda x: x >= 1,
+    )
+    dcrWorkingPrecision = pexConfig.ChoiceField(
+        doc="Precision of the intermediate arrays used to shift the subfilters of a DcrCoadd. "
+            "Used only if ``coaddName``='dcr'",
+        dtype=str,
+        default="float64",
+        allowed={
+            "float64": "Double precision, matching the templates of earlier versions",
+            "float32": "Single precision, halving the memory of the shifted subfilters",
+        },
+    )
     warpType = pexConfig.Field(
         doc="Warp type of the coadd template: one of 'direct' or 'psfMatched'",
         dtype=str,
@@ -143,7 +177,6 @@ class GetCoaddAsTemplateTask(pipeBase.Task):
                     continue
                 self.log.info("Constructing DCR-matched template for patch %s" % patchArgDict)
 
-                dcrModel = DcrModel.fromDataRef(sensorRef, **patchArgDict)
                 # The edge pixels of the DcrCoadd may contain artifacts due to missing data.
                 # Each patch has significant overlap, and the contaminated edge pixels in
                 # a new patch will overwrite good pixels in the overlap region from
@@ -153,9 +186,15 @@ class GetCoaddAsTemplateTask(pipeBase.Task):
                 dcrBBox = geom.Box2I(patchSubBBox)
                 dcrBBox.grow(-self.config.templateBorderSize)
                 dcrBBox.include(patchInnerBBox)
+                # Only read the region of the model that is used for the template
+                dcrModel = DcrModel.fromDataRef(sensorRef, **dict(patchArgDict, bbox=dcrBBox))
+                dcrModel.workingDtype = self.config.dcrWorkingPrecision
                 coaddPatch = dcrModel.buildMatchedExposure(bbox=dcrBBox,
                                                            wcs=coaddWcs,
-                                                           visitInfo=exposure.getInfo().getVisitInfo())
+                                                           visitInfo=exposure.getInfo().getVisitInfo(),
+                                                           shiftMethod=self.config.dcrShiftMethod,
+                                                           tileSize=self.config.dcrTileSize,
+                                                           numThreads=self.config.dcrNumThreads)
             else:
                 if not sensorRef.datasetExists(**patchArgDict):
                     self.log.warn("%(datasetType)s, tract=%(tract)s, patch=%(patch)s does not exist"
@@ -20,6 +20,10 @@
 # see <https://www.lsstcorp.org/LegalNotices/>.
 #
 
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import time
+
 import numpy as np
 
 import lsst.afw.image as afwImage
@@ -33,9 +37,11 @@ import lsst.pipe.base as pipeBase
 
 from .imageMapReduce import (ImageMapReduceConfig, ImageMapReduceTask,
                              ImageMapper)
+from .clippedStatistics import ClippedStatisticsConfig, computeClippedStatistics
 
 __all__ = ("DecorrelateALKernelTask", "DecorrelateALKernelConfig",
            "DecorrelateALKernelMapper", "DecorrelateALKernelMapReduceConfig",
+           "DecorrelateALKernelMapReduceTask",
            "DecorrelateALKernelSpatialConfig", "DecorrelateALKernelSpatialTask")
 
 
@@ -49,6 +55,27 @@ class DecorrelateALKernelConfig(pexConfig.Config):
         default=("INTRP", "EDGE", "DETECTED", "SAT", "CR", "BAD", "NO_DATA", "DETECTED_NEGATIVE")
     )
 
+    statistics = pexConfig.ConfigField(
+        dtype=ClippedStatisticsConfig,
+        doc="Estimator for the sigma-clipped mean image variances",
+    )
+
+    inImageSpace = pexConfig.Field(
+        dtype=bool,
+        doc="""Apply the decorrelation by convolving the diffim with the decorrelation kernel in
+        real (image) space. If False, multiply the spectrum of the diffim by the decorrelation
+        filter directly in Fourier space and propagate the variance plane analytically""",
+        default=True
+    )
+
+    padSize = pexConfig.Field(
+        dtype=int,
+        doc="""Number of pixels of apodized padding added to each side of the diffim before
+        Fourier-space decorrelation (when inImageSpace is False)""",
+        default=32,
+        check=lambda x: x >= 0
+    )
+
 
 class DecorrelateALKernelTask(pipeBase.Task):
     """Decorrelate the effect of convolution by Alard-Lupton matching kernel in image difference
@@ -83,6 +110,8 @@ class DecorrelateALKernelTask(pipeBase.Task):
     """
     ConfigClass = DecorrelateALKernelConfig
     _DefaultName = "ip_diffim_decorrelateALKernel"
+    # Cache the statistics of the exposures passed to `run`
+    _cacheStatistics = True
 
     def __init__(self, *args, **kwargs):
         """Create the image decorrelation Task
@@ -102,11 +131,15 @@ class DecorrelateALKernelTask(pipeBase.Task):
         self.statsControl.setAndMask(afwImage.Mask.getPlaneBitMask(self.config.ignoreMaskPlanes))
 
     def computeVarianceMean(self, exposure):
-        statObj = afwMath.makeStatistics(exposure.getMaskedImage().getVariance(),
-                                         exposure.getMaskedImage().getMask(),
-                                         afwMath.MEANCLIP, self.statsControl)
-        var = statObj.getValue(afwMath.MEANCLIP)
-        return var
+        """Compute the sigma-clipped mean of the variance plane of `exposure`.
+
+        The result is cached for `exposure`, unless the task operates on
+        sub-images (see `_cacheStatistics`).
+        """
+        mi = exposure.getMaskedImage()
+        return computeClippedStatistics(mi.getVariance(), mi.getMask(), self.config.ignoreMaskPlanes,
+                                        self.config.statistics,
+                                        owner=exposure if self._cacheStatistics else None).mean
 
     @pipeBase.timeMethod
     def run(self, exposure, templateExposure, subtractedExposure, psfMatchingKernel,
@@ -209,7 +242,12 @@ class DecorrelateALKernelTask(pipeBase.Task):
             pck = kimg2.getArray()
         corrKernel = DecorrelateALKernelTask._computeDecorrelationKernel(kimg.getArray(), svar, tvar,
                                                                          pck)
-        correctedExposure, corrKern = DecorrelateALKernelTask._doConvolve(subtractedExposure, corrKernel)
+        if self.config.inImageSpace:
+            correctedExposure, corrKern = DecorrelateALKernelTask._doConvolve(subtractedExposure, corrKernel)
+        else:
+            correctedExposure = DecorrelateALKernelTask._doFourierDecorrelation(
+                subtractedExposure, kimg.getArray(), svar, tvar, pck, padSize=self.config.padSize)
+            corrKern = DecorrelateALKernelTask._makeFixedKernel(corrKernel)
 
         # Compute the subtracted exposure's updated psf
         psf = subtractedExposure.getPsf().computeKernelImage(geom.Point2D(xcen, ycen)).getArray()
@@ -414,17 +452,207 @@ class DecorrelateALKernelTask(pipeBase.Task):
         -----
         We re-center the kernel if necessary and return the possibly re-centered kernel
         """
+        kern = DecorrelateALKernelTask._makeFixedKernel(kernel)
+        outExp = exposure.clone()  # Do this to keep WCS, PSF, masks, etc.
+        convCntrl = afwMath.ConvolutionControl(False, True, 0)
+        afwMath.convolve(outExp.getMaskedImage(), exposure.getMaskedImage(), kern, convCntrl)
+
+        return outExp, kern
+
+    @staticmethod
+    def _makeFixedKernel(kernel):
+        """Make a `lsst.afw.math.FixedKernel` centered on the peak of a kernel array.
+
+        Parameters
+        ----------
+        kernel : `numpy.array`
+            Input 2-d numpy.array containing the kernel
+
+        Returns
+        -------
+        kern : `lsst.afw.math.FixedKernel`
+            the kernel, with its center set to the location of its peak
+        """
         kernelImg = afwImage.ImageD(kernel.shape[0], kernel.shape[1])
         kernelImg.getArray()[:, :] = kernel
         kern = afwMath.FixedKernel(kernelImg)
         maxloc = np.unravel_index(np.argmax(kernel), kernel.shape)
         kern.setCtrX(maxloc[0])
         kern.setCtrY(maxloc[1])
+        return kern
+
+    @staticmethod
+    def _computeDecorrelationFilter(kappa, shape, svar=0.04, tvar=0.04, preConvKernel=None):
+        """Compute the Fourier-space decorrelation filter on a grid of a given shape.
+
+        Parameters
+        ----------
+        kappa : `numpy.ndarray`
+            A matching kernel 2-d numpy.array derived from Alard & Lupton PSF matching
+        shape : `tuple` of `int`
+            Shape of the (padded) image the filter is to be applied to
+        svar : `float`, optional
+            Average variance of science image used for PSF matching
+        tvar : `float`, optional
+            Average variance of template image used for PSF matching
+        preConvKernel : `numpy.ndarray`, optional
+            If not None, then pre-filtering was applied to science exposure,
+            and this is the pre-convolution kernel.
+
+        Returns
+        -------
+        filt : `numpy.ndarray`
+            the real, non-negative decorrelation filter
+            sqrt((svar + tvar) / (svar + tvar * |kappa_ft|**2)),
+            in `numpy.fft.fft2` frequency order
+
+        Notes
+        -----
+        Only the amplitude of the kernel spectra enters the filter, so the kernels
+        may be zero-padded to `shape` without regard to their centering, and the
+        corresponding real-space kernel is centered on the origin.
+        This filter does not include the clamp that `_computeDecorrelationKernel`
+        applies to the real-space kernel when ``preConvKernel`` is set; see
+        `_doFourierDecorrelation`.
+        """
+        # Psf should not be <= 0, and messes up denominator; set the minimum value to MIN_KERNEL
+        MIN_KERNEL = 1.0e-4
+
+        def _padToShape(kernel):
+            return np.pad(kernel, ((0, shape[0] - kernel.shape[0]), (0, shape[1] - kernel.shape[1])),
+                          mode='constant')
+
+        kft = np.fft.fft2(_padToShape(kappa))
+        kft2 = (np.conj(kft) * kft).real
+        kft2[kft2 < MIN_KERNEL] = MIN_KERNEL
+        denom = svar + tvar * kft2
+        if preConvKernel is not None:
+            mk = np.fft.fft2(_padToShape(preConvKernel))
+            mk2 = (np.conj(mk) * mk).real
+            mk2[mk2 < MIN_KERNEL] = MIN_KERNEL
+            denom = svar * mk2 + tvar * kft2
+        denom[denom < MIN_KERNEL] = MIN_KERNEL
+        return np.sqrt((svar + tvar) / denom)
+
+    @staticmethod
+    def _computeKernelFilter(kernel, shape):
+        """Compute the Fourier-space filter equivalent to convolving with a real-space kernel.
+
+        Parameters
+        ----------
+        kernel : `numpy.ndarray`
+            A 2-d real-space kernel, centered on its peak as in `_makeFixedKernel`.
+        shape : `tuple` of `int`
+            Shape of the (padded) image the filter is to be applied to.
+            Must be at least as large as ``kernel``.
+
+        Returns
+        -------
+        filt : `numpy.ndarray`
+            The complex filter, in `numpy.fft.fft2` frequency order.
+
+        Notes
+        -----
+        `lsst.afw.math.convolve` does not flip the kernel, so the filter is the
+        complex conjugate of the transform of the kernel wrapped around the origin.
+        """
+        center = np.unravel_index(np.argmax(kernel), kernel.shape)
+        rows = (np.arange(kernel.shape[0]) - center[0]) % shape[0]
+        cols = (np.arange(kernel.shape[1]) - center[1]) % shape[1]
+        wrapped = np.zeros(shape)
+        wrapped[np.ix_(rows, cols)] = kernel
+        return np.conj(np.fft.fft2(wrapped))
+
+    @staticmethod
+    def _doFourierDecorrelation(exposure, kappa, svar, tvar, preConvKernel=None, padSize=32):
+        """Decorrelate an Exposure by applying the decorrelation filter in Fourier space.
+
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.Exposure`
+            Input exposure (the uncorrected diffim) to be decorrelated.
+        kappa : `numpy.ndarray`
+            A matching kernel 2-d numpy.array derived from Alard & Lupton PSF matching
+        svar : `float`
+            Average variance of science image used for PSF matching
+        tvar : `float`
+            Average variance of template image used for PSF matching
+        preConvKernel : `numpy.ndarray`, optional
+            If not None, then pre-filtering was applied to science exposure,
+            and this is the pre-convolution kernel.
+        padSize : `int`, optional
+            Number of pixels of apodized padding added to each side of the image.
+
+        Returns
+        -------
+        out : `lsst.afw.image.Exposure`
+            a new Exposure with the decorrelated image and variance planes.
+
+        Notes
+        -----
+        The image is padded by reflection and the padding is tapered
+        to the image mean with a cosine window, to suppress the
+        artifacts arising from the periodic boundary conditions of the
+        FFT. The variance plane is the input variance convolved with the
+        square of the real-space decorrelation kernel, which is exact for
+        uncorrelated input noise. The mask plane is left unchanged.
+
+        If ``preConvKernel`` is set, the real-space kernel from
+        `_computeDecorrelationKernel` is clamped to limit the noise
+        amplification. The filter is then the transform of that clamped
+        kernel, so the result matches the image-space convolution.
+        """
         outExp = exposure.clone()  # Do this to keep WCS, PSF, masks, etc.
-        convCntrl = afwMath.ConvolutionControl(False, True, 0)
-        afwMath.convolve(outExp.getMaskedImage(), exposure.getMaskedImage(), kern, convCntrl)
+        image = exposure.getMaskedImage().getImage().getArray().astype(float)
+        variance = exposure.getMaskedImage().getVariance().getArray().astype(float)
 
-        return outExp, kern
+        # Some masked regions are NaN or infinite!, and FFTs no likey.
+        isBad = ~np.isfinite(image) | ~np.isfinite(variance)
+        imageMean = np.mean(image[~isBad]) if np.any(~isBad) else 0.
+        image[isBad] = imageMean
+        variance[isBad] = np.mean(variance[~isBad]) if np.any(~isBad) else 0.
+
+        if preConvKernel is not None:
+            # Clamp in real space, exactly as for the image-space convolution
+            corrKernel = DecorrelateALKernelTask._computeDecorrelationKernel(kappa, svar, tvar,
+                                                                             preConvKernel)
+            padSize = max(padSize, max(corrKernel.shape) // 2 + 1)
+        else:
+            padSize = max(padSize, max(kappa.shape) // 2)
+        paddedShape = (image.shape[0] + 2*padSize, image.shape[1] + 2*padSize)
+        padMode = 'reflect' if min(image.shape) > padSize else 'edge'
+
+        def _taper(n):
+            # Cosine roll-off from 1 at the image boundary to 0 at the edge of the padding
+            window = np.ones(n + 2*padSize)
+            if padSize > 0:
+                ramp = 0.5 * (1. - np.cos(np.pi * (np.arange(padSize) + 0.5) / padSize))
+                window[:padSize] = ramp
+                window[-padSize:] = ramp[::-1]
+            return window
+
+        window = np.outer(_taper(image.shape[0]), _taper(image.shape[1]))
+        paddedImage = np.pad(image - imageMean, padSize, mode=padMode) * window
+        paddedVariance = np.pad(variance, padSize, mode=padMode)
+
+        if preConvKernel is not None:
+            filt = DecorrelateALKernelTask._computeKernelFilter(corrKernel, paddedShape)
+        else:
+            filt = DecorrelateALKernelTask._computeDecorrelationFilter(kappa, paddedShape, svar, tvar)
+        corrImage = np.fft.ifft2(np.fft.fft2(paddedImage) * filt).real + imageMean
+        # Variance of a linear filter on uncorrelated noise: convolve with the squared kernel
+        kernel2Ft = np.fft.fft2(np.fft.ifft2(filt).real**2.)
+        corrVariance = np.fft.ifft2(np.fft.fft2(paddedVariance) * kernel2Ft).real
+
+        inner = (slice(padSize, padSize + image.shape[0]), slice(padSize, padSize + image.shape[1]))
+        corrImage = corrImage[inner]
+        corrVariance = corrVariance[inner]
+        corrImage[isBad] = np.nan
+        corrVariance[isBad] = np.nan
+
+        outExp.getMaskedImage().getImage().getArray()[:, :] = corrImage
+        outExp.getMaskedImage().getVariance().getArray()[:, :] = corrVariance
+        return outExp
 
 
 class DecorrelateALKernelMapper(DecorrelateALKernelTask, ImageMapper):
@@ -437,6 +665,8 @@ class DecorrelateALKernelMapper(DecorrelateALKernelTask, ImageMapper):
 
     ConfigClass = DecorrelateALKernelConfig
     _DefaultName = 'ip_diffim_decorrelateALKernelMapper'
+    # The sub-exposures of each cell are views, whose statistics are not reused
+    _cacheStatistics = False
 
     def __init__(self, *args, **kwargs):
         DecorrelateALKernelTask.__init__(self, *args, **kwargs)
@@ -526,6 +756,125 @@ class DecorrelateALKernelMapReduceConfig(ImageMapReduceConfig):
         target=DecorrelateALKernelMapper
     )
 
+    numThreads = pexConfig.Field(
+        dtype=int,
+        doc="""Number of threads with which to decorrelate the sub-images concurrently
+        (used by `DecorrelateALKernelMapReduceTask`)""",
+        default=1,
+        check=lambda x: x >= 1
+    )
+
+
+class DecorrelateALKernelMapReduceTask(ImageMapReduceTask):
+    """Perform A&L decorrelation on a grid of sub-images, optionally using
+    multiple threads.
+
+    This task is an `ImageMapReduceTask` specialized for running
+    `DecorrelateALKernelMapper` on each sub-image. The (possibly
+    spatially-varying) PSF matching kernel is first evaluated at the
+    center of every expanded sub-image in a single pass, since
+    evaluating a spatially-varying kernel is not thread-safe. The
+    per-cell decorrelation, which is dominated by FFTs and
+    convolutions that release the GIL, is then run on a pool of
+    `numThreads` threads, each with its own mapper instance. The
+    mapper results are returned in grid order, so the reduced image
+    does not depend on the number of threads.
+
+    The run time of each cell is recorded in the task metadata as
+    ``cellRunTime``.
+    """
+    ConfigClass = DecorrelateALKernelMapReduceConfig
+    _DefaultName = "ip_diffim_decorrelateALKernelMapReduce"
+
+    def _runMapper(self, exposure, doClone=False, **kwargs):
+        """Perform `mapper.run` on each sub-exposure, possibly concurrently.
+
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.Exposure`
+            the original exposure which is used as the template
+        doClone : `bool`
+            if True, clone the subimages before passing to subtask;
+            in that case, the sub-exps do not have to be considered as read-only
+        kwargs :
+            additional keyword arguments to be passed to
+            `mapper.run` and `self._generateGrid`, including `forceEvenSized`.
+            Must include either `psfMatchingKernel` or `alTaskResult`.
+
+        Returns
+        -------
+        a list of `pipeBase.Struct`s as returned by `mapper.run`.
+        """
+        if self.boxes0 is None:
+            self._generateGrid(exposure, **kwargs)  # possibly pass `forceEvenSized`
+        if len(self.boxes0) != len(self.boxes1):
+            raise ValueError('Bounding boxes list and expanded bounding boxes list are of different lengths')
+
+        alTaskResult = kwargs.pop('alTaskResult', None)
+        psfMatchingKernel = kwargs.pop('psfMatchingKernel', None)
+        if alTaskResult is None and psfMatchingKernel is None:
+            raise RuntimeError('Both alTaskResult and psfMatchingKernel cannot be None')
+        psfMatchingKernel = alTaskResult.psfMatchingKernel if alTaskResult is not None else psfMatchingKernel
+
+        # Evaluate the matching kernel where `DecorrelateALKernelTask.run` would, at the center
+        # of each expanded sub-exposure
+        t0 = time.time()
+        cellKernels = []
+        for box1 in self.boxes1:
+            kimg = afwImage.ImageD(psfMatchingKernel.getDimensions())
+            psfMatchingKernel.computeImage(kimg, True, (box1.getBeginX() + box1.getEndX()) / 2.,
+                                           (box1.getBeginY() + box1.getEndY()) / 2.)
+            cellKernels.append(afwMath.FixedKernel(kimg))
+        self.metadata.set("kernelEvaluationTime", time.time() - t0)
+
+        numThreads = min(self.config.numThreads, len(self.boxes0))
+        mapperList = [self.mapper] + [self.config.mapper.apply() for _ in range(numThreads - 1)]
+        mappers = queue.Queue()
+        for mapper in mapperList:
+            mappers.put(mapper)
+
+        def runCell(i):
+            subExp = exposure.Factory(exposure, self.boxes0[i])
+            expandedSubExp = exposure.Factory(exposure, self.boxes1[i])
+            if doClone:
+                subExp = subExp.clone()
+                expandedSubExp = expandedSubExp.clone()
+            mapper = mappers.get()
+            try:
+                t0 = time.time()
+                result = mapper.run(subExp, expandedSubExp, exposure.getBBox(),
+                                    psfMatchingKernel=cellKernels[i], **kwargs)
+                runTime = time.time() - t0
+            finally:
+                mappers.put(mapper)
+            if self.config.returnSubImages:
+                toAdd = pipeBase.Struct(inputSubExposure=subExp,
+                                        inputExpandedSubExposure=expandedSubExp)
+                result.mergeItems(toAdd, 'inputSubExposure', 'inputExpandedSubExposure')
+            return result, runTime
+
+        self.log.info("Processing %d sub-exposures with %d threads", len(self.boxes0), numThreads)
+        # The mappers lower their log level while running; do that once here, as mapper
+        # instances share a logger and would otherwise race to restore it
+        logLevels = [(mapper.log, mapper.log.getLevel()) for mapper in mapperList]
+        for mapper in mapperList:
+            mapper.log.setLevel(lsst.log.WARN)
+        try:
+            if numThreads > 1:
+                with ThreadPoolExecutor(max_workers=numThreads) as executor:
+                    cellResults = list(executor.map(runCell, range(len(self.boxes0))))
+            else:
+                cellResults = [runCell(i) for i in range(len(self.boxes0))]
+        finally:
+            for log, level in reversed(logLevels):
+                log.setLevel(level)
+
+        mapperResults = []
+        for result, runTime in cellResults:
+            self.metadata.add("cellRunTime", runTime)
+            mapperResults.append(result)
+        return mapperResults
+
 
 class DecorrelateALKernelSpatialConfig(pexConfig.Config):
     """Configuration parameters for the DecorrelateALKernelSpatialTask.
@@ -546,6 +895,61 @@ class DecorrelateALKernelSpatialConfig(pexConfig.Config):
         default=("INTRP", "EDGE", "DETECTED", "SAT", "CR", "BAD", "NO_DATA", "DETECTED_NEGATIVE")
     )
 
+    statistics = pexConfig.ConfigField(
+        dtype=ClippedStatisticsConfig,
+        doc="Estimator for the sigma-clipped mean image variances",
+    )
+
+    doInterpolateKernels = pexConfig.Field(
+        dtype=bool,
+        doc="""When spatially varying, compute the decorrelation kernel only at a coarse grid of
+        control points, interpolate it across the image and apply a single spatially-varying
+        convolution, rather than running the decorrelation independently on every sub-image""",
+        default=False
+    )
+
+    controlPointsX = pexConfig.Field(
+        dtype=int,
+        doc="""Number of decorrelation kernel control points along the x-axis
+        (used if `doInterpolateKernels` is True)""",
+        default=4,
+        check=lambda x: x >= 1
+    )
+
+    controlPointsY = pexConfig.Field(
+        dtype=int,
+        doc="""Number of decorrelation kernel control points along the y-axis
+        (used if `doInterpolateKernels` is True)""",
+        default=4,
+        check=lambda x: x >= 1
+    )
+
+    interpolationSpatialOrder = pexConfig.Field(
+        dtype=int,
+        doc="""Order of the Chebyshev polynomial used to interpolate the decorrelation kernel
+        between control points. Should be no higher than that supported by the number of control
+        points (used if `doInterpolateKernels` is True)""",
+        default=2,
+        check=lambda x: x >= 0
+    )
+
+    interpolationNumBasis = pexConfig.Field(
+        dtype=int,
+        doc="""Maximum number of principal-component basis kernels used to represent the
+        interpolated decorrelation kernel (used if `doInterpolateKernels` is True)""",
+        default=4,
+        check=lambda x: x >= 1
+    )
+
+    maxInterpolationDistance = pexConfig.Field(
+        dtype=int,
+        doc="""Maximum distance (in pixels) over which the spatially-varying decorrelation kernel
+        is linearly interpolated by the convolution; 0 computes the kernel at every pixel
+        (used if `doInterpolateKernels` is True)""",
+        default=10,
+        check=lambda x: x >= 0
+    )
+
     def setDefaults(self):
         self.decorrelateMapReduceConfig.gridStepX = self.decorrelateMapReduceConfig.gridStepY = 40
         self.decorrelateMapReduceConfig.cellSizeX = self.decorrelateMapReduceConfig.cellSizeY = 41
@@ -571,7 +975,10 @@ class DecorrelateALKernelSpatialTask(pipeBase.Task):
     subExposures on a grid, and performs the `run` method of @ref
     DecorrelateALKernelTask on each subExposure. This enables it to
     account for spatially-varying PSFs and noise in the exposures when
-    performing the decorrelation.
+    performing the decorrelation. If `doInterpolateKernels` is set, the
+    decorrelation kernel is instead computed only at a coarse grid of
+    control points and interpolated, and the image difference is
+    convolved once with the resulting spatially-varying kernel.
 
     This task has no standalone example, however it is applied as a
     subtask of pipe.tasks.imageDifference.ImageDifferenceTask.
@@ -599,14 +1006,16 @@ class DecorrelateALKernelSpatialTask(pipeBase.Task):
         self.statsControl.setNumIter(3)
         self.statsControl.setAndMask(afwImage.Mask.getPlaneBitMask(self.config.ignoreMaskPlanes))
 
-    def computeVarianceMean(self, exposure):
+    def computeVarianceMean(self, exposure, subImage=False):
         """Compute the mean of the variance plane of `exposure`.
+
+        The result is cached for `exposure` unless ``subImage`` is set, as
+        the statistics of sub-image views are not reused.
         """
-        statObj = afwMath.makeStatistics(exposure.getMaskedImage().getVariance(),
-                                         exposure.getMaskedImage().getMask(),
-                                         afwMath.MEANCLIP, self.statsControl)
-        var = statObj.getValue(afwMath.MEANCLIP)
-        return var
+        mi = exposure.getMaskedImage()
+        return computeClippedStatistics(mi.getVariance(), mi.getMask(), self.config.ignoreMaskPlanes,
+                                        self.config.statistics,
+                                        owner=None if subImage else exposure).mean
 
     def run(self, scienceExposure, templateExposure, subtractedExposure, psfMatchingKernel,
             spatiallyVarying=True, preConvKernel=None):
@@ -662,12 +1071,17 @@ class DecorrelateALKernelSpatialTask(pipeBase.Task):
         if spatiallyVarying:
             self.log.info("Variance (science, template): (%f, %f)", svar, tvar)
             self.log.info("Variance (uncorrected diffim): %f", var)
-            config = self.config.decorrelateMapReduceConfig
-            task = ImageMapReduceTask(config=config)
-            results = task.run(subtractedExposure, science=scienceExposure,
-                               template=templateExposure, psfMatchingKernel=psfMatchingKernel,
-                               preConvKernel=preConvKernel, forceEvenSized=True)
-            results.correctedExposure = results.exposure
+            if self.config.doInterpolateKernels:
+                results = self.runInterpolated(scienceExposure, templateExposure, subtractedExposure,
+                                               psfMatchingKernel, svar=svar, tvar=tvar,
+                                               preConvKernel=preConvKernel)
+            else:
+                config = self.config.decorrelateMapReduceConfig
+                task = DecorrelateALKernelMapReduceTask(config=config)
+                results = task.run(subtractedExposure, science=scienceExposure,
+                                   template=templateExposure, psfMatchingKernel=psfMatchingKernel,
+                                   preConvKernel=preConvKernel, forceEvenSized=True)
+                results.correctedExposure = results.exposure
 
             # Make sure masks of input image are propagated to diffim
             def gm(exp):
@@ -684,3 +1098,165 @@ class DecorrelateALKernelSpatialTask(pipeBase.Task):
                                subtractedExposure, psfMatchingKernel, preConvKernel=preConvKernel)
 
         return results
+
+    @pipeBase.timeMethod
+    def runInterpolated(self, scienceExposure, templateExposure, subtractedExposure, psfMatchingKernel,
+                        svar, tvar, preConvKernel=None):
+        """Perform spatially-varying decorrelation using an interpolated decorrelation kernel.
+
+        The decorrelation kernel is computed only at a coarse grid of
+        control points (the centers of a `controlPointsX` x
+        `controlPointsY` tiling of the exposure), using the matching
+        kernel and the local image variances at each point. The
+        resulting kernels are decomposed into a small number of
+        principal-component basis kernels, whose coefficients are
+        interpolated across the exposure with a Chebyshev
+        polynomial. The diffim is then convolved once with the
+        resulting spatially-varying `lsst.afw.math.LinearCombinationKernel`.
+
+        Parameters
+        ----------
+        scienceExposure : `lsst.afw.image.Exposure`
+           the science Exposure used for PSF matching
+        templateExposure : `lsst.afw.image.Exposure`
+           the template Exposure used for PSF matching
+        subtractedExposure : `lsst.afw.image.Exposure`
+           the subtracted Exposure produced by `ip_diffim.ImagePsfMatchTask.subtractExposures()`
+        psfMatchingKernel :
+           an (optionally spatially-varying) PSF matching kernel produced
+           by `ip_diffim.ImagePsfMatchTask.subtractExposures()`
+        svar : `float`
+           image variance of the full science image, used where the local variance is undefined
+        tvar : `float`
+           image variance of the full template image, used where the local variance is undefined
+        preConvKernel : `lsst.meas.algorithms.Psf`, optional
+           if not none, the scienceExposure has been pre-filtered with this kernel.
+
+        Returns
+        -------
+        results : `lsst.pipe.base.Struct`
+            a structure containing:
+
+            - ``correctedExposure`` : the decorrelated diffim
+            - ``correctionKernel`` : the spatially-varying decorrelation kernel
+        """
+        corrKernel = self._computeInterpolatedKernel(scienceExposure, templateExposure,
+                                                     subtractedExposure.getBBox(), psfMatchingKernel,
+                                                     svar, tvar, preConvKernel=preConvKernel)
+
+        correctedExposure = subtractedExposure.clone()  # Do this to keep WCS, PSF, masks, etc.
+        convCntrl = afwMath.ConvolutionControl(False, True, self.config.maxInterpolationDistance)
+        afwMath.convolve(correctedExposure.getMaskedImage(), subtractedExposure.getMaskedImage(),
+                         corrKernel, convCntrl)
+
+        # Compute the subtracted exposure's updated psf from the kernel at the center of the image
+        center = geom.Box2D(subtractedExposure.getBBox()).getCenter()
+        kimg = afwImage.ImageD(corrKernel.getDimensions())
+        corrKernel.computeImage(kimg, False, center.getX(), center.getY())
+        psf = subtractedExposure.getPsf().computeKernelImage(center).getArray()
+        psfc = DecorrelateALKernelTask.computeCorrectedDiffimPsf(kimg.getArray(), psf, svar=svar, tvar=tvar)
+        psfcI = afwImage.ImageD(psfc.shape[1], psfc.shape[0])
+        psfcI.getArray()[:, :] = psfc
+        correctedExposure.setPsf(measAlg.KernelPsf(afwMath.FixedKernel(psfcI)))
+
+        return pipeBase.Struct(correctedExposure=correctedExposure, correctionKernel=corrKernel)
+
+    def _computeInterpolatedKernel(self, scienceExposure, templateExposure, bbox, psfMatchingKernel,
+                                   svar, tvar, preConvKernel=None):
+        """Build a spatially-varying decorrelation kernel from kernels computed at control points.
+
+        Parameters
+        ----------
+        scienceExposure : `lsst.afw.image.Exposure`
+           the science Exposure used for PSF matching
+        templateExposure : `lsst.afw.image.Exposure`
+           the template Exposure used for PSF matching
+        bbox : `lsst.geom.Box2I`
+           bounding box over which the kernel is to be interpolated
+        psfMatchingKernel :
+           an (optionally spatially-varying) PSF matching kernel
+        svar : `float`
+           fallback science image variance
+        tvar : `float`
+           fallback template image variance
+        preConvKernel : `lsst.meas.algorithms.Psf`, optional
+           if not none, the scienceExposure has been pre-filtered with this kernel.
+
+        Returns
+        -------
+        kernel : `lsst.afw.math.LinearCombinationKernel`
+            the spatially-varying decorrelation kernel
+        """
+        nx, ny = self.config.controlPointsX, self.config.controlPointsY
+        cellWidth = bbox.getWidth() / nx
+        cellHeight = bbox.getHeight() / ny
+
+        pck = None
+        if preConvKernel is not None:
+            kimg2 = afwImage.ImageD(preConvKernel.getDimensions())
+            preConvKernel.computeImage(kimg2, False)
+            pck = kimg2.getArray()
+
+        points = []
+        corrKernels = []
+        kimg = afwImage.ImageD(psfMatchingKernel.getDimensions())
+        for iy in range(ny):
+            for ix in range(nx):
+                cellBBox = geom.Box2I(geom.Point2I(bbox.getMinX() + int(ix*cellWidth),
+                                                   bbox.getMinY() + int(iy*cellHeight)),
+                                      geom.Point2I(bbox.getMinX() + int((ix + 1)*cellWidth) - 1,
+                                                   bbox.getMinY() + int((iy + 1)*cellHeight) - 1))
+                cellCenter = geom.Box2D(cellBBox).getCenter()
+                xcen, ycen = cellCenter.getX(), cellCenter.getY()
+                psfMatchingKernel.computeImage(kimg, True, xcen, ycen)
+
+                # Local variances, as would be used by `DecorrelateALKernelMapper` in this cell
+                localSvar = self.computeVarianceMean(scienceExposure.Factory(scienceExposure, cellBBox),
+                                                     subImage=True)
+                localTvar = self.computeVarianceMean(templateExposure.Factory(templateExposure, cellBBox),
+                                                     subImage=True)
+                localSvar = svar if np.isnan(localSvar) else localSvar
+                localTvar = tvar if np.isnan(localTvar) else localTvar
+
+                points.append((xcen, ycen))
+                corrKernels.append(DecorrelateALKernelTask._computeDecorrelationKernel(
+                    kimg.getArray().copy(), localSvar, localTvar, pck))
+
+        # Kernels are centered on their peak; trim them all to the smallest common shape
+        shape = np.min([k.shape for k in corrKernels], axis=0)
+        trimmed = []
+        for k in corrKernels:
+            dy, dx = (k.shape[0] - shape[0]) // 2, (k.shape[1] - shape[1]) // 2
+            trimmed.append(k[dy:dy + shape[0], dx:dx + shape[1]].ravel())
+
+        # Principal-component basis kernels and their coefficients at each control point
+        u, s, vt = np.linalg.svd(np.array(trimmed), full_matrices=False)
+        nBasis = min(self.config.interpolationNumBasis, len(s))
+        coeffs = u[:, :nBasis]*s[:nBasis]
+
+        # Least-squares fit of the coefficients with the afw spatial function itself, so that
+        # the parameter ordering and coordinate normalization are those used by the convolution
+        fitBox = geom.Box2D(bbox)
+        spatialFunc = afwMath.Chebyshev1Function2D(self.config.interpolationSpatialOrder, fitBox)
+        nParams = spatialFunc.getNParameters()
+        design = np.zeros((len(points), nParams))
+        for i in range(nParams):
+            unitParams = np.zeros(nParams)
+            unitParams[i] = 1.
+            spatialFunc.setParameters(list(unitParams))
+            design[:, i] = [spatialFunc(x, y) for x, y in points]
+        params = np.linalg.lstsq(design, coeffs, rcond=None)[0]
+
+        basisList = []
+        spatialFuncList = []
+        for b in range(nBasis):
+            basisImg = afwImage.ImageD(int(shape[1]), int(shape[0]))
+            basisImg.getArray()[:, :] = vt[b].reshape(shape)
+            basisList.append(afwMath.FixedKernel(basisImg))
+            func = afwMath.Chebyshev1Function2D(self.config.interpolationSpatialOrder, fitBox)
+            func.setParameters(list(params[:, b]))
+            spatialFuncList.append(func)
+
+        self.log.info("Interpolating decorrelation kernel from %d control points with %d basis kernels",
+                      len(points), nBasis)
+        return afwMath.LinearCombinationKernel(basisList, spatialFuncList)
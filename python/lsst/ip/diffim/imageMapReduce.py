@@ -471,6 +471,44 @@ class ImageMapReduceConfig(pexConfig.Config):
         default=True
     )
 
+    doAdaptiveGrid = pexConfig.Field(
+        dtype=bool,
+        doc="""Adaptively refine the grid where the PSF varies. The exposure is first
+               tiled with non-overlapping cells of (at most) cellSizeX by cellSizeY. Each
+               cell is then recursively split in half along each axis whenever the
+               (normalized) PSF image differs between its center and any of its corners by
+               more than `adaptiveTolerance`, down to cells of minCellSizeX by minCellSizeY.
+               The PSF is taken from the `psfMatchingKernel` keyword argument passed to
+               `run`, if given, and otherwise from the exposure. Ignored if
+               `cellCentroidsX` and `cellCentroidsY` are given""",
+        default=False
+    )
+
+    adaptiveTolerance = pexConfig.Field(
+        dtype=float,
+        doc="""Maximum sum of absolute differences between the normalized PSF images at
+               the center and corners of a cell for the cell not to be split further
+               (used if doAdaptiveGrid is True)""",
+        default=0.05,
+        check=lambda x: x >= 0.
+    )
+
+    minCellSizeX = pexConfig.Field(
+        dtype=float,
+        doc="""Minimum dimension of adaptively refined grid cells in x direction
+               (used if doAdaptiveGrid is True)""",
+        default=5.,
+        check=lambda x: x > 0.
+    )
+
+    minCellSizeY = pexConfig.Field(
+        dtype=float,
+        doc="""Minimum dimension of adaptively refined grid cells in y direction
+               (used if doAdaptiveGrid is True)""",
+        default=5.,
+        check=lambda x: x > 0.
+    )
+
     returnSubImages = pexConfig.Field(
         dtype=bool,
         doc="""Return the input subExposures alongside the processed ones (for debugging)""",
@@ -657,6 +695,9 @@ class ImageMapReduceTask(pipeBase.Task):
         adjustGridOption = self.config.adjustGridOption
         scaleByFwhm = self.config.scaleByFwhm
 
+        if self.config.doAdaptiveGrid and (cellCentroidsX is None or len(cellCentroidsX) <= 0):
+            return self._generateAdaptiveGrid(exposure, forceEvenSized=forceEvenSized, **kwargs)
+
         if cellCentroidsX is None or len(cellCentroidsX) <= 0:
             # Not given centroids; construct them from cellSize/gridStep
 
@@ -715,26 +756,6 @@ class ImageMapReduceTask(pipeBase.Task):
         self.boxes0 = []  # "main" boxes; store in task so can be extracted if needed
         self.boxes1 = []  # "expanded" boxes
 
-        def _makeBoxEvenSized(bb):
-            """Force a bounding-box to have dimensions that are modulo 2."""
-
-            if bb.getWidth() % 2 == 1:  # grow to the right
-                bb.include(geom.Point2I(bb.getMaxX()+1, bb.getMaxY()))  # Expand by 1 pixel!
-                bb.clip(bbox)
-                if bb.getWidth() % 2 == 1:  # clipped at right -- so grow to the left
-                    bb.include(geom.Point2I(bb.getMinX()-1, bb.getMaxY()))
-                    bb.clip(bbox)
-            if bb.getHeight() % 2 == 1:  # grow upwards
-                bb.include(geom.Point2I(bb.getMaxX(), bb.getMaxY()+1))  # Expand by 1 pixel!
-                bb.clip(bbox)
-                if bb.getHeight() % 2 == 1:  # clipped upwards -- so grow down
-                    bb.include(geom.Point2I(bb.getMaxX(), bb.getMinY()-1))
-                    bb.clip(bbox)
-            if bb.getWidth() % 2 == 1 or bb.getHeight() % 2 == 1:  # Box is probably too big
-                raise RuntimeError('Cannot make bounding box even-sized. Probably too big.')
-
-            return bb
-
         # Use given or grid-parameterized centroids as centers for bounding boxes
         if cellCentroids is not None and len(cellCentroids) > 0:
             for x, y in cellCentroids:
@@ -745,12 +766,12 @@ class ImageMapReduceTask(pipeBase.Task):
                 bb0.shift(geom.Extent2I(xoff, yoff))
                 bb0.clip(bbox)
                 if forceEvenSized:
-                    bb0 = _makeBoxEvenSized(bb0)
+                    bb0 = self._makeBoxEvenSized(bb0, bbox)
                 bb1 = geom.Box2I(bbox1)
                 bb1.shift(geom.Extent2I(xoff, yoff))
                 bb1.clip(bbox)
                 if forceEvenSized:
-                    bb1 = _makeBoxEvenSized(bb1)
+                    bb1 = self._makeBoxEvenSized(bb1, bbox)
 
                 if bb0.getArea() > 1 and bb1.getArea() > 1:
                     self.boxes0.append(bb0)
@@ -758,6 +779,155 @@ class ImageMapReduceTask(pipeBase.Task):
 
         return self.boxes0, self.boxes1
 
+    def _generateAdaptiveGrid(self, exposure, forceEvenSized=False, psfMatchingKernel=None, **kwargs):
+        """Generate two lists of bounding boxes that tile `exposure`, refined where the PSF varies
+
+        The exposure is tiled with the fewest equal-sized cells no
+        larger than cellSizeX by cellSizeY. The PSF (or
+        `psfMatchingKernel`, if given) is evaluated at the center and
+        corners of each cell, and a cell is split in half along each of
+        its axes that is at least twice the minimum cell size whenever
+        the sum of absolute differences between the normalized PSF
+        image at its center and at any of its corners exceeds
+        `adaptiveTolerance`. Splitting continues recursively; the PSF
+        samples at shared corners are reused between neighboring cells.
+        The expanded bounding boxes are the resulting cells grown by
+        borderSizeX/Y. The lists are set to `self.boxes0`, `self.boxes1`.
+
+        Parameters
+        ----------
+        exposure : `lsst.afw.image.Exposure`
+            input exposure whose full bounding box is to be gridded.
+        forceEvenSized : `bool`
+            force grid elements to have even-valued x- and y- dimensions?
+        psfMatchingKernel : `lsst.afw.math.Kernel`, optional
+            kernel whose spatial variation drives the grid refinement,
+            instead of that of the exposure PSF.
+        """
+        bbox = exposure.getBBox()
+        psf = exposure.getPsf()
+        psfFwhm = psf.computeShape().getDeterminantRadius()*2.*np.sqrt(2.*np.log(2.))
+        if self.config.scaleByFwhm:
+            self.log.info("Scaling grid parameters by %f" % psfFwhm)
+
+        def rescaleValue(val):
+            if self.config.scaleByFwhm:
+                return max(1, np.rint(val*psfFwhm).astype(int))
+            else:
+                return max(1, np.rint(val).astype(int))
+
+        maxSizeX = rescaleValue(self.config.cellSizeX)
+        maxSizeY = rescaleValue(self.config.cellSizeY)
+        minSizeX = min(rescaleValue(self.config.minCellSizeX), maxSizeX)
+        minSizeY = min(rescaleValue(self.config.minCellSizeY), maxSizeY)
+        borderSizeX = rescaleValue(self.config.borderSizeX)
+        borderSizeY = rescaleValue(self.config.borderSizeY)
+
+        samples = {}
+
+        def sample(x, y):
+            """Return the normalized PSF or kernel image at (x, y)."""
+            if (x, y) not in samples:
+                if psfMatchingKernel is not None:
+                    img = afwImage.ImageD(psfMatchingKernel.getDimensions())
+                    psfMatchingKernel.computeImage(img, True, x, y)
+                    arr = img.getArray()
+                else:
+                    arr = psf.computeKernelImage(geom.Point2D(x, y)).getArray()
+                samples[(x, y)] = arr/np.sum(arr)
+            return samples[(x, y)]
+
+        def variation(box):
+            """Maximum difference between the PSF at the center and the corners of `box`."""
+            center = geom.Box2D(box).getCenter()
+            ref = sample(center.getX(), center.getY())
+            maxDiff = 0.
+            for x in (box.getMinX(), box.getMaxX()):
+                for y in (box.getMinY(), box.getMaxY()):
+                    corner = sample(float(x), float(y))
+                    if corner.shape != ref.shape:
+                        return np.inf
+                    maxDiff = max(maxDiff, np.sum(np.abs(corner - ref)))
+            return maxDiff
+
+        def split(box):
+            splitX = box.getWidth() >= 2*minSizeX
+            splitY = box.getHeight() >= 2*minSizeY
+            if not (splitX or splitY) or variation(box) <= self.config.adaptiveTolerance:
+                return [box]
+            xEdges = [box.getMinX(), box.getEndX()]
+            yEdges = [box.getMinY(), box.getEndY()]
+            if splitX:
+                xEdges.insert(1, box.getMinX() + box.getWidth()//2)
+            if splitY:
+                yEdges.insert(1, box.getMinY() + box.getHeight()//2)
+            cells = []
+            for y0, y1 in zip(yEdges[:-1], yEdges[1:]):
+                for x0, x1 in zip(xEdges[:-1], xEdges[1:]):
+                    cells.extend(split(geom.Box2I(geom.Point2I(x0, y0), geom.Point2I(x1 - 1, y1 - 1))))
+            return cells
+
+        nX = int(np.ceil(bbox.getWidth()/maxSizeX))
+        nY = int(np.ceil(bbox.getHeight()/maxSizeY))
+        xEdges = np.rint(np.linspace(bbox.getMinX(), bbox.getEndX(), nX + 1)).astype(int)
+        yEdges = np.rint(np.linspace(bbox.getMinY(), bbox.getEndY(), nY + 1)).astype(int)
+        cells = []
+        for y0, y1 in zip(yEdges[:-1], yEdges[1:]):
+            for x0, x1 in zip(xEdges[:-1], xEdges[1:]):
+                cells.extend(split(geom.Box2I(geom.Point2I(int(x0), int(y0)),
+                                              geom.Point2I(int(x1) - 1, int(y1) - 1))))
+
+        self.boxes0 = []
+        self.boxes1 = []
+        for bb0 in cells:
+            if forceEvenSized:
+                bb0 = self._makeBoxEvenSized(bb0, bbox)
+            bb1 = geom.Box2I(bb0)
+            bb1.grow(geom.Extent2I(borderSizeX, borderSizeY))
+            bb1.clip(bbox)
+            if forceEvenSized:
+                bb1 = self._makeBoxEvenSized(bb1, bbox)
+            if bb0.getArea() > 1 and bb1.getArea() > 1:
+                self.boxes0.append(bb0)
+                self.boxes1.append(bb1)
+
+        self.log.info("Adaptive grid: %d cells from %d PSF evaluations", len(self.boxes0), len(samples))
+        self.metadata.set("numGridCells", len(self.boxes0))
+        return self.boxes0, self.boxes1
+
+    @staticmethod
+    def _makeBoxEvenSized(bb, bbox):
+        """Force a bounding-box to have dimensions that are modulo 2.
+
+        Parameters
+        ----------
+        bb : `lsst.geom.Box2I`
+            the bounding box to adjust (in place)
+        bbox : `lsst.geom.Box2I`
+            the bounding box of the full exposure, to which `bb` is clipped
+
+        Returns
+        -------
+        bb : `lsst.geom.Box2I`
+            the adjusted bounding box
+        """
+        if bb.getWidth() % 2 == 1:  # grow to the right
+            bb.include(geom.Point2I(bb.getMaxX()+1, bb.getMaxY()))  # Expand by 1 pixel!
+            bb.clip(bbox)
+            if bb.getWidth() % 2 == 1:  # clipped at right -- so grow to the left
+                bb.include(geom.Point2I(bb.getMinX()-1, bb.getMaxY()))
+                bb.clip(bbox)
+        if bb.getHeight() % 2 == 1:  # grow upwards
+            bb.include(geom.Point2I(bb.getMaxX(), bb.getMaxY()+1))  # Expand by 1 pixel!
+            bb.clip(bbox)
+            if bb.getHeight() % 2 == 1:  # clipped upwards -- so grow down
+                bb.include(geom.Point2I(bb.getMaxX(), bb.getMinY()-1))
+                bb.clip(bbox)
+        if bb.getWidth() % 2 == 1 or bb.getHeight() % 2 == 1:  # Box is probably too big
+            raise RuntimeError('Cannot make bounding box even-sized. Probably too big.')
+
+        return bb
+
     def plotBoxes(self, fullBBox, skip=3):
         """Plot both grids of boxes using matplotlib.
 
@@ -0,0 +1,73 @@
+/*
+ * LSST Data Management System
+ *
+ * This product includes software developed by the
+ * LSST Project (http://www.lsst.org/).
+ * See the COPYRIGHT file
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the LSST License Statement and
+ * the GNU General Public License along with this program.  If not,
+ * see <https://www.lsstcorp.org/LegalNotices/>.
+ */
+#include "pybind11/pybind11.h"
+
+#include <memory>
+
+#include "lsst/ip/diffim/PsfImageCache.h"
+
+namespace py = pybind11;
+using namespace pybind11::literals;
+
+namespace lsst {
+namespace ip {
+namespace diffim {
+
+namespace {
+
+void declarePsfImageCache(py::module& mod) {
+    py::class_<PsfImageCache> cls(mod, "PsfImageCache");
+
+    cls.def(py::init<std::size_t, int>(), "maxSize"_a = 1024, "subpixelGrid"_a = 100);
+
+    cls.def_static("getInstance", &PsfImageCache::getInstance, py::return_value_policy::reference);
+    cls.def("computeImage",
+            [](PsfImageCache& self, std::shared_ptr<afw::detection::Psf> psf, geom::Point2D const& position) {
+                return self.computeImage(psf, position);
+            },
+            "psf"_a, "position"_a);
+    cls.def("clear", &PsfImageCache::clear);
+    cls.def("size", &PsfImageCache::size);
+    cls.def("__len__", &PsfImageCache::size);
+    cls.def("getMaxSize", &PsfImageCache::getMaxSize);
+    cls.def("setMaxSize", &PsfImageCache::setMaxSize, "maxSize"_a);
+    cls.def("getSubpixelGrid", &PsfImageCache::getSubpixelGrid);
+    cls.def("setSubpixelGrid", &PsfImageCache::setSubpixelGrid, "subpixelGrid"_a);
+    cls.def("getHits", &PsfImageCache::getHits);
+    cls.def("getMisses", &PsfImageCache::getMisses);
+    cls.def("getEvictions", &PsfImageCache::getEvictions);
+    cls.def("resetStatistics", &PsfImageCache::resetStatistics);
+}
+
+}  // namespace lsst::ip::diffim::<anonymous>
+
+PYBIND11_MODULE(psfImageCache, mod) {
+    py::module::import("lsst.geom");
+    py::module::import("lsst.afw.detection");
+    py::module::import("lsst.afw.image");
+
+    declarePsfImageCache(mod);
+}
+
+}  // diffim
+}  // ip
+}  // lsst
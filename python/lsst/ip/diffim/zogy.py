@@ -34,6 +34,7 @@ from .imageMapReduce import (ImageMapReduceConfig, ImageMapper,
                              ImageMapReduceTask)
 from .imagePsfMatch import (ImagePsfMatchTask, ImagePsfMatchConfig,
                             subtractAlgorithmRegistry)
+from .clippedStatistics import ClippedStatisticsConfig, computeClippedStatistics, getClippedStatisticsCache
 
 __all__ = ["ZogyTask", "ZogyConfig",
            "ZogyMapper", "ZogyMapReduceConfig",
@@ -125,6 +126,11 @@ class ZogyConfig(pexConfig.Config):
         doc="Mask planes to ignore for statistics"
     )
 
+    statistics = pexConfig.ConfigField(
+        dtype=ClippedStatisticsConfig,
+        doc="Estimator for the sigma-clipped image means and variances"
+    )
+
 
 MIN_KERNEL = 1.0e-4
 
@@ -288,11 +294,11 @@ class ZogyTask(pipeBase.Task):
             def _subtractImageMean(exposure):
                 """Compute the sigma-clipped mean of the image of `exposure`."""
                 mi = exposure.getMaskedImage()
-                statObj = afwMath.makeStatistics(mi.getImage(), mi.getMask(),
-                                                 afwMath.MEANCLIP, self.statsControl)
-                mean = statObj.getValue(afwMath.MEANCLIP)
+                mean = computeClippedStatistics(mi.getImage(), mi.getMask(), self.config.ignoreMaskPlanes,
+                                                self.config.statistics, owner=exposure).mean
                 if not np.isnan(mean):
                     mi -= mean
+                    getClippedStatisticsCache().invalidate(exposure)
 
             _subtractImageMean(self.template)
             _subtractImageMean(self.science)
@@ -323,11 +329,9 @@ class ZogyTask(pipeBase.Task):
     def _computeVarianceMean(self, exposure):
         """Compute the sigma-clipped mean of the variance image of `exposure`.
         """
-        statObj = afwMath.makeStatistics(exposure.getMaskedImage().getVariance(),
-                                         exposure.getMaskedImage().getMask(),
-                                         afwMath.MEANCLIP, self.statsControl)
-        var = statObj.getValue(afwMath.MEANCLIP)
-        return var
+        mi = exposure.getMaskedImage()
+        return computeClippedStatistics(mi.getVariance(), mi.getMask(), self.config.ignoreMaskPlanes,
+                                        self.config.statistics, owner=exposure).mean
 
     @staticmethod
     def _padPsfToSize(psf, size):
@@ -1110,17 +1114,11 @@ class ZogyImagePsfMatchTask(ImagePsfMatchTask):
     def _computeImageMean(self, exposure):
         """Compute the sigma-clipped mean of the pixels image of `exposure`.
         """
-        statsControl = afwMath.StatisticsControl()
-        statsControl.setNumSigmaClip(3.)
-        statsControl.setNumIter(3)
         ignoreMaskPlanes = ("INTRP", "EDGE", "DETECTED", "SAT", "CR", "BAD", "NO_DATA", "DETECTED_NEGATIVE")
-        statsControl.setAndMask(afwImage.Mask.getPlaneBitMask(ignoreMaskPlanes))
-        statObj = afwMath.makeStatistics(exposure.getMaskedImage().getImage(),
-                                         exposure.getMaskedImage().getMask(),
-                                         afwMath.MEANCLIP | afwMath.MEDIAN, statsControl)
-        mn = statObj.getValue(afwMath.MEANCLIP)
-        med = statObj.getValue(afwMath.MEDIAN)
-        return mn, med
+        mi = exposure.getMaskedImage()
+        stats = computeClippedStatistics(mi.getImage(), mi.getMask(), ignoreMaskPlanes,
+                                         self.config.zogyConfig.statistics, owner=exposure)
+        return stats.mean, stats.median
 
     def subtractExposures(self, templateExposure, scienceExposure,
                           doWarping=True, spatiallyVarying=True, inImageSpace=False,
@@ -1164,9 +1162,11 @@ class ZogyImagePsfMatchTask(ImagePsfMatchTask):
         if not np.isnan(mn1[0]) and np.abs(mn1[0]) > 1:
             mi = templateExposure.getMaskedImage()
             mi -= mn1[0]
+            getClippedStatisticsCache().invalidate(templateExposure)
         if not np.isnan(mn2[0]) and np.abs(mn2[0]) > 1:
             mi = scienceExposure.getMaskedImage()
             mi -= mn2[0]
+            getClippedStatisticsCache().invalidate(scienceExposure)
 
         self.log.info('Running Zogy algorithm: spatiallyVarying=%r' % spatiallyVarying)
 
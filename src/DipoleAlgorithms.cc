@@ -28,6 +28,11 @@
 #include <functional>   // std::binary_function
 #include <limits>       // std::numeric_limits
 #include <cmath>        // std::sqrt
+#include <atomic>       // std::atomic
+#include <exception>    // std::exception_ptr
+#include <thread>       // std::thread
+#include <vector>       // std::vector
+#include <string>       // std::string
 
 #if !defined(DOXYGEN)
 #   include "Minuit2/FCNBase.h"
@@ -45,6 +50,7 @@
 #include "lsst/afw/math.h"
 #include "lsst/geom.h"
 #include "lsst/ip/diffim/DipoleAlgorithms.h"
+#include "lsst/ip/diffim/PsfImageCache.h"
 #include "ndarray/eigen.h"
 
 namespace pexExceptions = lsst::pex::exceptions;
@@ -290,21 +296,308 @@ void NaiveDipoleFlux::fail(afw::table::SourceRecord & measRecord, meas::base::Me
 }
 
 
+namespace {
+
+/*
+ * Add flux times the part of a Psf image that overlaps bbox into model, a row-major buffer covering bbox
+ */
+void addPsfImage(std::vector<double> & model, geom::Box2I const & bbox,
+                 afwDet::Psf::Image const & psfImage, double flux) {
+    geom::Box2I overlap(psfImage.getBBox());
+    overlap.clip(bbox);
+    if (overlap.isEmpty()) {
+        return;
+    }
+    auto const psfArray = psfImage.getArray();
+    int const width = bbox.getWidth();
+    for (int y = overlap.getMinY(); y <= overlap.getMaxY(); ++y) {
+        double * out = model.data() + (y - bbox.getMinY())*width;
+        auto const psfRow = psfArray[y - psfImage.getY0()];
+        for (int x = overlap.getMinX(); x <= overlap.getMaxX(); ++x) {
+            out[x - bbox.getMinX()] += flux*psfRow[x - psfImage.getX0()];
+        }
+    }
+}
+
+/*
+ * Add flux times a Psf image computed at a nearby position, shifted by (dx, dy) to first order using
+ * the finite-difference gradient of the image (central differences, one-sided at the edges).
+ * Used for the Psf images of the PsfImageCache, which are computed on a sub-pixel grid: the shift
+ * keeps the model differentiable in the centroids between the grid positions.
+ */
+void addShiftedPsfImage(std::vector<double> & model, geom::Box2I const & bbox,
+                        afwDet::Psf::Image const & psfImage, double flux, double dx, double dy) {
+    geom::Box2I overlap(psfImage.getBBox());
+    overlap.clip(bbox);
+    if (overlap.isEmpty()) {
+        return;
+    }
+    auto const psfArray = psfImage.getArray();
+    int const psfWidth = psfImage.getWidth();
+    int const psfHeight = psfImage.getHeight();
+    int const width = bbox.getWidth();
+    auto gradient = [](double prev, double value, double next, int i, int n) {
+        if (n < 2) {
+            return 0.0;
+        } else if (i == 0) {
+            return next - value;
+        } else if (i == n - 1) {
+            return value - prev;
+        }
+        return 0.5*(next - prev);
+    };
+    for (int y = overlap.getMinY(); y <= overlap.getMaxY(); ++y) {
+        double * out = model.data() + (y - bbox.getMinY())*width;
+        int const iy = y - psfImage.getY0();
+        for (int x = overlap.getMinX(); x <= overlap.getMaxX(); ++x) {
+            int const ix = x - psfImage.getX0();
+            double const value = psfArray[iy][ix];
+            double const gx = gradient(ix > 0 ? psfArray[iy][ix - 1] : value, value,
+                                       ix < psfWidth - 1 ? psfArray[iy][ix + 1] : value, ix, psfWidth);
+            double const gy = gradient(iy > 0 ? psfArray[iy - 1][ix] : value, value,
+                                       iy < psfHeight - 1 ? psfArray[iy + 1][ix] : value, iy, psfHeight);
+            out[x - bbox.getMinX()] += flux*(value - dx*gx - dy*gy);
+        }
+    }
+}
+
+/*
+ * Psf images computed at oversampling x oversampling sub-pixel offsets from the pixel containing a
+ * reference position, stored on a common frame.  The Psf at any nearby position is the bilinear
+ * interpolation between the offsets bracketing its fractional part, shifted by its integer part.
+ */
+class PsfStamp {
+public:
+    PsfStamp() : _oversampling(0), _xref(0), _yref(0), _x0(0), _y0(0), _width(0), _height(0) {}
+
+    PsfStamp(afwDet::Psf const & psf, geom::Point2D const & center, int oversampling) :
+        _oversampling(oversampling),
+        _xref(std::floor(center.getX())),
+        _yref(std::floor(center.getY()))
+    {
+        int const s = _oversampling;
+        std::vector<std::shared_ptr<afwDet::Psf::Image>> images;
+        geom::Box2I frame;
+        for (int j = 0; j < s; ++j) {
+            for (int i = 0; i < s; ++i) {
+                images.push_back(psf.computeImage(geom::Point2D(_xref + static_cast<double>(i)/s,
+                                                                _yref + static_cast<double>(j)/s)));
+                frame.include(images.back()->getBBox());
+            }
+        }
+        // Leave room for the stamps shifted by one pixel below
+        frame.include(geom::Point2I(frame.getMaxX() + 1, frame.getMaxY() + 1));
+        _x0 = frame.getMinX();
+        _y0 = frame.getMinY();
+        _width = frame.getWidth();
+        _height = frame.getHeight();
+
+        _planes.assign((s + 1)*(s + 1)*_width*_height, 0.0);
+        for (int j = 0; j < s; ++j) {
+            for (int i = 0; i < s; ++i) {
+                afwDet::Psf::Image const & image = *images[j*s + i];
+                auto const array = image.getArray();
+                double * out = _plane(j, i);
+                for (int y = 0; y < image.getHeight(); ++y) {
+                    int const row = (y + image.getY0() - _y0)*_width + image.getX0() - _x0;
+                    for (int x = 0; x < image.getWidth(); ++x) {
+                        out[row + x] = array[y][x];
+                    }
+                }
+            }
+        }
+        // An offset of one full pixel is the zero offset shifted by one pixel
+        for (int j = 0; j < s; ++j) {
+            double const * in = _plane(j, 0);
+            double * out = _plane(j, s);
+            for (int y = 0; y < _height; ++y) {
+                std::copy(in + y*_width, in + (y + 1)*_width - 1, out + y*_width + 1);
+            }
+        }
+        for (int i = 0; i <= s; ++i) {
+            double const * in = _plane(0, i);
+            std::copy(in, in + (_height - 1)*_width, _plane(s, i) + _width);
+        }
+    }
+
+    /*
+     * Add flux times the Psf centered at (xcen, ycen) into model, a row-major buffer covering bbox
+     */
+    void addTo(std::vector<double> & model, geom::Box2I const & bbox,
+               double xcen, double ycen, double flux) const {
+        int const s = _oversampling;
+        double const ux = (xcen - _xref)*s;
+        double const uy = (ycen - _yref)*s;
+        int const fx = static_cast<int>(std::floor(ux));
+        int const fy = static_cast<int>(std::floor(uy));
+        double const tx = ux - fx;
+        double const ty = uy - fy;
+        int const ix = ((fx % s) + s) % s;
+        int const iy = ((fy % s) + s) % s;
+        int const x0 = _x0 + (fx - ix)/s;
+        int const y0 = _y0 + (fy - iy)/s;
+
+        double const * p00 = _plane(iy, ix);
+        double const * p01 = _plane(iy, ix + 1);
+        double const * p10 = _plane(iy + 1, ix);
+        double const * p11 = _plane(iy + 1, ix + 1);
+        double const w00 = flux*(1.0 - tx)*(1.0 - ty);
+        double const w01 = flux*tx*(1.0 - ty);
+        double const w10 = flux*(1.0 - tx)*ty;
+        double const w11 = flux*tx*ty;
+
+        int const xa = std::max(x0, bbox.getMinX());
+        int const xb = std::min(x0 + _width - 1, bbox.getMaxX());
+        int const ya = std::max(y0, bbox.getMinY());
+        int const yb = std::min(y0 + _height - 1, bbox.getMaxY());
+        int const width = bbox.getWidth();
+        for (int y = ya; y <= yb; ++y) {
+            double * out = model.data() + (y - bbox.getMinY())*width;
+            int const row = (y - y0)*_width - x0;
+            for (int x = xa; x <= xb; ++x) {
+                int const k = row + x;
+                out[x - bbox.getMinX()] += w00*p00[k] + w01*p01[k] + w10*p10[k] + w11*p11[k];
+            }
+        }
+    }
+
+private:
+    double * _plane(int j, int i) { return &_planes[(j*(_oversampling + 1) + i)*_width*_height]; }
+    double const * _plane(int j, int i) const {
+        return &_planes[(j*(_oversampling + 1) + i)*_width*_height];
+    }
+
+    int _oversampling;
+    double _xref, _yref;
+    int _x0, _y0, _width, _height;
+    std::vector<double> _planes;
+};
+
+/*
+ * Return the OR of the bits of the named mask planes, ignoring planes that are not defined
+ */
+afwImage::MaskPixel getBadMaskBits(std::vector<std::string> const & maskPlanes) {
+    afwImage::MaskPixel bits = 0;
+    for (auto const & name : maskPlanes) {
+        try {
+            bits |= afwImage::Mask<afwImage::MaskPixel>::getPlaneBitMask(name);
+        } catch (pexExceptions::InvalidParameterError &) {
+            // not a mask plane of this process; no pixel can have it set
+        }
+    }
+    return bits;
+}
+
+/*
+ * Buffers used to evaluate the chi^2 of the dipole model of one source.  These are set up once per
+ * source, so that the evaluations by the minimizer do not allocate any images.
+ *
+ * The data are stored as a compressed vector of the pixels of the footprint which have a finite
+ * value and variance and none of the badMaskBits set; only these pixels enter the chi^2.
+ */
+class PsfDipoleChi2Workspace {
+public:
+    PsfDipoleChi2Workspace(afwDet::Footprint const & footprint,
+                           afwImage::Exposure<float> const & exposure,
+                           std::shared_ptr<afwDet::Psf const> psf,
+                           geom::Point2D const & negCenter,
+                           geom::Point2D const & posCenter,
+                           int psfOversampling,
+                           bool usePsfImageCache=false,
+                           afwImage::MaskPixel badMaskBits=0) :
+        _bbox(footprint.getBBox()),
+        _psf(psf),
+        _psfOversampling(psfOversampling),
+        _usePsfImageCache(usePsfImageCache),
+        _model(_bbox.getArea())
+    {
+        afwImage::MaskedImage<float> const subImage(exposure.getMaskedImage(), _bbox);
+        auto const image = subImage.getImage()->getArray();
+        auto const mask = subImage.getMask()->getArray();
+        auto const variance = subImage.getVariance()->getArray();
+        int const width = _bbox.getWidth();
+        for (auto const & span : *footprint.getSpans()) {
+            int const y = span.getY() - _bbox.getMinY();
+            for (int x = span.getMinX() - _bbox.getMinX(); x <= span.getMaxX() - _bbox.getMinX(); ++x) {
+                double const value = image[y][x];
+                double const var = variance[y][x];
+                if ((mask[y][x] & badMaskBits) == 0 && std::isfinite(value) && std::isfinite(var) &&
+                    var > 0.0) {
+                    _index.push_back(y*width + x);
+                    _data.push_back(value);
+                    _inverseVariance.push_back(1.0/var);
+                }
+            }
+        }
+
+        if (_psfOversampling > 0) {
+            _negStamp = PsfStamp(*_psf, negCenter, _psfOversampling);
+            _posStamp = PsfStamp(*_psf, posCenter, _psfOversampling);
+        }
+    }
+
+    std::pair<double,int> operator()(double negCenterX, double negCenterY, double negFlux,
+                                     double posCenterX, double posCenterY, double posFlux) const {
+        /*
+         * Fit for the superposition of Psfs at the two centroids.
+         */
+        std::fill(_model.begin(), _model.end(), 0.0);
+        if (_psfOversampling > 0) {
+            _negStamp.addTo(_model, _bbox, negCenterX, negCenterY, negFlux);
+            _posStamp.addTo(_model, _bbox, posCenterX, posCenterY, posFlux);
+        } else if (_usePsfImageCache) {
+            _addCachedPsfImage(geom::Point2D(negCenterX, negCenterY), negFlux);
+            _addCachedPsfImage(geom::Point2D(posCenterX, posCenterY), posFlux);
+        } else {
+            addPsfImage(_model, _bbox, *_psf->computeImage(geom::Point2D(negCenterX, negCenterY)), negFlux);
+            addPsfImage(_model, _bbox, *_psf->computeImage(geom::Point2D(posCenterX, posCenterY)), posFlux);
+        }
+
+        // Sum [(model-data)/sigma]**2 over the good pixels of the footprint
+        double chi2 = 0.0;
+        std::size_t const nPix = _index.size();
+        for (std::size_t i = 0; i < nPix; ++i) {
+            double const resid = _model[_index[i]] - _data[i];
+            chi2 += resid*resid*_inverseVariance[i];
+        }
+        return std::pair<double,int>(chi2, static_cast<int>(nPix));
+    }
+
+private:
+    // The cached image is that of the nearest grid position; shift it by the remainder, so that the
+    // model is not piecewise-constant in the centroids and the fit can move them.
+    void _addCachedPsfImage(geom::Point2D const & position, double flux) const {
+        PsfImageCache & cache = PsfImageCache::getInstance();
+        double const grid = cache.getSubpixelGrid();
+        geom::Point2D const gridPosition(std::floor(position.getX()*grid + 0.5)/grid,
+                                         std::floor(position.getY()*grid + 0.5)/grid);
+        addShiftedPsfImage(_model, _bbox, *cache.computeImage(_psf, gridPosition), flux,
+                           position.getX() - gridPosition.getX(), position.getY() - gridPosition.getY());
+    }
+
+    geom::Box2I _bbox;
+    std::vector<int> _index;              // offsets of the good pixels in the bbox
+    std::vector<double> _data;
+    std::vector<double> _inverseVariance;
+    std::shared_ptr<afwDet::Psf const> _psf;
+    int _psfOversampling;
+    bool _usePsfImageCache;
+    PsfStamp _negStamp;
+    PsfStamp _posStamp;
+    mutable std::vector<double> _model;   // evaluations only modify this scratch buffer
+};
+
 /**
  * Class to minimize PsfDipoleFlux; this is the object that Minuit minimizes
  */
 class MinimizeDipoleChi2 : public ROOT::Minuit2::FCNBase {
 public:
-    explicit MinimizeDipoleChi2(PsfDipoleFlux const& psfDipoleFlux,
-                                afw::table::SourceRecord & source,
-                                afw::image::Exposure<float> const& exposure
+    explicit MinimizeDipoleChi2(PsfDipoleChi2Workspace const& workspace
                                 ) : _errorDef(1.0),
                                     _nPar(6),
                                     _maxPix(1e4),
                                     _bigChi2(1e10),
-                                    _psfDipoleFlux(psfDipoleFlux),
-                                    _source(source),
-                                    _exposure(exposure)
+                                    _workspace(workspace)
     {}
     double Up() const { return _errorDef; }
     void setErrorDef(double def) { _errorDef = def; }
@@ -326,8 +619,8 @@ public:
             return _bigChi2;
         }
 
-        std::pair<double,int> fit = _psfDipoleFlux.chi2(_source, _exposure, negCenterX, negCenterY, negFlux,
-                                                        posCenterX, posCenterY, posFlux);
+        std::pair<double,int> fit = _workspace(negCenterX, negCenterY, negFlux,
+                                               posCenterX, posCenterY, posFlux);
         double chi2 = fit.first;
         int nPix = fit.second;
         if (nPix > _maxPix) {
@@ -344,82 +637,36 @@ private:
                             // prevents too much centroid wander
     double _bigChi2;        // large value to tell fitter when it has gone into bad region of parameter space
 
-    PsfDipoleFlux const& _psfDipoleFlux;
-    afw::table::SourceRecord & _source;
-    afw::image::Exposure<float> const& _exposure;
+    PsfDipoleChi2Workspace const& _workspace;
 };
 
-std::pair<double,int> PsfDipoleFlux::chi2(
-    afw::table::SourceRecord & source,
-    afw::image::Exposure<float> const& exposure,
-    double negCenterX, double negCenterY, double negFlux,
-    double posCenterX, double posCenterY, double posFlux
-) const {
-
-    geom::Point2D negCenter(negCenterX, negCenterY);
-    geom::Point2D posCenter(posCenterX, posCenterY);
-
-    CONST_PTR(afw::detection::Footprint) footprint = source.getFootprint();
+} // end anonymous namespace
 
-    /*
-     * Fit for the superposition of Psfs at the two centroids.
-     */
-    CONST_PTR(afwDet::Psf) psf = exposure.getPsf();
-    PTR(afwImage::Image<afwMath::Kernel::Pixel>) negPsf = psf->computeImage(negCenter);
-    PTR(afwImage::Image<afwMath::Kernel::Pixel>) posPsf = psf->computeImage(posCenter);
-
-    afwImage::Image<double> negModel(footprint->getBBox());
-    afwImage::Image<double> posModel(footprint->getBBox());
-    afwImage::Image<float> data(*(exposure.getMaskedImage().getImage()),footprint->getBBox());
-    afwImage::Image<afwImage::VariancePixel> var(*(exposure.getMaskedImage().getVariance()),
-                                                 footprint->getBBox());
-
-    geom::Box2I negPsfBBox = negPsf->getBBox();
-    geom::Box2I posPsfBBox = posPsf->getBBox();
-    geom::Box2I negModelBBox = negModel.getBBox();
-    geom::Box2I posModelBBox = posModel.getBBox();
-
-    // Portion of the negative Psf that overlaps the model
-    int negXmin = std::max(negPsfBBox.getMinX(), negModelBBox.getMinX());
-    int negYmin = std::max(negPsfBBox.getMinY(), negModelBBox.getMinY());
-    int negXmax = std::min(negPsfBBox.getMaxX(), negModelBBox.getMaxX());
-    int negYmax = std::min(negPsfBBox.getMaxY(), negModelBBox.getMaxY());
-    geom::Box2I negBBox = geom::Box2I(geom::Point2I(negXmin, negYmin),
-                                      geom::Point2I(negXmax, negYmax));
-    afwImage::Image<afwMath::Kernel::Pixel> negSubim(*negPsf, negBBox);
-    afwImage::Image<double> negModelSubim(negModel, negBBox);
-    negModelSubim += negSubim;
-
-    // Portion of the positive Psf that overlaps the model
-    int posXmin = std::max(posPsfBBox.getMinX(), posModelBBox.getMinX());
-    int posYmin = std::max(posPsfBBox.getMinY(), posModelBBox.getMinY());
-    int posXmax = std::min(posPsfBBox.getMaxX(), posModelBBox.getMaxX());
-    int posYmax = std::min(posPsfBBox.getMaxY(), posModelBBox.getMaxY());
-    geom::Box2I posBBox = geom::Box2I(geom::Point2I(posXmin, posYmin),
-                                      geom::Point2I(posXmax, posYmax));
-    afwImage::Image<afwMath::Kernel::Pixel> posSubim(*posPsf, posBBox);
-    afwImage::Image<double> posModelSubim(posModel, posBBox);
-    posModelSubim += posSubim;
-
-    negModel  *= negFlux;   // scale negative model to image
-    posModel  *= posFlux;   // scale positive model to image
-    afwImage::Image<double> residuals(negModel, true); // full model contains negative lobe...
-    residuals += posModel;  // plus positive lobe...
-    residuals -= data;      // minus the data...
-    residuals *= residuals; // squared...
-    residuals /= var;       // divided by the variance : [(model-data)/sigma]**2
-    afwMath::Statistics stats = afwMath::makeStatistics(residuals, afwMath::SUM | afwMath::NPOINT);
-    double chi2 = stats.getValue(afwMath::SUM);
-    int nPix = stats.getValue(afwMath::NPOINT);
-    return std::pair<double,int>(chi2, nPix);
-}
+/*
+ * Result of the fit of one source, computed by fitPsfDipole and written by PsfDipoleFlux::_recordFit
+ */
+struct PsfDipoleFlux::FitResult {
+    FitResult() : isFitted(false) {}
+
+    bool isFitted;          // false if there was nothing to fit (a single peak)
+    double negCenterX, negCenterY, negFlux, negFluxErr;
+    double posCenterX, posCenterY, posFlux, posFluxErr;
+    double chi2;
+    int nPix;
+    int nPar;
+};
 
-void PsfDipoleFlux::measure(
-    afw::table::SourceRecord & source,
-    afw::image::Exposure<float> const & exposure
-) const {
+namespace {
 
-    typedef afw::image::Exposure<float>::MaskedImageT MaskedImageT;
+/*
+ * Fit the dipole model to a source.  This only reads the source, so may be called concurrently
+ * for different sources, as long as each thread uses its own Psf.
+ */
+PsfDipoleFlux::FitResult fitPsfDipole(PsfDipoleFluxControl const & ctrl,
+                                      afw::table::SourceRecord const & source,
+                                      afw::image::Exposure<float> const & exposure,
+                                      std::shared_ptr<afwDet::Psf const> psf) {
+    PsfDipoleFlux::FitResult result;
 
     CONST_PTR(afw::detection::Footprint) footprint = source.getFootprint();
     if (!footprint) {
@@ -435,7 +682,7 @@ void PsfDipoleFlux::measure(
     }
     else if (peakCatalog.size() == 1) {
         // No deblending to do
-        return;
+        return result;
     }
 
     // For N>=2, just measure the brightest-positive and brightest-negative
@@ -447,17 +694,24 @@ void PsfDipoleFlux::measure(
     // Set up fit parameters and param names
     ROOT::Minuit2::MnUserParameters fitPar;
 
-    fitPar.Add((boost::format("P%d")%NEGCENTXPAR).str(), negativePeak.getFx(), _ctrl.stepSizeCoord);
-    fitPar.Add((boost::format("P%d")%NEGCENTYPAR).str(), negativePeak.getFy(), _ctrl.stepSizeCoord);
-    fitPar.Add((boost::format("P%d")%NEGFLUXPAR).str(), negativePeak.getPeakValue(), _ctrl.stepSizeFlux);
-    fitPar.Add((boost::format("P%d")%POSCENTXPAR).str(), positivePeak.getFx(), _ctrl.stepSizeCoord);
-    fitPar.Add((boost::format("P%d")%POSCENTYPAR).str(), positivePeak.getFy(), _ctrl.stepSizeCoord);
-    fitPar.Add((boost::format("P%d")%POSFLUXPAR).str(), positivePeak.getPeakValue(), _ctrl.stepSizeFlux);
+    fitPar.Add((boost::format("P%d")%NEGCENTXPAR).str(), negativePeak.getFx(), ctrl.stepSizeCoord);
+    fitPar.Add((boost::format("P%d")%NEGCENTYPAR).str(), negativePeak.getFy(), ctrl.stepSizeCoord);
+    fitPar.Add((boost::format("P%d")%NEGFLUXPAR).str(), negativePeak.getPeakValue(), ctrl.stepSizeFlux);
+    fitPar.Add((boost::format("P%d")%POSCENTXPAR).str(), positivePeak.getFx(), ctrl.stepSizeCoord);
+    fitPar.Add((boost::format("P%d")%POSCENTYPAR).str(), positivePeak.getFy(), ctrl.stepSizeCoord);
+    fitPar.Add((boost::format("P%d")%POSFLUXPAR).str(), positivePeak.getPeakValue(), ctrl.stepSizeFlux);
+
+    // Set up the buffers (and cached Psf images) reused by every evaluation of the fit
+    PsfDipoleChi2Workspace workspace(*footprint, exposure, psf,
+                                     geom::Point2D(negativePeak.getFx(), negativePeak.getFy()),
+                                     geom::Point2D(positivePeak.getFx(), positivePeak.getFy()),
+                                     ctrl.psfOversampling, ctrl.usePsfImageCache,
+                                     getBadMaskBits(ctrl.badMaskPlanes));
 
     // Create the minuit object that knows how to minimise our functor
     //
-    MinimizeDipoleChi2 minimizerFunc(*this, source, exposure);
-    minimizerFunc.setErrorDef(_ctrl.errorDef);
+    MinimizeDipoleChi2 minimizerFunc(workspace);
+    minimizerFunc.setErrorDef(ctrl.errorDef);
 
     //
     // tell minuit about it
@@ -467,49 +721,124 @@ void PsfDipoleFlux::measure(
     //
     // And let it loose
     //
-    ROOT::Minuit2::FunctionMinimum min = migrad(_ctrl.maxFnCalls);
-
-    float minChi2 = min.Fval();
-    bool const isValid = min.IsValid() && std::isfinite(minChi2);
-
-    if (true || isValid) {              // calculate coeffs even in minuit is unhappy
-
-        /* I need to call chi2 one more time to grab nPix to calculate chi2/dof.
-           Turns out that the Minuit operator method has to be const, and the
-           measurement _apply method has to be const, so I can't store nPix as a
-           private member variable anywhere.  Consted into a corner.
-        */
-        std::pair<double,int> fit = chi2(source, exposure,
-                                         min.UserState().Value(NEGCENTXPAR),
-                                         min.UserState().Value(NEGCENTYPAR),
-                                         min.UserState().Value(NEGFLUXPAR),
-                                         min.UserState().Value(POSCENTXPAR),
-                                         min.UserState().Value(POSCENTYPAR),
-                                         min.UserState().Value(POSFLUXPAR));
-        double evalChi2 = fit.first;
-        int nPix = fit.second;
+    ROOT::Minuit2::FunctionMinimum min = migrad(ctrl.maxFnCalls);
+
+    // Calculate coeffs even if minuit is unhappy (min.IsValid() is false), as before.
+    // Evaluate the chi2 one more time to grab nPix to calculate chi2/dof.
+    result.negCenterX = min.UserState().Value(NEGCENTXPAR);
+    result.negCenterY = min.UserState().Value(NEGCENTYPAR);
+    result.negFlux = min.UserState().Value(NEGFLUXPAR);
+    result.negFluxErr = min.UserState().Error(NEGFLUXPAR);
+    result.posCenterX = min.UserState().Value(POSCENTXPAR);
+    result.posCenterY = min.UserState().Value(POSCENTYPAR);
+    result.posFlux = min.UserState().Value(POSFLUXPAR);
+    result.posFluxErr = min.UserState().Error(POSFLUXPAR);
+
+    std::pair<double,int> fit = workspace(result.negCenterX, result.negCenterY, result.negFlux,
+                                          result.posCenterX, result.posCenterY, result.posFlux);
+    result.chi2 = fit.first;
+    result.nPix = fit.second;
+    result.nPar = minimizerFunc.getNpar();
+    result.isFitted = true;
+    return result;
+}
+
+} // end anonymous namespace
+
+std::pair<double,int> PsfDipoleFlux::chi2(
+    afw::table::SourceRecord & source,
+    afw::image::Exposure<float> const& exposure,
+    double negCenterX, double negCenterY, double negFlux,
+    double posCenterX, double posCenterY, double posFlux
+) const {
+    geom::Point2D negCenter(negCenterX, negCenterY);
+    geom::Point2D posCenter(posCenterX, posCenterY);
+
+    CONST_PTR(afw::detection::Footprint) footprint = source.getFootprint();
+
+    PsfDipoleChi2Workspace workspace(*footprint, exposure, exposure.getPsf(), negCenter, posCenter, 0,
+                                     false, getBadMaskBits(_ctrl.badMaskPlanes));
+    return workspace(negCenterX, negCenterY, negFlux, posCenterX, posCenterY, posFlux);
+}
 
-        PTR(geom::Point2D) minNegCentroid(new geom::Point2D(min.UserState().Value(NEGCENTXPAR),
-                                                            min.UserState().Value(NEGCENTYPAR)));
-        source.set(getNegativeKeys().getInstFlux(), min.UserState().Value(NEGFLUXPAR));
-        source.set(getNegativeKeys().getInstFluxErr(), min.UserState().Error(NEGFLUXPAR));
+void PsfDipoleFlux::measure(
+    afw::table::SourceRecord & source,
+    afw::image::Exposure<float> const & exposure
+) const {
+    FitResult const fit = fitPsfDipole(_ctrl, source, exposure, exposure.getPsf());
+    if (fit.isFitted) {
+        _recordFit(source, fit);
+    }
+}
 
-        PTR(geom::Point2D) minPosCentroid(new geom::Point2D(min.UserState().Value(POSCENTXPAR),
-                                                            min.UserState().Value(POSCENTYPAR)));
-        source.set(getPositiveKeys().getInstFlux(), min.UserState().Value(POSFLUXPAR));
-        source.set(getPositiveKeys().getInstFluxErr(), min.UserState().Error(POSFLUXPAR));
+void PsfDipoleFlux::measureAll(
+    afw::table::SourceCatalog & measCat,
+    afw::image::Exposure<float> const & exposure,
+    int numThreads
+) const {
+    std::size_t const nSources = measCat.size();
+    std::vector<FitResult> fits(nSources);
+    std::vector<std::exception_ptr> errors(nSources);
+    std::atomic<std::size_t> next(0);
+
+    auto worker = [&](std::shared_ptr<afwDet::Psf const> psf) {
+        for (std::size_t i = next++; i < nSources; i = next++) {
+            try {
+                fits[i] = fitPsfDipole(_ctrl, measCat[i], exposure, psf);
+            } catch (...) {
+                errors[i] = std::current_exception();
+            }
+        }
+    };
 
-        source.set(_chi2dofKey, evalChi2 / (nPix - minimizerFunc.getNpar()));
-        source.set(_negCentroid.getX(), minNegCentroid->getX());
-        source.set(_negCentroid.getY(), minNegCentroid->getY());
-        source.set(_posCentroid.getX(), minPosCentroid->getX());
-        source.set(_posCentroid.getY(), minPosCentroid->getY());
-        source.set(_avgCentroid.getX(), 0.5*(minNegCentroid->getX() + minPosCentroid->getX()));
-        source.set(_avgCentroid.getY(), 0.5*(minNegCentroid->getY() + minPosCentroid->getY()));
+    int const nThreads = std::max(1, std::min(numThreads, static_cast<int>(nSources)));
+    if (nThreads == 1) {
+        worker(exposure.getPsf());
+    } else {
+        // Psf models cache their images, so give each thread its own copy
+        std::vector<std::thread> threads;
+        for (int i = 0; i < nThreads; ++i) {
+            threads.emplace_back(worker, std::shared_ptr<afwDet::Psf const>(exposure.getPsf()->clone()));
+        }
+        for (auto & thread : threads) {
+            thread.join();
+        }
+    }
 
+    // Write the results (and failures) from this thread only
+    for (std::size_t i = 0; i < nSources; ++i) {
+        if (errors[i]) {
+            try {
+                std::rethrow_exception(errors[i]);
+            } catch (meas::base::MeasurementError & error) {
+                fail(measCat[i], &error);
+            } catch (std::exception &) {
+                fail(measCat[i]);
+            }
+        } else if (fits[i].isFitted) {
+            _recordFit(measCat[i], fits[i]);
+        }
     }
 }
 
+void PsfDipoleFlux::_recordFit(afw::table::SourceRecord & source, FitResult const & fit) const {
+    PTR(geom::Point2D) minNegCentroid(new geom::Point2D(fit.negCenterX, fit.negCenterY));
+    source.set(getNegativeKeys().getInstFlux(), fit.negFlux);
+    source.set(getNegativeKeys().getInstFluxErr(), fit.negFluxErr);
+
+    PTR(geom::Point2D) minPosCentroid(new geom::Point2D(fit.posCenterX, fit.posCenterY));
+    source.set(getPositiveKeys().getInstFlux(), fit.posFlux);
+    source.set(getPositiveKeys().getInstFluxErr(), fit.posFluxErr);
+
+    source.set(_chi2dofKey, fit.chi2 / (fit.nPix - fit.nPar));
+    source.set(_negCentroid.getX(), minNegCentroid->getX());
+    source.set(_negCentroid.getY(), minNegCentroid->getY());
+    source.set(_posCentroid.getX(), minPosCentroid->getX());
+    source.set(_posCentroid.getY(), minPosCentroid->getY());
+    source.set(_avgCentroid.getX(), 0.5*(minNegCentroid->getX() + minPosCentroid->getX()));
+    source.set(_avgCentroid.getY(), 0.5*(minNegCentroid->getY() + minPosCentroid->getY()));
+}
+
 void PsfDipoleFlux::fail(afw::table::SourceRecord & measRecord, meas::base::MeasurementError * error) const {
     _flagHandler.handleFailure(measRecord, error);
 }
@@ -0,0 +1,176 @@
+// -*- LSST-C++ -*-
+
+/*
+ * LSST Data Management System
+ * Copyright 2008-2015 AURA/LSST
+ *
+ * This product includes software developed by the
+ * LSST Project (http://www.lsst.org/).
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the LSST License Statement and
+ * the GNU General Public License along with this program.  If not,
+ * see <http://www.lsstcorp.org/LegalNotices/>.
+ */
+
+/**
+ * @file PsfImageCache.cc
+ *
+ * @brief Implementation of the Psf image cache
+ *
+ * @ingroup ip_diffim
+ */
+
+#include <cmath>
+#include <functional>
+
+#include "lsst/pex/exceptions.h"
+#include "lsst/ip/diffim/PsfImageCache.h"
+
+namespace afwDet = lsst::afw::detection;
+namespace geom = lsst::geom;
+namespace pexExcept = lsst::pex::exceptions;
+
+namespace lsst {
+namespace ip {
+namespace diffim {
+
+std::size_t PsfImageCache::KeyHash::operator()(Key const& key) const {
+    std::size_t seed = std::hash<afwDet::Psf const*>()(key.psf);
+    seed ^= std::hash<long long>()(key.x) + 0x9e3779b9 + (seed << 6) + (seed >> 2);
+    seed ^= std::hash<long long>()(key.y) + 0x9e3779b9 + (seed << 6) + (seed >> 2);
+    return seed;
+}
+
+PsfImageCache::PsfImageCache(std::size_t maxSize, int subpixelGrid) :
+    _maxSize(maxSize), _subpixelGrid(subpixelGrid), _hits(0), _misses(0), _evictions(0)
+{
+    if (subpixelGrid < 1) {
+        throw LSST_EXCEPT(pexExcept::InvalidParameterError, "subpixelGrid must be at least 1");
+    }
+}
+
+PsfImageCache& PsfImageCache::getInstance() {
+    static PsfImageCache instance;
+    return instance;
+}
+
+std::shared_ptr<PsfImageCache::Image> PsfImageCache::computeImage(
+    std::shared_ptr<afwDet::Psf const> const& psf,
+    geom::Point2D const& position
+) {
+    int grid;
+    Key key;
+    {
+        std::lock_guard<std::mutex> lock(_mutex);
+        grid = _subpixelGrid;
+        key = Key{psf.get(),
+                  std::llround(position.getX()*grid),
+                  std::llround(position.getY()*grid)};
+        auto iter = _entries.find(key);
+        if (iter != _entries.end()) {
+            if (iter->second.psf.lock() == psf) {
+                ++_hits;
+                _order.splice(_order.begin(), _order, iter->second.position);
+                return iter->second.image;
+            }
+            // The Psf this entry was made from has been deleted, and psf reuses its address
+            _order.erase(iter->second.position);
+            _entries.erase(iter);
+        }
+        ++_misses;
+    }
+
+    // Evaluate the Psf without holding the lock, so other threads are not blocked
+    std::shared_ptr<Image> image = psf->computeImage(geom::Point2D(static_cast<double>(key.x)/grid,
+                                                                   static_cast<double>(key.y)/grid));
+
+    std::lock_guard<std::mutex> lock(_mutex);
+    if (grid != _subpixelGrid || _entries.count(key) > 0 || _maxSize == 0) {
+        return image;
+    }
+    _order.push_front(key);
+    _entries[key] = Entry{psf, image, _order.begin()};
+    _evict();
+    return image;
+}
+
+void PsfImageCache::_evict() {
+    while (_entries.size() > _maxSize) {
+        _entries.erase(_order.back());
+        _order.pop_back();
+        ++_evictions;
+    }
+}
+
+void PsfImageCache::clear() {
+    std::lock_guard<std::mutex> lock(_mutex);
+    _entries.clear();
+    _order.clear();
+}
+
+std::size_t PsfImageCache::size() const {
+    std::lock_guard<std::mutex> lock(_mutex);
+    return _entries.size();
+}
+
+std::size_t PsfImageCache::getMaxSize() const {
+    std::lock_guard<std::mutex> lock(_mutex);
+    return _maxSize;
+}
+
+void PsfImageCache::setMaxSize(std::size_t maxSize) {
+    std::lock_guard<std::mutex> lock(_mutex);
+    _maxSize = maxSize;
+    _evict();
+}
+
+int PsfImageCache::getSubpixelGrid() const {
+    std::lock_guard<std::mutex> lock(_mutex);
+    return _subpixelGrid;
+}
+
+void PsfImageCache::setSubpixelGrid(int subpixelGrid) {
+    if (subpixelGrid < 1) {
+        throw LSST_EXCEPT(pexExcept::InvalidParameterError, "subpixelGrid must be at least 1");
+    }
+    std::lock_guard<std::mutex> lock(_mutex);
+    if (subpixelGrid != _subpixelGrid) {
+        _subpixelGrid = subpixelGrid;
+        _entries.clear();
+        _order.clear();
+    }
+}
+
+std::size_t PsfImageCache::getHits() const {
+    std::lock_guard<std::mutex> lock(_mutex);
+    return _hits;
+}
+
+std::size_t PsfImageCache::getMisses() const {
+    std::lock_guard<std::mutex> lock(_mutex);
+    return _misses;
+}
+
+std::size_t PsfImageCache::getEvictions() const {
+    std::lock_guard<std::mutex> lock(_mutex);
+    return _evictions;
+}
+
+void PsfImageCache::resetStatistics() {
+    std::lock_guard<std::mutex> lock(_mutex);
+    _hits = 0;
+    _misses = 0;
+    _evictions = 0;
+}
+
+}}} // end of namespace lsst::ip::diffim
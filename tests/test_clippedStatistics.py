@@ -0,0 +1,144 @@
+# This file is part of ip_diffim.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import gc
+import unittest
+
+import numpy as np
+
+import lsst.utils.tests
+import lsst.afw.image as afwImage
+import lsst.geom as geom
+
+from lsst.ip.diffim.clippedStatistics import (ClippedStatisticsConfig, ClippedStatisticsCache,
+                                              computeClippedStatistics)
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class ClippedStatisticsTest(lsst.utils.tests.TestCase):
+    """Test the estimators and the cache used by `computeClippedStatistics`.
+    """
+
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.ignoreMaskPlanes = ("SAT", "BAD")
+        self.mi = afwImage.MaskedImageF(geom.Extent2I(300, 200))
+        arr = rng.normal(loc=10., scale=2., size=(200, 300))
+        # Add some bright outliers, and masked pixels that should be ignored
+        arr[rng.randint(0, 200, 500), rng.randint(0, 300, 500)] += 1000.
+        arr[50:60, 50:60] = -1.e6
+        self.mi.getImage().getArray()[:, :] = arr
+        self.mi.getMask().getArray()[50:60, 50:60] = afwImage.Mask.getPlaneBitMask("BAD")
+        self.cache = ClippedStatisticsCache()
+
+    def tearDown(self):
+        del self.mi
+
+    def testEstimators(self):
+        """Test that the fast estimators agree with the afw MEANCLIP.
+        """
+        stats = {}
+        for method in ("meanclip", "sampled", "histogram"):
+            config = ClippedStatisticsConfig()
+            config.method = method
+            config.maxSamples = 10000
+            stats[method] = computeClippedStatistics(self.mi.getImage(), self.mi.getMask(),
+                                                     self.ignoreMaskPlanes, config, cache=self.cache)
+        self.assertFloatsAlmostEqual(stats["meanclip"].mean, 10., atol=0.02)
+        self.assertFloatsAlmostEqual(stats["sampled"].mean, stats["meanclip"].mean, atol=0.05)
+        self.assertFloatsAlmostEqual(stats["histogram"].mean, stats["meanclip"].mean, atol=0.02)
+        self.assertFloatsAlmostEqual(stats["sampled"].median, stats["meanclip"].median, atol=0.05)
+
+    def testCache(self):
+        """Test that statistics are reused for an owner until it is invalidated
+        or its pixels change.
+        """
+        config = ClippedStatisticsConfig()
+        first = computeClippedStatistics(self.mi.getImage(), self.mi.getMask(), self.ignoreMaskPlanes,
+                                         config, cache=self.cache, owner=self.mi)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+        # A new view of the same pixels of the same owner hits the cache
+        second = computeClippedStatistics(self.mi.getImage(), self.mi.getMask(), self.ignoreMaskPlanes,
+                                          config, cache=self.cache, owner=self.mi)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(first.mean, second.mean)
+
+        # Without an owner, nothing is cached
+        computeClippedStatistics(self.mi.getImage(), self.mi.getMask(), self.ignoreMaskPlanes,
+                                 config, cache=self.cache)
+        self.assertEqual((self.cache.hits, self.cache.misses, len(self.cache)), (1, 1, 1))
+
+        # Setting a mask plane in place recomputes the statistics
+        ignoreMaskPlanes = self.ignoreMaskPlanes + ("DETECTED",)
+        unmasked = computeClippedStatistics(self.mi.getImage(), self.mi.getMask(), ignoreMaskPlanes,
+                                            config, cache=self.cache, owner=self.mi)
+        self.mi.getMask().getArray()[:100, :] |= afwImage.Mask.getPlaneBitMask("DETECTED")
+        self.mi.getImage().getArray()[100:, :] -= 1.
+        masked = computeClippedStatistics(self.mi.getImage(), self.mi.getMask(), ignoreMaskPlanes,
+                                          config, cache=self.cache, owner=self.mi)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 3))
+        self.assertFloatsAlmostEqual(masked.mean, unmasked.mean - 1., atol=0.05)
+
+        # Modifying the pixels in place recomputes the statistics
+        self.mi -= 5.
+        third = computeClippedStatistics(self.mi.getImage(), self.mi.getMask(), self.ignoreMaskPlanes,
+                                         config, cache=self.cache, owner=self.mi)
+        self.assertEqual(self.cache.misses, 4)
+        self.assertFloatsAlmostEqual(third.mean, first.mean - 5.5, atol=0.05)
+
+        # Invalidating an owner drops its entries
+        self.cache.invalidate(self.mi)
+        self.assertEqual(len(self.cache), 0)
+        computeClippedStatistics(self.mi.getImage(), self.mi.getMask(), self.ignoreMaskPlanes,
+                                 config, cache=self.cache, owner=self.mi)
+        self.assertEqual(self.cache.misses, 5)
+
+        # Entries are dropped with their owner
+        owner = self.mi.clone()
+        computeClippedStatistics(owner.getImage(), owner.getMask(), self.ignoreMaskPlanes,
+                                 config, cache=self.cache, owner=owner)
+        self.assertEqual(len(self.cache), 2)
+        del owner
+        gc.collect()
+        self.assertEqual(len(self.cache), 1)
+
+        # Entries are evicted beyond the maximum cache size, with their owner
+        self.cache.maxSize = 1
+        computeClippedStatistics(self.mi.getVariance(), self.mi.getMask(), self.ignoreMaskPlanes,
+                                 config, cache=self.cache, owner=self.mi)
+        self.assertEqual(len(self.cache), 1)
+        owner = self.mi.clone()
+        computeClippedStatistics(owner.getImage(), owner.getMask(), self.ignoreMaskPlanes,
+                                 config, cache=self.cache, owner=owner)
+        self.assertEqual(len(self.cache), 1)
+        self.assertNotIn(id(self.mi), self.cache._owners)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -35,7 +35,7 @@ import lsst.afw.math as afwMath
 import lsst.geom as geom
 from lsst.geom import arcseconds, degrees, radians, arcminutes
 from lsst.ip.diffim.dcrModel import (DcrModel, calculateDcr, calculateImageParallacticAngle,
-                                     applyDcr, wavelengthGenerator)
+                                     applyDcr, fourierShiftKernel, wavelengthGenerator, DcrShiftCache)
 from lsst.obs.base import MakeRawVisitInfoViaObsInfo
 from lsst.meas.algorithms.testUtils import plantSources
 import lsst.utils.tests
@@ -229,6 +229,37 @@ class DcrModelTestTask(lsst.utils.tests.TestCase):
         visitInfo = MakeRawVisitInfoViaObsInfo.observationInfo2visitInfo(obsInfo)
         return visitInfo
 
+    def makeDummyDcrModel(self, elevation=50.*degrees, azimuth=30.*degrees, **kwargs):
+        """Make a DcrModel with a filter, and the metadata of an exposure
+        to build matched templates for.
+
+        Parameters
+        ----------
+        elevation : `lsst.geom.Angle`, optional
+            Elevation angle of the simulated observation.
+        azimuth : `lsst.geom.Angle`, optional
+            Azimuth angle of the simulated observation.
+        **kwargs
+            Additional keyword arguments to pass to ``makeTestImages``.
+
+        Returns
+        -------
+        dcrModels : `lsst.ip.diffim.DcrModel`
+            Model of the simulated sky.
+        visitInfo : `lsst.afw.image.VisitInfo`
+            VisitInfo for the exposure.
+        wcs : `lsst.afw.geom.skyWcs.SkyWcs`
+            A wcs for the exposure.
+        """
+        afwImageUtils.defineFilter("gTest", self.lambdaEff,
+                                   lambdaMin=self.lambdaMin, lambdaMax=self.lambdaMax)
+        filterInfo = afwImage.Filter("gTest")
+        modelImages = self.makeTestImages(**kwargs)
+        dcrModels = DcrModel(modelImages=modelImages, filterInfo=filterInfo, mask=self.mask)
+        visitInfo = self.makeDummyVisitInfo(azimuth, elevation)
+        wcs = self.makeDummyWcs(0.*degrees, 0.2*arcseconds, crval=visitInfo.getBoresightRaDec())
+        return dcrModels, visitInfo, wcs
+
     def testDummyVisitInfo(self):
         """Verify the implementation of the visitInfo used for tests.
         """
@@ -278,6 +309,48 @@ class DcrModelTestTask(lsst.utils.tests.TestCase):
             self.assertFloatsAlmostEqual(shiftOld[1], shiftNew[1], rtol=1e-6, atol=1e-8)
             self.assertFloatsAlmostEqual(shiftOld[0], shiftNew[0], rtol=1e-6, atol=1e-8)
 
+    def testDcrShiftCache(self):
+        """Test that DCR shifts are reused for the same observation, and
+        recalculated for a different observation or coordinate system.
+        """
+        afwImageUtils.defineFilter("gTest", self.lambdaEff,
+                                   lambdaMin=self.lambdaMin, lambdaMax=self.lambdaMax)
+        filterInfo = afwImage.Filter("gTest")
+        pixelScale = 0.2*arcseconds
+        cache = DcrShiftCache()
+        visitInfo = self.makeDummyVisitInfo(30.*degrees, 65.*degrees)
+        wcs = self.makeDummyWcs(0.*degrees, pixelScale, crval=visitInfo.getBoresightRaDec())
+        dcrShift = calculateDcr(visitInfo, wcs, filterInfo, self.dcrNumSubfilters, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        for splitSubfilters in [False, True]:
+            cachedShift = calculateDcr(visitInfo, wcs, filterInfo, self.dcrNumSubfilters,
+                                       splitSubfilters=splitSubfilters, cache=cache)
+            refShift = calculateDcr(visitInfo, wcs, filterInfo, self.dcrNumSubfilters,
+                                    splitSubfilters=splitSubfilters, cache=DcrShiftCache())
+            self.assertFloatsEqual(np.array(cachedShift), np.array(refShift))
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+        # A rotated coordinate system of the same observation reuses the entry
+        rotatedWcs = self.makeDummyWcs(40.*degrees, pixelScale, crval=visitInfo.getBoresightRaDec())
+        rotatedShift = calculateDcr(visitInfo, rotatedWcs, filterInfo, self.dcrNumSubfilters, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+        refShift = calculateDcr(visitInfo, rotatedWcs, filterInfo, self.dcrNumSubfilters,
+                                cache=DcrShiftCache())
+        self.assertFloatsAlmostEqual(np.array(rotatedShift), np.array(refShift), rtol=1e-12, atol=1e-14)
+
+        # A different observation with the same exposure id, or a different
+        # pixel scale, is recalculated
+        visitInfo2 = self.makeDummyVisitInfo(30.*degrees, 50.*degrees)
+        dcrShift2 = calculateDcr(visitInfo2, wcs, filterInfo, self.dcrNumSubfilters, cache=cache)
+        self.assertEqual(cache.misses, 2)
+        self.assertGreater(np.max(np.abs(dcrShift2)), np.max(np.abs(dcrShift)))
+        wcs2 = self.makeDummyWcs(0.*degrees, 2.*pixelScale, crval=visitInfo.getBoresightRaDec())
+        calculateDcr(visitInfo, wcs2, filterInfo, self.dcrNumSubfilters, cache=cache)
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(len(cache), 3)
+        cache.clear()
+        self.assertEqual((len(cache), cache.hits, cache.misses), (0, 0, 0))
+
     def testCoordinateTransformDcrCalculation(self):
         """Check the DCR calculation using astropy coordinate transformations.
 
@@ -350,6 +423,13 @@ class DcrModelTestTask(lsst.utils.tests.TestCase):
                 refImage.image.array[y0 + dy, x0 + dx] = 1.
                 self.assertFloatsAlmostEqual(shiftedImage, refImage.image.array, rtol=1e-12, atol=1e-12)
 
+        # Below the split threshold, the average of the (y, x) shifts at the two wavelengths is applied
+        shift = ((-1., 2.), (-3., 0.))
+        shiftedImage = applyDcr(image, shift, splitSubfilters=True, splitThreshold=10.)
+        refImage = afwImage.MaskedImageF(self.bbox)
+        refImage.image.array[y0 - 2, x0 + 1] = 1.
+        self.assertFloatsAlmostEqual(shiftedImage, refImage.image.array, rtol=1e-12, atol=1e-12)
+
     def testRotationAngle(self):
         """Test that the sky rotation angle is consistently computed.
 
@@ -495,6 +575,74 @@ class DcrModelTestTask(lsst.utils.tests.TestCase):
             self.assertGreater(np.sum(np.abs(refModel.array - templateImage)),
                                np.sum(np.abs(model.array - templateImage)))
 
+    def testFromImage(self):
+        """Test that a model initialized from a coadd divides it between
+        the subfilters, which are views of a single array.
+        """
+        maskedImage = afwImage.MaskedImageF(self.bbox)
+        maskedImage.image.array[:] = self.rng.rand(self.bbox.getHeight(), self.bbox.getWidth())
+        maskedImage.variance.array[:] = 1.
+        dcrModels = DcrModel.fromImage(maskedImage, self.dcrNumSubfilters)
+        self.assertEqual(len(dcrModels), self.dcrNumSubfilters)
+        self.assertEqual(dcrModels.bbox, self.bbox)
+        planes = dcrModels.getPlanes()
+        for model, plane in zip(dcrModels, planes):
+            self.assertFloatsAlmostEqual(model.array, maskedImage.image.array/self.dcrNumSubfilters,
+                                         rtol=1e-6)
+            self.assertTrue(np.shares_memory(model.array, plane))
+        self.assertFloatsAlmostEqual(dcrModels.getReferenceImage(),
+                                     maskedImage.image.array/self.dcrNumSubfilters, rtol=1e-6)
+
+    def testVectorizedRegularization(self):
+        """Test that operating on all subfilter planes at once gives the
+        same result as operating on each plane.
+        """
+        clampFrequency = 2
+        regularizationWidth = 2
+        modelImages = self.makeTestImages(fluxRange=10.)
+        dcrModels = DcrModel(modelImages=modelImages, mask=self.mask)
+        # The getters of a model do not stack its subfilter images
+        referenceImage = dcrModels.getReferenceImage()
+        with self.assertRaises(RuntimeError):
+            dcrModels.getPlanes()
+        planes = dcrModels.stackPlanes()
+        self.assertIs(dcrModels.getPlanes(), planes)
+        self.assertFloatsEqual(dcrModels.getReferenceImage(), referenceImage)
+        self.assertEqual(planes.shape,
+                         (self.dcrNumSubfilters, self.bbox.getHeight(), self.bbox.getWidth()))
+        subBBox = geom.Box2I(self.bbox.getMin() + geom.Extent2I(3, 4), geom.Extent2I(20, 25))
+        for model, plane in zip(dcrModels, dcrModels.getPlanes(subBBox)):
+            self.assertFloatsEqual(model[subBBox].array, plane)
+
+        # Thresholds applied to a stack of images match those applied to each image
+        newPlanes = 3.*planes*self.rng.rand(*planes.shape)
+        refPlanes = newPlanes.copy()
+        dcrModels.applyImageThresholds(newPlanes, highThreshold=2.*referenceImage,
+                                       lowThreshold=referenceImage/2.,
+                                       regularizationWidth=regularizationWidth)
+        for newPlane, refPlane in zip(newPlanes, refPlanes):
+            dcrModels.applyImageThresholds(refPlane, highThreshold=2.*referenceImage,
+                                           lowThreshold=referenceImage/2.,
+                                           regularizationWidth=regularizationWidth)
+            self.assertFloatsEqual(newPlane, refPlane)
+
+        # Regularizing a list of images or a DcrModel gives the same result
+        statsCtrl = self.prepareStats()
+        newModels = [model.clone() for model in dcrModels]
+        newDcrModels = DcrModel([model.clone() for model in dcrModels], mask=self.mask)
+        dcrModels.regularizeModelFreq(newModels, self.bbox, statsCtrl, clampFrequency, regularizationWidth)
+        dcrModels.regularizeModelFreq(newDcrModels, self.bbox, statsCtrl, clampFrequency, regularizationWidth)
+        for newModel, newDcrModel in zip(newModels, newDcrModels):
+            self.assertFloatsEqual(newModel.array, newDcrModel.array)
+        regularizedModels = [newModel.array.copy() for newModel in newModels]
+        dcrModels.conditionDcrModel(newModels, self.bbox, gain=2.)
+        dcrModels.conditionDcrModel(newDcrModels, self.bbox, gain=2.)
+        for model, regularizedModel, newModel, newDcrModel in zip(dcrModels, regularizedModels,
+                                                                  newModels, newDcrModels):
+            self.assertFloatsEqual(newModel.array, newDcrModel.array)
+            self.assertFloatsAlmostEqual(newModel.array, (2.*regularizedModel + model.array)/3.,
+                                         rtol=1e-5, atol=1e-4)
+
     def testRegularizeModelIter(self):
         """Test that large amplitude changes between iterations are restricted.
 
@@ -525,6 +673,282 @@ class DcrModelTestTask(lsst.utils.tests.TestCase):
         lowPix = ndimage.morphology.binary_opening(lowPix, iterations=regularizationWidth)
         self.assertFalse(np.all(lowPix))
 
+    def testPrefilterCache(self):
+        """Test that matched templates built from cached prefiltered planes
+        match shifting each plane directly, and that the cache is invalidated
+        when the model changes.
+        """
+        dcrModels, visitInfo, wcs = self.makeDummyDcrModel()
+        dcrShift = calculateDcr(visitInfo, wcs, dcrModels.filter, len(dcrModels), splitSubfilters=True)
+        for amplifyModel in [1., 3.]:
+            templateImage = dcrModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=self.bbox, wcs=wcs,
+                                                           amplifyModel=amplifyModel)
+            refModel = dcrModels.getReferenceImage(self.bbox)
+            refImage = np.zeros_like(refModel)
+            for model, dcr in zip(dcrModels, dcrShift):
+                refImage += applyDcr((model.array - refModel)*amplifyModel + refModel, dcr,
+                                     splitSubfilters=True)
+            self.assertFloatsAlmostEqual(templateImage.array, refImage, rtol=1e-5, atol=1e-3)
+
+        prefilteredImage = dcrModels.getPrefilteredImage(0, self.bbox)
+        self.assertIs(dcrModels.getPrefilteredImage(0, self.bbox), prefilteredImage)
+        self.assertIs(dcrModels.getPrefilteredImage(-len(dcrModels), self.bbox), prefilteredImage)
+
+        # Replacing a subfilter invalidates only its own planes
+        prefilteredImage1 = dcrModels.getPrefilteredImage(1, self.bbox)
+        newModel = dcrModels[0].clone()
+        newModel.array *= 2.
+        dcrModels[0] = newModel
+        self.assertIs(dcrModels.getPrefilteredImage(1, self.bbox), prefilteredImage1)
+        self.assertFloatsAlmostEqual(dcrModels.getPrefilteredImage(0, self.bbox), 2.*prefilteredImage,
+                                     rtol=1e-6)
+
+        # Assigning to a sub-region invalidates every plane
+        subBBox = geom.Box2I(self.bbox.getMin(), geom.Extent2I(10, 10))
+        dcrModels.assign(DcrModel([model[subBBox].clone() for model in dcrModels]), subBBox)
+        self.assertIsNot(dcrModels.getPrefilteredImage(1, self.bbox), prefilteredImage1)
+
+        # The least recently used planes are evicted to keep the cache within its size in bytes
+        planeBytes = prefilteredImage.nbytes
+        dcrModels.clearCache()
+        dcrModels.prefilterCacheMaxBytes = 2*planeBytes
+        for subfilter in range(len(dcrModels)):
+            dcrModels.getPrefilteredImage(subfilter, self.bbox)
+        self.assertEqual(dcrModels.getPrefilterCacheBytes(), 2*planeBytes)
+        prefilteredImage2 = dcrModels.getPrefilteredImage(2, self.bbox)
+        self.assertIs(dcrModels.getPrefilteredImage(2, self.bbox), prefilteredImage2)
+
+        # Planes larger than the cache are not kept
+        dcrModels.clearCache()
+        dcrModels.prefilterCacheMaxBytes = planeBytes - 1
+        prefilteredImage = dcrModels.getPrefilteredImage(0, self.bbox)
+        self.assertIsNot(dcrModels.getPrefilteredImage(0, self.bbox), prefilteredImage)
+        self.assertEqual(dcrModels.getPrefilterCacheBytes(), 0)
+
+    def testFourierShift(self):
+        """Test that the Fourier shift engine agrees with spline interpolation.
+        """
+        # Integer shifts are exact
+        x0 = 13
+        y0 = 27
+        image = np.zeros((self.bbox.getHeight() + 16, self.bbox.getWidth() + 16))
+        image[y0, x0] = 1.
+        frequencies = (np.fft.fftfreq(image.shape[0]), np.fft.rfftfreq(image.shape[1]))
+        for shift in [(-2, 1), (0, 2), (1, -1)]:
+            kernel = fourierShiftKernel(frequencies, shift)
+            shiftedImage = np.fft.irfft2(np.fft.rfft2(image)*kernel, s=image.shape)
+            refImage = np.zeros_like(image)
+            refImage[y0 + shift[0], x0 + shift[1]] = 1.
+            self.assertFloatsAlmostEqual(shiftedImage, refImage, atol=1e-12)
+            inverseKernel = fourierShiftKernel(frequencies, shift, useInverse=True)
+            self.assertFloatsAlmostEqual(kernel*inverseKernel, np.ones_like(kernel), atol=1e-12)
+
+        # Sub-pixel shifts of well-sampled sources agree with the spline shift
+        dcrModels, visitInfo, wcs = self.makeDummyDcrModel(elevation=40.*degrees, noiseLevel=0.01,
+                                                           sourceSigma=1e4)
+        for amplifyModel in [1., 3.]:
+            splineTemplate = dcrModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=self.bbox, wcs=wcs,
+                                                            amplifyModel=amplifyModel)
+            fourierTemplate = dcrModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=self.bbox, wcs=wcs,
+                                                             amplifyModel=amplifyModel,
+                                                             shiftMethod="fourier")
+            self.assertFloatsAlmostEqual(fourierTemplate.array, splineTemplate.array,
+                                         atol=0.01*np.max(splineTemplate.array))
+            self.assertFloatsAlmostEqual(np.sum(fourierTemplate.array), np.sum(splineTemplate.array),
+                                         rtol=1e-3)
+
+        # Both engines average the shifts of the two wavelengths the same way below the split threshold
+        splineTemplate = dcrModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=self.bbox, wcs=wcs,
+                                                        splitThreshold=1e3)
+        fourierTemplate = dcrModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=self.bbox, wcs=wcs,
+                                                         splitThreshold=1e3, shiftMethod="fourier")
+        self.assertFloatsAlmostEqual(fourierTemplate.array, splineTemplate.array,
+                                     atol=0.01*np.max(splineTemplate.array))
+        midpointTemplate = dcrModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=self.bbox, wcs=wcs,
+                                                          splitSubfilters=False)
+        self.assertFloatsAlmostEqual(splineTemplate.array, midpointTemplate.array,
+                                     atol=0.01*np.max(midpointTemplate.array))
+        with self.assertRaises(ValueError):
+            dcrModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=self.bbox, wcs=wcs, shiftMethod="sinc")
+
+    def testTiledTemplate(self):
+        """Test that shifting the model in tiles on several threads gives
+        the same template as shifting it at once.
+        """
+        dcrModels, visitInfo, wcs = self.makeDummyDcrModel(elevation=35.*degrees)
+        for amplifyModel in [1., 3.]:
+            refTemplate = dcrModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=self.bbox, wcs=wcs,
+                                                         amplifyModel=amplifyModel)
+            for tileSize, numThreads in [(16, 1), (7, 3), (100, 2)]:
+                template = dcrModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=self.bbox, wcs=wcs,
+                                                          amplifyModel=amplifyModel, tileSize=tileSize,
+                                                          numThreads=numThreads)
+                self.assertFloatsAlmostEqual(template.array, refTemplate.array, rtol=1e-6, atol=1e-5)
+
+    def testIncrementalTemplate(self):
+        """Test that incremental templates reuse the shifted subfilters of
+        the previous template only while the shifts are within tolerance.
+        """
+        tolerance = 1e-3
+        dcrModels, visitInfo, wcs = self.makeDummyDcrModel(elevation=50.*degrees)
+        template = dcrModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=self.bbox, wcs=wcs,
+                                                  incrementalTolerance=tolerance)
+        refTemplate = dcrModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=self.bbox, wcs=wcs)
+        self.assertFloatsAlmostEqual(template.array, refTemplate.array, rtol=1e-6, atol=1e-5)
+
+        # A very small change of the elevation reuses every shifted subfilter
+        visitInfo2 = self.makeDummyVisitInfo(30.*degrees, (50. + 1e-5)*degrees)
+        template2 = dcrModels.buildMatchedTemplate(visitInfo=visitInfo2, bbox=self.bbox, wcs=wcs,
+                                                   incrementalTolerance=tolerance)
+        self.assertFloatsEqual(template2.array, template.array)
+
+        # A larger change shifts the subfilters again
+        visitInfo3 = self.makeDummyVisitInfo(30.*degrees, 45.*degrees)
+        template3 = dcrModels.buildMatchedTemplate(visitInfo=visitInfo3, bbox=self.bbox, wcs=wcs,
+                                                   incrementalTolerance=tolerance)
+        refTemplate3 = dcrModels.buildMatchedTemplate(visitInfo=visitInfo3, bbox=self.bbox, wcs=wcs)
+        self.assertFloatsAlmostEqual(template3.array, refTemplate3.array, atol=1e-2)
+        self.assertGreater(np.max(np.abs(template3.array - template.array)), 0.1)
+
+        # Changing the model discards the shifted subfilters
+        newModel = dcrModels[0].clone()
+        newModel.array *= 2.
+        dcrModels[0] = newModel
+        template4 = dcrModels.buildMatchedTemplate(visitInfo=visitInfo3, bbox=self.bbox, wcs=wcs,
+                                                   incrementalTolerance=tolerance)
+        refTemplate4 = dcrModels.buildMatchedTemplate(visitInfo=visitInfo3, bbox=self.bbox, wcs=wcs)
+        self.assertFloatsAlmostEqual(template4.array, refTemplate4.array, rtol=1e-6, atol=1e-5)
+
+    def testBuildMatchedTemplates(self):
+        """Test that templates built in one pass for several exposures match
+        those built for each exposure separately.
+        """
+        dcrModels, visitInfo, wcs = self.makeDummyDcrModel()
+        visitInfo2 = self.makeDummyVisitInfo(120.*degrees, 60.*degrees)
+        subBBox = geom.Box2I(self.bbox.getMin() + geom.Extent2I(8, 6), geom.Extent2I(20, 25))
+        innerBBox = geom.Box2I(subBBox)
+        innerBBox.grow(-5)
+        inputs = [(visitInfo, wcs, self.bbox), (visitInfo2, wcs, self.bbox), (visitInfo2, wcs, subBBox)]
+        for shiftMethod in ["spline", "fourier"]:
+            templates = dcrModels.buildMatchedTemplates(inputs, shiftMethod=shiftMethod)
+            for (visit, visitWcs, bbox), templateImage in zip(inputs, templates):
+                self.assertEqual(templateImage.getBBox(), bbox)
+                # Spline templates share planes prefiltered over the full bbox
+                refBBox = self.bbox if shiftMethod == "spline" else bbox
+                refImage = dcrModels.buildMatchedTemplate(visitInfo=visit, bbox=refBBox, wcs=visitWcs,
+                                                          shiftMethod=shiftMethod)
+                if bbox == refBBox:
+                    self.assertFloatsAlmostEqual(templateImage.array, refImage.array, rtol=1e-6, atol=1e-4)
+                else:
+                    self.assertFloatsAlmostEqual(templateImage[innerBBox].array, refImage[innerBBox].array,
+                                                 atol=1e-2*np.max(refImage.array))
+
+        for (visit, visitWcs, bbox), templateExposure in zip(inputs, dcrModels.buildMatchedExposures(inputs)):
+            self.assertEqual(templateExposure.getBBox(), bbox)
+            self.assertFloatsEqual(templateExposure.mask.array, dcrModels.mask[bbox].array)
+
+    def testMemmapModel(self):
+        """Test a DcrModel with subfilter planes memory-mapped from a file.
+        """
+        dcrModels, visitInfo, wcs = self.makeDummyDcrModel()
+        refTemplate = dcrModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=self.bbox, wcs=wcs)
+        with lsst.utils.tests.getTempFilePath(".npy") as filename:
+            memmapModels = dcrModels.writeMemmap(filename)
+            self.assertEqual(memmapModels.bbox, self.bbox)
+            for model, memmapModel in zip(dcrModels, memmapModels):
+                self.assertFloatsEqual(model.array, memmapModel.array)
+            template = memmapModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=self.bbox, wcs=wcs)
+            self.assertFloatsAlmostEqual(template.array, refTemplate.array, rtol=1e-6, atol=1e-4)
+            self.assertFloatsAlmostEqual(memmapModels.getReferenceImage(), dcrModels.getReferenceImage())
+            # The cached planes take no more memory than the file
+            modelBytes = sum(model.array.nbytes for model in dcrModels)
+            self.assertEqual(memmapModels.prefilterCacheMaxBytes, modelBytes)
+            self.assertGreater(memmapModels.getPrefilterCacheBytes(), 0)
+            self.assertLessEqual(memmapModels.getPrefilterCacheBytes(), modelBytes)
+
+            # Changes to the model are written to the file
+            newModel = memmapModels[1].clone()
+            newModel.array *= 2.
+            memmapModels[1] = newModel
+            subBBox = geom.Box2I(self.bbox.getMin(), geom.Extent2I(10, 10))
+            subModels = [afwImage.ImageF(subBBox) for subfilter in range(len(dcrModels))]
+            for subModel in subModels:
+                subModel.array[:] = 7.
+            memmapModels.assign(DcrModel(subModels), subBBox)
+            memmapModels.flush()
+            reloadedModels = DcrModel.fromMemmap(filename, mask=self.mask, filterInfo=dcrModels.filter)
+            self.assertEqual(reloadedModels.bbox, self.bbox)
+            for model, reloadedModel in zip(memmapModels, reloadedModels):
+                self.assertFloatsEqual(model.array, reloadedModel.array)
+            self.assertFloatsEqual(reloadedModels[0][subBBox].array, 7.)
+            innerBBox = geom.Box2I(self.bbox.getMin() + geom.Extent2I(10, 10), self.bbox.getMax())
+            self.assertFloatsEqual(reloadedModels[1][innerBBox].array, 2.*dcrModels[1][innerBBox].array)
+            del memmapModels, reloadedModels
+
+    def testFromDataRef(self):
+        """Test that subfilters are read lazily, and only within the bbox.
+        """
+        dcrModels, visitInfo, wcs = self.makeDummyDcrModel()
+        dataRef = DummyDcrDataRef(dcrModels)
+        subBBox = geom.Box2I(self.bbox.getMin() + geom.Extent2I(5, 6), geom.Extent2I(20, 25))
+        newModels = DcrModel.fromDataRef(dataRef, numSubfilters=len(dcrModels), bbox=subBBox,
+                                         tract=0, patch="1,1")
+        self.assertEqual(dataRef.reads, [("dcrCoadd_sub", 0, subBBox)])
+        self.assertEqual(len(newModels), len(dcrModels))
+        self.assertEqual(newModels.bbox, subBBox)
+        self.assertEqual(newModels.mask.getBBox(), subBBox)
+        self.assertFloatsEqual(newModels[-1].array, dcrModels[-1][subBBox].array)
+        self.assertEqual(dataRef.reads[-1], ("dcrCoadd_sub", len(dcrModels) - 1, subBBox))
+        for subfilter in range(len(dcrModels)):
+            self.assertFloatsEqual(newModels[subfilter].array, dcrModels[subfilter][subBBox].array)
+        # Each subfilter is read once
+        self.assertEqual(len(dataRef.reads), len(dcrModels))
+
+        template = newModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=subBBox, wcs=wcs)
+        refTemplate = dcrModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=subBBox, wcs=wcs)
+        self.assertFloatsAlmostEqual(template.array, refTemplate.array, rtol=1e-6, atol=1e-5)
+
+        # Reading eagerly without a bbox reads every full subfilter
+        dataRef.reads = []
+        DcrModel.fromDataRef(dataRef, numSubfilters=len(dcrModels), lazy=False)
+        self.assertEqual(dataRef.reads,
+                         [("dcrCoadd", subfilter, None) for subfilter in range(len(dcrModels))])
+
+    def testWorkingPrecision(self):
+        """Test the accuracy of matched templates and reference images built
+        with single precision intermediate arrays.
+        """
+        dcrModels, visitInfo, wcs = self.makeDummyDcrModel()
+        self.assertEqual(dcrModels.workingDtype, np.float64)
+        refModel = dcrModels.getReferenceImage(self.bbox)
+        peak = np.max(np.abs(refModel))
+        kwargList = [dict(), dict(amplifyModel=3.), dict(tileSize=16, numThreads=2),
+                     dict(shiftMethod="fourier", amplifyModel=3.)]
+        refTemplates = [dcrModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=self.bbox, wcs=wcs,
+                                                       **kwargs)
+                        for kwargs in kwargList]
+
+        dcrModels.workingDtype = "float32"
+        self.assertEqual(dcrModels.workingDtype, np.float32)
+        self.assertEqual(dcrModels.getPrefilteredImage(0, self.bbox).dtype, np.float32)
+        self.assertEqual(dcrModels.getFourierImage(0, self.bbox).dtype, np.complex64)
+        for kwargs, refTemplate in zip(kwargList, refTemplates):
+            template = dcrModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=self.bbox, wcs=wcs,
+                                                      **kwargs)
+            # The difference is a few times the float32 resolution of the peak
+            self.assertFloatsAlmostEqual(template.array, refTemplate.array, atol=1e-5*peak)
+        template = dcrModels.buildMatchedTemplate(visitInfo=visitInfo, bbox=self.bbox, wcs=wcs,
+                                                  incrementalTolerance=1e-3)
+        self.assertFloatsAlmostEqual(template.array, refTemplates[0].array, atol=1e-5*peak)
+
+        # The reference image can be accumulated into a preallocated array
+        out = np.empty((self.bbox.getHeight(), self.bbox.getWidth()), dtype=np.float64)
+        self.assertIs(dcrModels.getReferenceImage(self.bbox, out=out), out)
+        self.assertFloatsAlmostEqual(out, refModel, rtol=1e-6, atol=1e-6*peak)
+
+        with self.assertRaises(ValueError):
+            dcrModels.workingDtype = np.int32
+
     def testIterateModel(self):
         """Test that the DcrModel is iterable, and has the right values.
         """
@@ -537,6 +961,34 @@ class DcrModelTestTask(lsst.utils.tests.TestCase):
         self.assertFloatsEqual(refVals[-1], np.sum(dcrModels[-1].array))
 
 
+class DummyDcrDataRef:
+    """A stand-in for a butler data reference to a persisted DcrModel.
+
+    Parameters
+    ----------
+    dcrModels : `lsst.ip.diffim.DcrModel`
+        The model to return subfilters of.
+
+    Attributes
+    ----------
+    reads : `list` of `tuple`
+        The dataset type, subfilter, and bbox of each read.
+    """
+
+    def __init__(self, dcrModels):
+        self.dcrModels = dcrModels
+        self.reads = []
+
+    def get(self, datasetType, subfilter=None, numSubfilters=None, bbox=None, **kwargs):
+        self.reads.append((datasetType, subfilter, bbox))
+        bbox = bbox or self.dcrModels.bbox
+        maskedImage = afwImage.MaskedImageF(self.dcrModels[subfilter][bbox].clone(),
+                                            self.dcrModels.mask[bbox].clone())
+        dcrCoadd = afwImage.ExposureF(maskedImage)
+        dcrCoadd.setFilter(self.dcrModels.filter)
+        return dcrCoadd
+
+
 def calculateAstropyDcr(visitInfo, wcs, filterInfo, dcrNumSubfilters):
     """Calculate the DCR shift using astropy coordinate transformations.
 
@@ -331,6 +331,79 @@ class DipoleAlgorithmTest(lsst.utils.tests.TestCase):
 
         self.assertGreater(source.get("ip_diffim_PsfDipoleFlux_chi2dof"), 0.0)
 
+    def testPsfDipoleFluxPsfImageCache(self):
+        """Test that fits using the Psf image cache agree with fits computing
+        every Psf image, even with a coarse grid of cached positions.
+        """
+        psf, psfSum, exposure, s = createDipole(self.w, self.h, self.xc, self.yc)
+        results = []
+        for usePsfImageCache in (False, True):
+            control = ipDiffim.PsfDipoleFluxControl()
+            control.usePsfImageCache = usePsfImageCache
+            control.psfImageCacheSubpixelGrid = 10
+            plugin, cat = makePluginAndCat(ipDiffim.PsfDipoleFlux, "test", control, centroid="centroid")
+            source = cat.addNew()
+            source.setFootprint(s.getFootprint())
+            plugin.measure(source, exposure)
+            results.append(source)
+        self.assertEqual(ipDiffim.PsfImageCache.getInstance().getSubpixelGrid(), 10)
+        ipDiffim.PsfImageCache.getInstance().setSubpixelGrid(100)
+
+        expected, cached = results
+        for lobe in ("neg", "pos"):
+            key = "test_%s_instFlux" % lobe
+            self.assertFloatsAlmostEqual(cached.get(key), expected.get(key), rtol=1e-2)
+            for coord in ("x", "y"):
+                key = "test_%s_centroid_%s" % (lobe, coord)
+                self.assertFloatsAlmostEqual(cached.get(key), expected.get(key), atol=0.02)
+            self.assertFalse(cached.get("test_%s_flag" % lobe))
+
+    def testPsfDipoleFluxChi2Pixels(self):
+        """Test that the chi2 only includes the unmasked pixels of the footprint.
+        """
+        psf, psfSum, exposure, s = createDipole(self.w, self.h, self.xc, self.yc)
+        control = ipDiffim.PsfDipoleFluxControl()
+        plugin, cat = makePluginAndCat(ipDiffim.PsfDipoleFlux, "test", control, centroid="centroid")
+        source = cat.addNew()
+        fp = s.getFootprint()
+        source.setFootprint(fp)
+        fitParams = (self.xc - 2., self.yc - 2., -1000., self.xc + 2., self.yc + 2., 1000.)
+        chi2, nPix = plugin.chi2(source, exposure, *fitParams)
+        self.assertEqual(nPix, fp.getArea())
+
+        peak = fp.getPeaks()[0]
+        exposure.getMask().getArray()[peak.getIy(), peak.getIx()] |= afwImage.Mask.getPlaneBitMask("BAD")
+        maskedChi2, maskedNPix = plugin.chi2(source, exposure, *fitParams)
+        self.assertEqual(maskedNPix, nPix - 1)
+        self.assertLess(maskedChi2, chi2)
+
+    def testPsfDipoleFluxMeasureAll(self):
+        """Test that fitting a catalog on several threads, with interpolated
+        Psf stamps, agrees with fitting each source on its own.
+        """
+        psf, psfSum, exposure, s = createDipole(self.w, self.h, self.xc, self.yc)
+        control = ipDiffim.PsfDipoleFluxControl()
+        plugin, cat = makePluginAndCat(ipDiffim.PsfDipoleFlux, "test", control, centroid="centroid")
+        expected = cat.addNew()
+        expected.setFootprint(s.getFootprint())
+        plugin.measure(expected, exposure)
+
+        control.psfOversampling = 5
+        plugin, threadedCat = makePluginAndCat(ipDiffim.PsfDipoleFlux, "test", control, centroid="centroid")
+        for i in range(4):
+            source = threadedCat.addNew()
+            source.setFootprint(s.getFootprint())
+        plugin.measureAll(threadedCat, exposure, numThreads=2)
+
+        for source in threadedCat:
+            for lobe in ("neg", "pos"):
+                key = "test_%s_instFlux" % lobe
+                self.assertFloatsAlmostEqual(source.get(key), expected.get(key), rtol=1e-2)
+                for coord in ("x", "y"):
+                    key = "test_%s_centroid_%s" % (lobe, coord)
+                    self.assertFloatsAlmostEqual(source.get(key), expected.get(key), atol=0.02)
+                self.assertFalse(source.get("test_%s_flag" % lobe))
+
     def measureDipole(self, s, exp):
         msConfig = ipDiffim.DipoleMeasurementConfig()
         schema = afwTable.SourceTable.makeMinimalSchema()
@@ -387,6 +460,64 @@ class DipoleMeasurementTaskTest(lsst.utils.tests.TestCase):
         task.run(sources, exposure)
         self.assertEqual(source.get("ip_diffim_ClassificationDipole_value"), 1.0)
 
+    def testPsfImageCacheMetadata(self):
+        """Test that the use of the Psf image cache is recorded in the metadata.
+        """
+        self.config.plugins["ip_diffim_PsfDipoleFlux"].usePsfImageCache = True
+        schema = afwTable.SourceTable.makeMinimalSchema()
+        task = ipDiffim.DipoleMeasurementTask(schema, config=self.config)
+        sources = afwTable.SourceCatalog(afwTable.SourceTable.make(schema))
+        source = sources.addNew()
+        psf, psfSum, exposure, s = createDipole(100, 100, 50, 50)
+        source.setFootprint(s.getFootprint())
+        task.run(sources, exposure)
+        self.assertGreater(task.metadata.getScalar("psfImageCacheMisses"), 0)
+        self.assertGreater(task.metadata.getScalar("psfImageCacheHits"), 0)
+        self.assertEqual(source.get("ip_diffim_ClassificationDipole_value"), 1.0)
+
+    def testParallelMeasure(self):
+        """Test that measuring batches of sources on a process pool gives
+        the same catalog as a serial run, with and without deblended
+        children.
+        """
+        psf, psfSum, exposure, s = createDipole(100, 100, 50, 50)
+        # Parent of each record, sorted by parent as the measurement framework
+        # requires; record 7 is a grandchild of record 1
+        deblendedParents = [0, 0, 0, 1, 1, 2, 4]
+        for parents, batchSize, numBatches in (([0]*5, 2, 3), (deblendedParents, 5, 2)):
+            catalogs = []
+            for numProcesses in (1, 2):
+                config = ipDiffim.DipoleMeasurementConfig()
+                config.numProcesses = numProcesses
+                config.batchSize = batchSize
+                schema = afwTable.SourceTable.makeMinimalSchema()
+                task = ipDiffim.DipoleMeasurementTask(schema, config=config)
+                sources = afwTable.SourceCatalog(afwTable.SourceTable.make(schema))
+                for i, parent in enumerate(parents):
+                    record = sources.addNew()
+                    record.setId(i + 1)
+                    record.setParent(parent)
+                    record.setFootprint(s.getFootprint())
+                if numProcesses > 1 and parents is deblendedParents:
+                    # Every descendant is batched with its top-level ancestor, in catalog order
+                    self.assertEqual(task._makeBatches(sources), [[0, 1, 3, 4, 5, 6], [2]])
+                task.run(sources, exposure)
+                self.assertEqual(task.metadata.getScalar("numBatches"),
+                                 1 if numProcesses == 1 else numBatches)
+                catalogs.append(sources)
+            self._assertCatalogsEqual(*catalogs)
+            self.assertEqual(catalogs[1][0].get("ip_diffim_ClassificationDipole_value"), 1.0)
+
+    def _assertCatalogsEqual(self, serial, parallel):
+        """Assert that two measured catalogs hold the same values.
+        """
+        self.assertEqual(serial.schema.getNames(), parallel.schema.getNames())
+        for name in serial.schema.getNames():
+            for serialRecord, parallelRecord in zip(serial, parallel):
+                np.testing.assert_array_equal(np.asarray(serialRecord.get(name), dtype=float),
+                                              np.asarray(parallelRecord.get(name), dtype=float),
+                                              err_msg=name)
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
@@ -0,0 +1,84 @@
+# This file is part of ip_diffim.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import tempfile
+import unittest
+
+import lsst.utils.tests
+
+from lsst.ip.diffim.dipoleBenchmark import DipoleBenchmarkTask, writeBenchmarkResults
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class DipoleBenchmarkTest(lsst.utils.tests.TestCase):
+    """Test the dipole measurement benchmark on a small image.
+    """
+
+    def setUp(self):
+        self.config = DipoleBenchmarkTask.ConfigClass()
+        self.config.imageSize = 128
+        self.config.sourceDensity = 2.
+        self.config.separation = 2.5
+        self.config.numRepeats = 2
+
+    def tearDown(self):
+        del self.config
+
+    def testMakeTestImage(self):
+        """Test that the dipoles are simulated with the configured density.
+        """
+        task = DipoleBenchmarkTask(config=self.config)
+        testImage, numDipoles = task.makeTestImage()
+        self.assertEqual(numDipoles, 3)
+        self.assertEqual(len(testImage.xcenPos), numDipoles)
+        self.assertEqual(testImage.diffim.getWidth(), self.config.imageSize)
+
+    def testRun(self):
+        """Test that each algorithm is timed and the results written as JSON.
+        """
+        task = DipoleBenchmarkTask(config=self.config)
+        results = task.run().results
+        self.assertEqual(set(results["timings"]), set(self.config.algorithms))
+        self.assertEqual(results["footprints"]["number"], results["numDipoles"])
+        for timing in results["timings"].values():
+            self.assertEqual(len(timing["catalogTime"]["all"]), self.config.numRepeats)
+            self.assertGreater(timing["catalogTime"]["min"], 0.)
+            self.assertGreater(timing["sourceTime"]["median"], 0.)
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            filename = os.path.join(tempDir, "benchmark.json")
+            writeBenchmarkResults(results, filename)
+            with open(filename) as infile:
+                self.assertEqual(json.load(infile), json.loads(json.dumps(results)))
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
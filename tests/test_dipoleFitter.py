@@ -28,9 +28,12 @@ import unittest
 import numpy as np
 
 import lsst.utils.tests
+import lsst.afw.image as afwImage
 import lsst.afw.table as afwTable
+import lsst.geom as geom
 import lsst.meas.base as measBase
-from lsst.ip.diffim.dipoleFitTask import (DipoleFitAlgorithm, DipoleFitTask)
+from lsst.ip.diffim import PsfImageCache
+from lsst.ip.diffim.dipoleFitTask import (DipoleFitAlgorithm, DipoleFitTask, DipoleModel)
 import lsst.ip.diffim.utils as ipUtils
 
 
@@ -123,11 +126,180 @@ class DipoleFitTest(lsst.utils.tests.TestCase):
             self.assertFloatsAlmostEqual(result.negCentroidX, params.xc[i] - offsets[i], rtol=rtol)
             self.assertFloatsAlmostEqual(result.negCentroidY, params.yc[i] - offsets[i], rtol=rtol)
 
-    def _runDetection(self, params):
+    def testDipoleAlgorithmPsfStamp(self):
+        """!Test the dipole fitting algorithm using the cached PSF stamp model
+        and analytic Jacobian.
+
+        Test that the model generated from the stamp matches the one computed
+        from the PSF directly, and that the fit results agree with the
+        default fit and with the input values.
+        """
+        params = DipoleTestImage()
+        catalog = params.testImage.detectDipoleSources(minBinSize=32)
+
+        rtol = params.rtol
+        offsets = params.offsets
+        testImage = params.testImage
+        for i, s in enumerate(catalog):
+            fp = s.getFootprint()
+            psf = testImage.diffim.getPsf()
+            dipoleModel = DipoleModel()
+            xc, yc = params.xc[i] + 0.37, params.yc[i] - 0.81
+            expected = dipoleModel.makeStarModel(fp.getBBox(), psf, xc, yc, 1.).getArray()
+            dipoleModel.setPsfStamp(psf, fp.getCentroid(), oversampling=8)
+            model = dipoleModel.makeStampModel(fp.getBBox(), xc, yc)[0]
+            self.assertFloatsAlmostEqual(model, expected, atol=2e-3*expected.max())
+
+            alg = DipoleFitAlgorithm(testImage.diffim, testImage.posImage, testImage.negImage)
+            result, _ = alg.fitDipole(s, rel_weight=0.5, separateNegParams=False)
+            resultStamp, _ = alg.fitDipole(s, rel_weight=0.5, separateNegParams=False,
+                                           psfStampOversampling=5)
+
+            self.assertFloatsAlmostEqual(resultStamp.posFlux, result.posFlux, rtol=rtol)
+            self.assertFloatsAlmostEqual(resultStamp.posCentroidX, params.xc[i] + offsets[i], rtol=rtol)
+            self.assertFloatsAlmostEqual(resultStamp.posCentroidY, params.yc[i] + offsets[i], rtol=rtol)
+            self.assertFloatsAlmostEqual(resultStamp.negCentroidX, params.xc[i] - offsets[i], rtol=rtol)
+            self.assertFloatsAlmostEqual(resultStamp.negCentroidY, params.yc[i] - offsets[i], rtol=rtol)
+
+    def testDipoleAlgorithmLeastSquares(self):
+        """!Test the scipy least_squares fitting backend.
+
+        Test that it gives the same results as the default lmfit backend,
+        with or without the PSF stamp model, and the same outputs.
+        """
+        params = DipoleTestImage()
+        catalog = params.testImage.detectDipoleSources(minBinSize=32)
+
+        rtol = params.rtol
+        testImage = params.testImage
+        for s in catalog:
+            alg = DipoleFitAlgorithm(testImage.diffim, testImage.posImage, testImage.negImage)
+            result, _ = alg.fitDipole(s, rel_weight=0.5, separateNegParams=True)
+            for oversampling in (0, 5):
+                resultLsq, fitResult = alg.fitDipole(s, rel_weight=0.5, separateNegParams=True,
+                                                     psfStampOversampling=oversampling,
+                                                     fitMethod="leastSquares")
+                self.assertEqual(set(resultLsq.getDict()), set(result.getDict()))
+                self.assertTrue(fitResult.success)
+                for key in ("posFlux", "negFlux", "posCentroidX", "posCentroidY",
+                            "negCentroidX", "negCentroidY", "signalToNoise"):
+                    self.assertFloatsAlmostEqual(getattr(resultLsq, key), getattr(result, key), rtol=rtol)
+                self.assertFloatsAlmostEqual(resultLsq.posFluxErr, result.posFluxErr, rtol=0.1)
+
+    def testDipoleAlgorithmPsfImageCache(self):
+        """!Test that fits using the PSF image cache agree with fits computing
+        every PSF image, even with a coarse grid of cached positions.
+        """
+        params = DipoleTestImage()
+        catalog = params.testImage.detectDipoleSources(minBinSize=32)
+        testImage = params.testImage
+        psf = testImage.diffim.getPsf()
+        # A coarse grid, on which an unshifted model would be piecewise-constant
+        # over 0.1 pixel, and the centroids would not move from their starting values
+        psfImageCache = PsfImageCache(subpixelGrid=10)
+
+        cachedModel = DipoleModel(psfImageCache=psfImageCache)
+        bbox = catalog[0].getFootprint().getBBox()
+        xc, yc = params.xc[0] + 0.037, params.yc[0] - 0.021
+        expected = DipoleModel().makeStarModel(bbox, psf, xc, yc, 1.).getArray()
+        model = cachedModel.makeStarModel(bbox, psf, xc, yc, 1.).getArray()
+        self.assertFloatsAlmostEqual(model, expected, atol=2e-3*expected.max())
+
+        for s in catalog:
+            alg = DipoleFitAlgorithm(testImage.diffim, testImage.posImage, testImage.negImage)
+            result, _ = alg.fitDipole(s, rel_weight=0.5, separateNegParams=True)
+            cachedAlg = DipoleFitAlgorithm(testImage.diffim, testImage.posImage, testImage.negImage,
+                                           psfImageCache=psfImageCache)
+            resultCached, _ = cachedAlg.fitDipole(s, rel_weight=0.5, separateNegParams=True)
+            for key in ("posFlux", "negFlux"):
+                self.assertFloatsAlmostEqual(getattr(resultCached, key), getattr(result, key), rtol=1e-2)
+            for key in ("posCentroidX", "posCentroidY", "negCentroidX", "negCentroidY"):
+                self.assertFloatsAlmostEqual(getattr(resultCached, key), getattr(result, key), atol=0.02)
+        self.assertGreater(psfImageCache.getHits(), 0)
+
+    def testDipoleAlgorithmBadPixels(self):
+        """!Test that the fit only uses the unmasked pixels of the footprint.
+
+        Mask some pixels of each dipole, and check that they are excluded
+        from the fit, which still recovers the input values.
+        """
+        params = DipoleTestImage()
+        catalog = params.testImage.detectDipoleSources(minBinSize=32)
+
+        rtol = params.rtol
+        offsets = params.offsets
+        testImage = params.testImage
+        badBit = testImage.diffim.getMask().getPlaneBitMask("BAD")
+        badBoxes = [geom.Box2I(geom.Point2I(int(xc) + 2, int(yc) - 3), geom.Extent2I(3, 2))
+                    for xc, yc in zip(params.xc, params.yc)]
+        for bad in badBoxes:
+            for exposure in (testImage.diffim, testImage.posImage, testImage.negImage):
+                badMask = afwImage.Mask(exposure.getMask(), bad, afwImage.PARENT)
+                badMask |= badBit
+
+        for i, s in enumerate(catalog):
+            fp = s.getFootprint()
+            bad = badBoxes[i]
+            numBad = sum(fp.contains(geom.Point2I(x, y)) for x in range(bad.getBeginX(), bad.getEndX())
+                         for y in range(bad.getBeginY(), bad.getEndY()))
+            self.assertGreater(numBad, 0)
+
+            alg = DipoleFitAlgorithm(testImage.diffim, testImage.posImage, testImage.negImage)
+            for fitMethod in ("lmfit", "leastSquares"):
+                result, fitResult = alg.fitDipole(s, rel_weight=0.5, separateNegParams=False,
+                                                  badMaskPlanes=["BAD"], fitMethod=fitMethod)
+                self.assertFloatsAlmostEqual((result.posFlux + abs(result.negFlux))/2.,
+                                             params.flux[i], rtol=rtol)
+                self.assertFloatsAlmostEqual(result.posCentroidX, params.xc[i] + offsets[i], rtol=rtol)
+                self.assertFloatsAlmostEqual(result.negCentroidY, params.yc[i] - offsets[i], rtol=rtol)
+
+                # Only the unmasked pixels of the footprint were fit, in each image
+                self.assertEqual(fitResult.pixelMask.shape, (3, fp.getBBox().getHeight(),
+                                                             fp.getBBox().getWidth()))
+                for plane in fitResult.pixelMask:
+                    self.assertEqual(plane.sum(), fp.getArea() - numBad)
+                # Both backends return the fitted pixels only
+                numFit = fitResult.pixelMask.sum()
+                self.assertEqual(np.shape(fitResult.data), (numFit,))
+                self.assertEqual(np.shape(fitResult.best_fit), (numFit,))
+
+    def testFitFootprintBackground(self):
+        """!Test the background fit with cached QR-factorised design matrices
+        against a direct least-squares solution.
+        """
+        params = DipoleTestImage()
+        catalog = params.testImage.detectDipoleSources(minBinSize=32)
+        dipoleModel = DipoleModel()
+        posImage = params.testImage.posImage
+        for s in catalog:
+            bbox = s.getFootprint().getBBox()
+            bbox.grow(3)
+            in_x = dipoleModel._generateXYGrid(bbox)
+            for order in (0, 1, 2):
+                pars = dipoleModel.fitFootprintBackground(s, posImage, order=order)
+                numCached = len(DipoleModel._backgroundQRCache)
+                self.assertFloatsEqual(dipoleModel.fitFootprintBackground(s, posImage, order=order), pars)
+                self.assertEqual(len(DipoleModel._backgroundQRCache), numCached)
+
+                # Compare to a direct solution on the pixels outside the footprint
+                spans = s.getFootprint().getSpans()
+                isBg = np.ones(in_x.shape[1:], dtype=bool)
+                for span in spans:
+                    isBg[span.getY() - bbox.getMinY(), span.getMinX() - bbox.getMinX():
+                         span.getMaxX() - bbox.getMinX() + 1] = False
+                x, y = in_x[1][isBg], in_x[0][isBg]
+                terms = [np.ones_like(x), x, y, x**2, y**2, x*y][:(1, 3, 6)[order]]
+                data = posImage.getMaskedImage().getImage()[bbox].getArray()[isBg]
+                expected = np.linalg.lstsq(np.array(terms).T, data, rcond=-1)[0]
+                self.assertFloatsAlmostEqual(pars, expected, rtol=1e-6, atol=1e-8)
+
+    def _runDetection(self, params, returnTask=False, **pluginConfig):
         """!Run 'diaSource' detection on the diffim, including merging of
         positive and negative sources.
 
-        Then run DipoleFitTask on the image and return the resulting catalog.
+        Then run DipoleFitTask on the image, overriding the DipoleFitPlugin
+        config with `pluginConfig`, and return the resulting catalog (and
+        the task if `returnTask` is set).
         """
 
         # Create the various tasks and schema -- avoid code reuse.
@@ -150,6 +322,8 @@ class DipoleFitTest(lsst.utils.tests.TestCase):
                                        "ip_diffim_NaiveDipoleCentroid",
                                        "ip_diffim_NaiveDipoleFlux",
                                        "ip_diffim_PsfDipoleFlux"]
+        for name, value in pluginConfig.items():
+            setattr(measureConfig.plugins["ip_diffim_DipoleFit"], name, value)
 
         # Here is where we make the dipole fitting task. It can run the other measurements as well.
         # This is an example of how to pass it a custom config.
@@ -166,6 +340,8 @@ class DipoleFitTest(lsst.utils.tests.TestCase):
         fpSet.makeSources(sources)
 
         measureTask.run(sources, testImage.diffim, testImage.posImage, testImage.negImage)
+        if returnTask:
+            return sources, measureTask
         return sources
 
     def _checkTaskOutput(self, params, sources, rtol=None):
@@ -236,6 +412,45 @@ class DipoleFitTest(lsst.utils.tests.TestCase):
         sources = self._runDetection(params)
         self._checkTaskOutput(params, sources)
 
+    def testDipoleTaskThreaded(self):
+        """!Test the batch dipole fit of the catalog with several threads.
+
+        Test that the results are identical to those of the serial fit.
+        """
+        params = DipoleTestImage()
+        sources = self._runDetection(params)
+        sourcesThreaded = self._runDetection(params, numThreads=2)
+        self._checkTaskOutput(params, sourcesThreaded)
+        for r1, r2 in zip(sources, sourcesThreaded):
+            for key in ("pos_instFlux", "neg_instFlux", "pos_centroid_x", "neg_centroid_y", "chi2dof"):
+                self.assertEqual(r1["ip_diffim_DipoleFit_" + key], r2["ip_diffim_DipoleFit_" + key])
+
+    def testDipolePrefilter(self):
+        """!Test the footprint moments used by the dipole prefilter, and that
+        genuine dipoles pass the prefilter and are fit.
+        """
+        params = DipoleTestImage()
+        catalog = params.testImage.detectDipoleSources(minBinSize=32)
+        alg = DipoleFitAlgorithm(params.testImage.diffim)
+        for i, s in enumerate(catalog):
+            moments = alg.computeFootprintMoments(s)
+            self.assertGreater(moments.lobeFluxFraction, 0.3)
+            self.assertFloatsAlmostEqual(moments.separation, 2.*np.sqrt(2.)*abs(params.offsets[i]),
+                                         rtol=0.2)
+
+        sources, task = self._runDetection(params, returnTask=True, doPrefilter=True)
+        self._checkTaskOutput(params, sources)
+        self.assertEqual(task.metadata.get("numDipoleFitsAvoided"), 0)
+        self.assertEqual(task.metadata.get("numDipoleFits"), len(sources))
+
+        # Requiring equal lobes with zero separation rejects every source
+        sources, task = self._runDetection(params, returnTask=True, doPrefilter=True,
+                                           prefilterMinLobeFluxFraction=0.5, maxSeparation=0.)
+        self.assertEqual(task.metadata.get("numDipoleFitsAvoided"), len(sources))
+        for s in sources:
+            self.assertTrue(s.get("ip_diffim_DipoleFit_flag"))
+            self.assertFalse(s.get("ip_diffim_DipoleFit_flag_classificationAttempted"))
+
     def testDipoleTaskNoPosImage(self):
         """!Test the dipole fitting singleFramePlugin in the case where no
         `posImage` is provided. It should be the same as above because
@@ -31,7 +31,9 @@ import lsst.meas.algorithms as measAlg
 import lsst.daf.base as dafBase
 
 from lsst.ip.diffim.imageDecorrelation import (DecorrelateALKernelTask,
+                                               DecorrelateALKernelConfig,
                                                DecorrelateALKernelMapReduceConfig,
+                                               DecorrelateALKernelMapReduceTask,
                                                DecorrelateALKernelSpatialConfig,
                                                DecorrelateALKernelSpatialTask)
 from lsst.ip.diffim.imageMapReduce import ImageMapReduceTask
@@ -347,6 +349,58 @@ class DiffimCorrectionTest(lsst.utils.tests.TestCase):
         # Template variance is higher than that of the science img.
         self._testDiffimCorrection(svar=0.04, tvar=0.08)
 
+    def _testDiffimCorrection_fourierSpace(self, svar, tvar):
+        """Run decorrelation in Fourier space, check the variance of the corrected diffim,
+        and compare it with the diffim decorrelated by convolution in image space.
+        """
+        self._setUpImages(svar=svar, tvar=tvar)
+        diffExp, mKernel, expected_var = self._makeAndTestUncorrectedDiffim()
+        config = DecorrelateALKernelConfig()
+        config.inImageSpace = False
+        task = DecorrelateALKernelTask(config=config)
+        corrected_diffExp = task.run(self.im1ex, self.im2ex, diffExp, mKernel).correctedExposure
+        self._testDecorrelation(expected_var, corrected_diffExp)
+
+        corrected_diffExp_OLD = self._runDecorrelationTask(diffExp, mKernel)
+        # Ignore the edge pixels, which are copied from the input by the image-space convolution
+        border = mKernel.getWidth()
+        inner = (slice(border, -border), slice(border, -border))
+        im = corrected_diffExp.getMaskedImage().getImage().getArray()[inner]
+        im_OLD = corrected_diffExp_OLD.getMaskedImage().getImage().getArray()[inner]
+        self.assertLess(np.std(im - im_OLD), 0.05*np.std(im_OLD))
+        var = corrected_diffExp.getMaskedImage().getVariance().getArray()[inner]
+        var_OLD = corrected_diffExp_OLD.getMaskedImage().getVariance().getArray()[inner]
+        self.assertFloatsAlmostEqual(np.mean(var), np.mean(var_OLD), rtol=0.02)
+
+    def testDiffimCorrection_fourierSpace(self):
+        """Test decorrelated diffim when applying the decorrelation filter in Fourier space.
+        """
+        self._testDiffimCorrection_fourierSpace(svar=0.04, tvar=0.04)
+        self._testDiffimCorrection_fourierSpace(svar=0.08, tvar=0.04)
+        self._testDiffimCorrection_fourierSpace(svar=0.04, tvar=0.08)
+
+    def testDiffimCorrection_fourierSpacePreConv(self):
+        """Test that decorrelation with a pre-convolution kernel gives the same
+        diffim in Fourier space as in image space.
+        """
+        self._setUpImages(svar=0.04, tvar=0.04)
+        diffExp, mKernel, expected_var = self._makeAndTestUncorrectedDiffim()
+        preConvKernel = afwMath.FixedKernel(self.im1ex.getPsf().computeKernelImage())
+        results = []
+        for inImageSpace in [True, False]:
+            config = DecorrelateALKernelConfig()
+            config.inImageSpace = inImageSpace
+            task = DecorrelateALKernelTask(config=config)
+            results.append(task.run(self.im1ex, self.im2ex, diffExp, mKernel,
+                                    preConvKernel=preConvKernel).correctedExposure)
+        # Ignore the edge pixels, which are copied from the input by the image-space convolution
+        border = max(mKernel.getWidth(), preConvKernel.getWidth())
+        inner = (slice(border, -border), slice(border, -border))
+        im_OLD, im = [exp.getMaskedImage().getImage().getArray()[inner] for exp in results]
+        self.assertLess(np.std(im - im_OLD), 0.01*np.std(im_OLD))
+        var_OLD, var = [exp.getMaskedImage().getVariance().getArray()[inner] for exp in results]
+        self.assertFloatsAlmostEqual(np.mean(var), np.mean(var_OLD), rtol=0.01)
+
     def _runDecorrelationTaskMapReduced(self, diffExp, mKernel):
         """ Run decorrelation using the imageMapReducer.
         """
@@ -383,6 +437,25 @@ class DiffimCorrectionTest(lsst.utils.tests.TestCase):
         # Template variance is higher than that of the science img.
         self._testDiffimCorrection_mapReduced(svar=0.08, tvar=0.04)
 
+    def testDiffimCorrection_mapReducedThreaded(self):
+        """Test that decorrelating the sub-images on multiple threads gives the same
+        diffim as doing so serially, and that the cell timings are recorded.
+        """
+        self._setUpImages(svar=0.04, tvar=0.04, varyPsf=0.1)
+        diffExp, mKernel, expected_var = self._makeAndTestUncorrectedDiffim()
+        corrected_diffExp = self._runDecorrelationTaskMapReduced(diffExp, mKernel)
+
+        config = DecorrelateALKernelMapReduceConfig()
+        config.borderSizeX = config.borderSizeY = 3
+        config.reducer.reduceOperation = 'average'
+        config.numThreads = 4
+        task = DecorrelateALKernelMapReduceTask(config=config)
+        decorrResult = task.run(diffExp, template=self.im2ex, science=self.im1ex,
+                                psfMatchingKernel=mKernel, forceEvenSized=True)
+        self.assertMaskedImagesAlmostEqual(decorrResult.exposure.getMaskedImage(),
+                                           corrected_diffExp.getMaskedImage())
+        self.assertEqual(len(task.metadata.getArray("cellRunTime")), len(task.boxes0))
+
     def _runDecorrelationSpatialTask(self, diffExp, mKernel, spatiallyVarying=False):
         """ Run decorrelation using the DecorrelateALKernelSpatialTask.
         """
@@ -421,6 +494,70 @@ class DiffimCorrectionTest(lsst.utils.tests.TestCase):
         # Template variance is higher than that of the science img.
         self._testDiffimCorrection_spatialTask(svar=0.08, tvar=0.04)
 
+    def _testDiffimCorrection_interpolatedKernels(self, svar, tvar, varyPsf=0.0):
+        """Run spatially-varying decorrelation with the interpolated decorrelation kernel,
+        check the variance of the corrected diffim, and compare it with that from the
+        default (ImageMapReduce-based) spatially-varying decorrelation. Also check the
+        interpolated kernel at a control point against the kernel computed there.
+        """
+        self._setUpImages(svar=svar, tvar=tvar, varyPsf=varyPsf)
+        diffExp, mKernel, expected_var = self._makeAndTestUncorrectedDiffim()
+        variances = []
+        results = []
+        for doInterpolateKernels in [False, True]:
+            config = DecorrelateALKernelSpatialConfig()
+            config.doInterpolateKernels = doInterpolateKernels
+            task = DecorrelateALKernelSpatialTask(config=config)
+            decorrResult = task.run(scienceExposure=self.im1ex, templateExposure=self.im2ex,
+                                    subtractedExposure=diffExp, psfMatchingKernel=mKernel,
+                                    spatiallyVarying=True)
+            var, mn = self._testDecorrelation(expected_var, decorrResult.correctedExposure)
+            variances.append(var)
+            results.append(decorrResult)
+        self.assertFloatsAlmostEqual(variances[0], variances[1], rtol=0.03)
+
+        # Ignore the edge pixels, which are copied from the input by the convolution
+        border = mKernel.getWidth()
+        inner = (slice(border, -border), slice(border, -border))
+        im_OLD, im = [result.correctedExposure.getMaskedImage().getImage().getArray()[inner]
+                      for result in results]
+        good = np.isfinite(im) & np.isfinite(im_OLD)
+        self.assertGreater(np.sum(good), 0.9*good.size)
+        self.assertLess(np.std(im[good] - im_OLD[good]), 0.05*np.std(im_OLD[good]))
+
+        # The interpolated kernel reproduces the kernel computed at a control point
+        bbox = diffExp.getBBox()
+        cellWidth = bbox.getWidth() / config.controlPointsX
+        cellHeight = bbox.getHeight() / config.controlPointsY
+        ix, iy = 1, 2
+        cellBBox = geom.Box2I(geom.Point2I(bbox.getMinX() + int(ix*cellWidth),
+                                           bbox.getMinY() + int(iy*cellHeight)),
+                              geom.Point2I(bbox.getMinX() + int((ix + 1)*cellWidth) - 1,
+                                           bbox.getMinY() + int((iy + 1)*cellHeight) - 1))
+        center = geom.Box2D(cellBBox).getCenter()
+        mKernelImg = afwImage.ImageD(mKernel.getDimensions())
+        mKernel.computeImage(mKernelImg, True, center.getX(), center.getY())
+        localSvar = task.computeVarianceMean(self.im1ex.Factory(self.im1ex, cellBBox), subImage=True)
+        localTvar = task.computeVarianceMean(self.im2ex.Factory(self.im2ex, cellBBox), subImage=True)
+        expected = DecorrelateALKernelTask._computeDecorrelationKernel(mKernelImg.getArray().copy(),
+                                                                      localSvar, localTvar)
+        corrKernel = results[1].correctionKernel
+        kimg = afwImage.ImageD(corrKernel.getDimensions())
+        corrKernel.computeImage(kimg, False, center.getX(), center.getY())
+        kernel = kimg.getArray()
+        dy, dx = (expected.shape[0] - kernel.shape[0]) // 2, (expected.shape[1] - kernel.shape[1]) // 2
+        expected = expected[dy:dy + kernel.shape[0], dx:dx + kernel.shape[1]]
+        self.assertEqual(np.unravel_index(np.argmax(kernel), kernel.shape),
+                         np.unravel_index(np.argmax(expected), expected.shape))
+        self.assertFloatsAlmostEqual(kernel, expected, atol=0.01*np.max(np.abs(expected)))
+
+    def testDiffimCorrection_interpolatedKernels(self):
+        """Test decorrelated diffim when interpolating the decorrelation kernel between
+           control points. Compare results with those from the map-reduced decorrelation.
+        """
+        self._testDiffimCorrection_interpolatedKernels(svar=0.04, tvar=0.04)
+        self._testDiffimCorrection_interpolatedKernels(svar=0.04, tvar=0.08, varyPsf=0.1)
+
 
 class MemoryTester(lsst.utils.tests.MemoryTestCase):
     pass
@@ -416,6 +416,40 @@ class ImageMapReduceTest(lsst.utils.tests.TestCase):
         with self.assertRaises(TypeError):
             task.run(self.exposure)
 
+    def testAdaptiveGrid(self):
+        """Test that the adaptive grid only refines cells where the kernel varies.
+        """
+        config = AddAmountImageMapReduceConfig()
+        config.reducer.reduceOperation = 'average'
+        config.scaleByFwhm = False
+        config.doAdaptiveGrid = True
+        config.cellSizeX = config.cellSizeY = 64.
+        config.minCellSizeX = config.minCellSizeY = 8.
+
+        # The exposure PSF is constant, so the coarse tiling is not refined
+        task = ImageMapReduceTask(config)
+        task._generateGrid(self.exposure)
+        self.assertEqual(len(task.boxes0), 4)
+
+        # A kernel that varies across the image in x
+        basisList = [afwMath.AnalyticKernel(15, 15, afwMath.GaussianFunction2D(sigma, sigma))
+                     for sigma in (2., 4.)]
+        kernel = afwMath.LinearCombinationKernel(basisList, afwMath.PolynomialFunction2D(1))
+        kernel.setSpatialParameters([[1., 0., 0.], [0., 1./128., 0.]])
+        task = ImageMapReduceTask(config)
+        newExp = task.run(self.exposure, psfMatchingKernel=kernel).exposure
+        self.assertGreater(len(task.boxes0), 4)
+        for box in task.boxes0:
+            self.assertGreaterEqual(box.getWidth(), 8)
+            self.assertGreaterEqual(box.getHeight(), 8)
+            self.assertLessEqual(box.getWidth(), 64)
+            self.assertLessEqual(box.getHeight(), 64)
+
+        newArr = newExp.getMaskedImage().getImage().getArray()
+        self.assertEqual(np.sum(np.isnan(newArr)), 0)
+        mi = self.exposure.getMaskedImage().getImage().getArray()
+        self.assertFloatsAlmostEqual(mi, newArr - config.mapper.addAmount)
+
     def testGridValidity(self):
         """Test sample grids with various spacings and sizes and other options.
         """
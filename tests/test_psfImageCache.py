@@ -0,0 +1,107 @@
+# This file is part of ip_diffim.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+import lsst.utils.tests
+import lsst.geom as geom
+import lsst.meas.algorithms as measAlg
+import lsst.pex.exceptions as pexExcept
+
+from lsst.ip.diffim import PsfImageCache
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+class PsfImageCacheTest(lsst.utils.tests.TestCase):
+    """Test the Psf image cache shared by the dipole algorithms.
+    """
+
+    def setUp(self):
+        self.psf = measAlg.DoubleGaussianPsf(17, 17, 2.0, 3.5, 0.1)
+        self.cache = PsfImageCache(maxSize=3, subpixelGrid=10)
+
+    def tearDown(self):
+        del self.psf
+        del self.cache
+
+    def testComputeImage(self):
+        """Test that cached images are those of the Psf at the rounded position.
+        """
+        image = self.cache.computeImage(self.psf, geom.Point2D(20.32, 30.77))
+        expected = self.psf.computeImage(geom.Point2D(20.3, 30.8))
+        self.assertImagesAlmostEqual(image, expected)
+        self.assertEqual((self.cache.getHits(), self.cache.getMisses()), (0, 1))
+
+        # Positions rounding to the same grid point hit the cache
+        self.cache.computeImage(self.psf, geom.Point2D(20.28, 30.84))
+        self.assertEqual((self.cache.getHits(), self.cache.getMisses()), (1, 1))
+
+        # A different Psf at the same position does not
+        other = self.psf.clone()
+        self.cache.computeImage(other, geom.Point2D(20.32, 30.77))
+        self.assertEqual((self.cache.getHits(), self.cache.getMisses()), (1, 2))
+        self.assertEqual(len(self.cache), 2)
+
+    def testEviction(self):
+        """Test that the least recently used images are evicted.
+        """
+        points = [geom.Point2D(10. + i, 10.) for i in range(4)]
+        for point in points[:3]:
+            self.cache.computeImage(self.psf, point)
+        self.cache.computeImage(self.psf, points[0])
+        self.cache.computeImage(self.psf, points[3])
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(self.cache.getEvictions(), 1)
+
+        # points[1] was the least recently used
+        self.cache.resetStatistics()
+        self.cache.computeImage(self.psf, points[0])
+        self.cache.computeImage(self.psf, points[1])
+        self.assertEqual((self.cache.getHits(), self.cache.getMisses()), (1, 1))
+
+        self.cache.setMaxSize(1)
+        self.assertEqual(len(self.cache), 1)
+        self.cache.setSubpixelGrid(4)
+        self.assertEqual(len(self.cache), 0)
+        with self.assertRaises(pexExcept.InvalidParameterError):
+            self.cache.setSubpixelGrid(0)
+
+    def testInstance(self):
+        """Test that the process-wide cache is shared.
+        """
+        maxSize = PsfImageCache.getInstance().getMaxSize()
+        try:
+            PsfImageCache.getInstance().setMaxSize(maxSize + 1)
+            self.assertEqual(PsfImageCache.getInstance().getMaxSize(), maxSize + 1)
+        finally:
+            PsfImageCache.getInstance().setMaxSize(maxSize)
+
+
+class MemoryTester(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()